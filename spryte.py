@@ -11,6 +11,7 @@ gi.require_version("GdkPixbuf", "2.0")
 
 from gi.repository import Gio
 from gi.repository import Gtk
+from gi.repository import GLib
 
 import src
 from src import ToolPalette
@@ -20,6 +21,8 @@ from src import Statusbar
 from src import FilesNotebook
 from src.utils import FileChooserManager
 from src.utils import FileManagement
+from src.history import HistoryJournal
+from src.preview import PreviewWindow
 
 
 class SpryteApp(Gtk.Application):
@@ -41,6 +44,9 @@ class SpryteApp(Gtk.Application):
             # Edit
             ("undo", "app.undo", ["<Primary>Z"], self.undo),
             ("redo", "app.redo", ["<Primary><Shift>Z", "<Primary>Y"], self.redo),
+
+            # View
+            ("preview", "app.preview", ["<Primary>P"], self.preview),
         ]
 
         for name, detailed_name, accesls, callback in actions:
@@ -96,6 +102,9 @@ class SpryteApp(Gtk.Application):
     def redo(self, action, param):
         self.get_current_window().redo()
 
+    def preview(self, action, param):
+        self.get_current_window().preview()
+
 
 class SpryteWindow(Gtk.ApplicationWindow):
 
@@ -106,7 +115,23 @@ class SpryteWindow(Gtk.ApplicationWindow):
 
         self.headerbar = HeaderBar()
         self.headerbar.connect("tool-size-changed", self._tool_size_changed_cb)
+        self.headerbar.connect("brush-shape-changed", self._brush_shape_changed_cb)
+        self.headerbar.connect("brush-from-selection", self._brush_from_selection_cb)
         self.headerbar.connect("layout-size-changed", self._layout_size_changed_cb)
+        self.headerbar.connect("journal-changed", self._journal_changed_cb)
+        self.headerbar.connect("indexed-changed", self._indexed_changed_cb)
+        self.headerbar.connect("fill-connectivity-changed", self._fill_connectivity_changed_cb)
+        self.headerbar.connect("replace-tolerance-changed", self._replace_tolerance_changed_cb)
+        self.headerbar.connect("replace-scope-changed", self._replace_scope_changed_cb)
+        self.headerbar.connect("adjustment-changed", self._adjustment_changed_cb)
+        self.headerbar.connect("adjustment-amount-changed", self._adjustment_amount_changed_cb)
+        self.headerbar.connect("adjust-colors", self._adjust_colors_cb)
+        self.headerbar.connect("dither-pattern-changed", self._dither_pattern_changed_cb)
+        self.headerbar.connect("dither-level-changed", self._dither_level_changed_cb)
+        self.headerbar.connect("pattern-from-selection", self._pattern_from_selection_cb)
+        self.headerbar.connect("symmetry-mode-changed", self._symmetry_mode_changed_cb)
+        self.headerbar.connect("symmetry-folds-changed", self._symmetry_folds_changed_cb)
+        self.headerbar.connect("symmetry-center-changed", self._symmetry_center_changed_cb)
         self.set_titlebar(self.headerbar)
 
         self.box = Gtk.Box()
@@ -136,15 +161,72 @@ class SpryteWindow(Gtk.ApplicationWindow):
 
         self.show_all()
 
+        GLib.idle_add(self._recover_journals_cb)
+
     def get_current_cavases_notebook(self):
         return self.files_notebook.get_current_notebook()
 
     def _tool_size_changed_cb(self, headerbar, size):
         self.get_current_cavases_notebook().set_tool_size(size)
 
+    def _brush_shape_changed_cb(self, headerbar, shape):
+        self.get_current_cavases_notebook().set_brush_shape(shape)
+
+    def _brush_from_selection_cb(self, headerbar):
+        self.get_current_cavases_notebook().use_selection_as_brush()
+
     def _layout_size_changed_cb(self, headerbar, size):
         self.get_current_cavases_notebook().set_layout_size(size)
 
+    def _journal_changed_cb(self, headerbar, enabled):
+        self.get_current_cavases_notebook().set_journal(enabled)
+
+    def _indexed_changed_cb(self, headerbar, indexed):
+        self.get_current_cavases_notebook().set_indexed(indexed)
+
+    def _fill_connectivity_changed_cb(self, headerbar, connectivity):
+        self.get_current_cavases_notebook().set_fill_connectivity(connectivity)
+
+    def _replace_tolerance_changed_cb(self, headerbar, tolerance):
+        self.get_current_cavases_notebook().set_replace_tolerance(tolerance)
+
+    def _replace_scope_changed_cb(self, headerbar, scope):
+        self.get_current_cavases_notebook().set_replace_scope(scope)
+
+    def _adjustment_changed_cb(self, headerbar, adjustment):
+        self.get_current_cavases_notebook().set_adjustment(adjustment)
+
+    def _adjustment_amount_changed_cb(self, headerbar, amount):
+        self.get_current_cavases_notebook().set_adjustment_amount(amount)
+
+    def _adjust_colors_cb(self, headerbar):
+        self.get_current_cavases_notebook().adjust_colors()
+
+    def _dither_pattern_changed_cb(self, headerbar, pattern):
+        self.get_current_cavases_notebook().set_dither_pattern(pattern)
+
+    def _dither_level_changed_cb(self, headerbar, level):
+        self.get_current_cavases_notebook().set_dither_level(level)
+
+    def _pattern_from_selection_cb(self, headerbar):
+        self.get_current_cavases_notebook().use_selection_as_pattern()
+
+    def _symmetry_mode_changed_cb(self, headerbar, mode):
+        self.get_current_cavases_notebook().set_symmetry_mode(mode)
+
+    def _symmetry_folds_changed_cb(self, headerbar, folds):
+        self.get_current_cavases_notebook().set_symmetry_folds(folds)
+
+    def _symmetry_center_changed_cb(self, headerbar, center):
+        self.get_current_cavases_notebook().set_symmetry_center(center)
+
+    def _recover_journals_cb(self):
+        sessions = HistoryJournal.find_orphans()
+        if len(sessions) > 0:
+            self.recover(sessions)
+
+        return GLib.SOURCE_REMOVE
+
     def _tool_changed_cb(self, palette, tool):
         self.get_current_cavases_notebook().set_tool(tool)
 
@@ -196,6 +278,7 @@ class SpryteWindow(Gtk.ApplicationWindow):
         FileManagement.save(pixelmaps, file)
 
         self.get_current_cavases_notebook().set_file(file, refresh=False)
+        self.get_current_cavases_notebook().mark_saved()
         self.files_notebook.set_filename(os.path.basename(file))
 
         return True
@@ -212,12 +295,38 @@ class SpryteWindow(Gtk.ApplicationWindow):
         notebook = self.files_notebook.get_current_notebook()
         self.files_notebook.remove_page(notebook)
 
+    def recover(self, sessions):
+        dialog = Gtk.MessageDialog(self, 0, Gtk.MessageType.QUESTION,
+                                   Gtk.ButtonsType.YES_NO,
+                                   "Spryte no se cerró correctamente")
+        dialog.format_secondary_text("¿Recuperar los cambios sin guardar?")
+
+        response = dialog.run()
+        dialog.destroy()
+
+        for paths in sessions:
+            if response != Gtk.ResponseType.YES:
+                for path in paths:
+                    # Solo se borra si el proceso sigue sin existir
+                    if HistoryJournal.is_orphan(path) and os.path.exists(path):
+                        os.remove(path)
+
+                continue
+
+            self.files_notebook.append_page()
+            self.get_current_cavases_notebook().recover_journals(paths)
+
     def undo(self):
         self.get_current_cavases_notebook().undo()
 
     def redo(self):
         self.get_current_cavases_notebook().redo()
 
+    def preview(self):
+        window = PreviewWindow(self.get_current_cavases_notebook(),
+                               transient_for=self)
+        window.show_all()
+
 
 if __name__ == "__main__":
     import signal
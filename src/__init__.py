@@ -1,9 +1,27 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from .tool_palette import ToolPalette
-from .headerbar import HeaderBar
-from .canvas import CanvasContainer
-from .statusbar import Statusbar
-from .canvases_notebook import CanvasesNotebook
-from .files_notebook import FilesNotebook
\ No newline at end of file
+import importlib
+
+# utils.py importa canvas.py al final, así que tiene que importarse primero
+from . import utils
+
+# Los widgets se importan recién cuando se usan, así canvas.py, history.py
+# y los demás se pueden importar (por ejemplo, en los tests) sin abrir
+# ninguna ventana
+_WIDGETS = {
+    "ToolPalette": "tool_palette",
+    "HeaderBar": "headerbar",
+    "CanvasContainer": "canvas",
+    "Statusbar": "statusbar",
+    "CanvasesNotebook": "canvases_notebook",
+    "FilesNotebook": "files_notebook",
+}
+
+
+def __getattr__(name):
+    if name not in _WIDGETS:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+    module = importlib.import_module("." + _WIDGETS[name], __name__)
+    return getattr(module, name)
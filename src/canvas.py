@@ -4,10 +4,19 @@
 from __future__ import division
 from __future__ import print_function
 
+import math
+import cairo
+import numpy
+import weakref
+
 from PIL import Image
 
-from .utils import Color, ToolType, PaintAlgorithms, FileManagement
-from .tools import TOOLS
+from .utils import Color, ToolType, BrushShape, ReplaceScope, ColorAdjustment, DitherPattern, PaintAlgorithms, FileManagement
+from .tools import TOOLS, Tool
+from .history import History, HistoryStep, ReplaceStep, DurationStep, HistoryJournal
+from .renderer import SurfaceCache, PatternCache, RedrawScheduler, render_mask, upload_region
+from .selection import Selection, SelectionMode
+from .symmetry import Symmetry, SymmetryMode
 
 from gi.repository import Gtk
 from gi.repository import Gdk
@@ -23,142 +32,1209 @@ class Pixel(object):
         self.color = color
 
 
+class TempLayer(object):
+    """
+    Capa de píxeles temporales (lo que se está pintando y todavía no se
+    guardó en el PixelMap). Se guarda en tiles de TILE_SIZE x TILE_SIZE
+    que se crean a medida que se pintan, cada uno con su máscara de
+    píxeles modificados, y se lleva la cuenta del rectángulo que los
+    contiene. Vaciar la capa no depende de cuántos píxeles tenga.
+
+    Trabaja con coordenadas que empiezan en 0.
+    """
+
+    TILE_SIZE = 64
+
+    def __init__(self):
+        self._tiles = {}
+        self.bounds = None
+
+    def is_empty(self):
+        return len(self._tiles) == 0
+
+    def _tile(self, tx, ty, create=False):
+        tile = self._tiles.get((tx, ty), None)
+        if tile is None and create:
+            size = self.TILE_SIZE
+            tile = (numpy.zeros((size, size, 4), dtype=numpy.uint8),
+                    numpy.zeros((size, size), dtype=bool))
+
+            self._tiles[(tx, ty)] = tile
+
+        return tile
+
+    def _extend_bounds(self, x0, y0, x1, y1):
+        if self.bounds is None:
+            self.bounds = (x0, y0, x1, y1)
+
+        else:
+            bx0, by0, bx1, by1 = self.bounds
+            self.bounds = (min(bx0, x0), min(by0, y0), max(bx1, x1), max(by1, y1))
+
+    def get(self, x, y):
+        size = self.TILE_SIZE
+        tile = self._tile(x // size, y // size)
+        if tile is None or not tile[1][y % size, x % size]:
+            return None
+
+        return tile[0][y % size, x % size]
+
+    def put(self, x, y, values):
+        size = self.TILE_SIZE
+        data, mask = self._tile(x // size, y // size, create=True)
+        data[y % size, x % size] = values
+        mask[y % size, x % size] = True
+
+        self._extend_bounds(x, y, x + 1, y + 1)
+
+    def write(self, x0, y0, values, mask):
+        """
+        Escribe values donde mask es True. Igual que en
+        PixelMap.set_temp_pixel_color, un píxel transparente no reemplaza
+        a uno temporal que no lo es.
+        """
+
+        size = self.TILE_SIZE
+        height, width = mask.shape
+        x1, y1 = x0 + width, y0 + height
+
+        ys, xs = numpy.nonzero(mask)
+        if len(xs) == 0:
+            return
+
+        for ty in range(y0 // size, (y1 - 1) // size + 1):
+            for tx in range(x0 // size, (x1 - 1) // size + 1):
+                ax0, ay0 = max(x0, tx * size), max(y0, ty * size)
+                ax1, ay1 = min(x1, (tx + 1) * size), min(y1, (ty + 1) * size)
+
+                src = (slice(ay0 - y0, ay1 - y0), slice(ax0 - x0, ax1 - x0))
+                _mask = mask[src]
+                if not _mask.any():
+                    continue
+
+                dst = (slice(ay0 - ty * size, ay1 - ty * size),
+                       slice(ax0 - tx * size, ax1 - tx * size))
+
+                data, tile_mask = self._tile(tx, ty, create=True)
+                _values = values[src]
+
+                keep = tile_mask[dst] & (data[dst][:, :, Color.ALPHA] != 0) & \
+                       (_values[:, :, Color.ALPHA] == 0)
+                _mask = _mask & ~keep
+
+                data[dst][_mask] = _values[_mask]
+                tile_mask[dst] |= _mask
+
+        self._extend_bounds(x0 + int(xs.min()), y0 + int(ys.min()),
+                            x0 + int(xs.max()) + 1, y0 + int(ys.max()) + 1)
+
+    def read(self, x0, y0, x1, y1):
+        """
+        Devuelve los valores y la máscara de la región, o None si no hay
+        píxeles temporales en ella.
+        """
+
+        if self.bounds is None:
+            return None
+
+        bx0, by0, bx1, by1 = self.bounds
+        if bx0 >= x1 or by0 >= y1 or bx1 <= x0 or by1 <= y0:
+            return None
+
+        size = self.TILE_SIZE
+        values = numpy.zeros((y1 - y0, x1 - x0, 4), dtype=numpy.uint8)
+        mask = numpy.zeros((y1 - y0, x1 - x0), dtype=bool)
+
+        for ty in range(y0 // size, (y1 - 1) // size + 1):
+            for tx in range(x0 // size, (x1 - 1) // size + 1):
+                tile = self._tile(tx, ty)
+                if tile is None:
+                    continue
+
+                ax0, ay0 = max(x0, tx * size), max(y0, ty * size)
+                ax1, ay1 = min(x1, (tx + 1) * size), min(y1, (ty + 1) * size)
+
+                dst = (slice(ay0 - y0, ay1 - y0), slice(ax0 - x0, ax1 - x0))
+                src = (slice(ay0 - ty * size, ay1 - ty * size),
+                       slice(ax0 - tx * size, ax1 - tx * size))
+
+                values[dst] = tile[0][src]
+                mask[dst] = tile[1][src]
+
+        return values, mask
+
+    def delete(self, x, y):
+        size = self.TILE_SIZE
+        tile = self._tile(x // size, y // size)
+        if tile is not None:
+            tile[1][y % size, x % size] = False
+
+    def tiles(self):
+        """
+        Itera sobre los tiles, devolviendo tuplas (x, y, data, mask) donde
+        (x, y) es la esquina superior izquierda del tile.
+        """
+
+        size = self.TILE_SIZE
+        for (tx, ty), (data, mask) in self._tiles.items():
+            yield tx * size, ty * size, data, mask
+
+    def crop(self, width, height):
+        size = self.TILE_SIZE
+        for (tx, ty) in list(self._tiles.keys()):
+            if tx * size >= width or ty * size >= height:
+                del self._tiles[(tx, ty)]
+                continue
+
+            mask = self._tiles[(tx, ty)][1]
+            mask[:, max(width - tx * size, 0):] = False
+            mask[max(height - ty * size, 0):, :] = False
+
+        if self.bounds is not None:
+            x0, y0, x1, y1 = self.bounds
+            self.bounds = (x0, y0, min(x1, width), min(y1, height))
+
+    def clear(self):
+        self._tiles = {}
+        self.bounds = None
+
+    def copy(self):
+        layer = TempLayer()
+        layer._tiles = {key: (data.copy(), mask.copy())
+                        for key, (data, mask) in self._tiles.items()}
+        layer.bounds = self.bounds
+
+        return layer
+
+
+class DamageTracker(object):
+    """
+    Acumula el rectángulo (x0, y0, x1, y1), en coordenadas que empiezan en
+    0, que cambió en un PixelMap desde la última vez que se consultó. Ver
+    PixelMap.track_damage.
+    """
+
+    def __init__(self):
+        self.rect = None
+
+    def add(self, x0, y0, x1, y1):
+        if self.rect is None:
+            self.rect = (x0, y0, x1, y1)
+
+        else:
+            rx0, ry0, rx1, ry1 = self.rect
+            self.rect = (min(rx0, x0), min(ry0, y0), max(rx1, x1), max(ry1, y1))
+
+    def pop(self):
+        rect = self.rect
+        self.rect = None
+
+        return rect
+
+
 class PixelMap(object):
+    """
+    Guarda los píxeles en un array de numpy de tamaño (alto, ancho, 4)
+    con valores RGBA de 0 a 255. Las coordenadas que recibe la API son las
+    mismas que usa Canvas: empiezan en 1, así que el píxel (x, y) se guarda
+    en self._data[y - 1, x - 1].
+
+    Las subclases que cambian la forma de guardar los píxeles solo tienen
+    que reimplementar los métodos _get, _put, _read, _write, _resize_storage,
+    chunks y copy, que trabajan con coordenadas que empiezan en 0 y ya
+    recortadas a los límites del PixelMap.
+
+    copy() no copia los píxeles: la copia comparte el array con el
+    original hasta que alguno de los dos lo modifica (copy-on-write).
+
+    Encima de los píxeles temporales hay una vista previa (ver
+    set_preview) que usan las herramientas que dibujan una figura
+    mientras se arrastra el mouse.
+
+    Los cambios visibles (incluidos los de los píxeles temporales) se
+    informan a los DamageTracker creados con track_damage, así quien
+    dibuja el PixelMap puede actualizar solo lo que cambió.
+    """
+
+    # A partir de este área PixelMap.new devuelve un TiledPixelMap
+    MAX_DENSE_AREA = 1024 * 1024
+
+    # Cuánto se muestra el frame en una animación, en milisegundos
+    DEFAULT_DURATION = 250
+    MIN_DURATION = 10  # Igual que en los GIF
+
+    # Si los colores se guardan en una paleta, ver IndexedPixelMap
+    indexed = False
 
     def __init__(self, width=48, height=48):
-        self.width = width
-        self.height = height
+        self._width = width
+        self._height = height
 
-        self.pixels = []
-        self.temp_pixels = []
+        self._data = numpy.zeros((height, width, 4), dtype=numpy.uint8)
+        self._shared = False
+        self._temp = TempLayer()
+        self._preview = None
+        self._trackers = weakref.WeakSet()
+        self.duration = PixelMap.DEFAULT_DURATION
 
     def __iter__(self):
         return self
 
     def __contains__(self, obj):
-        for pixel in self.pixels:
-            if pixel.x == obj[0] and pixel.y == obj[1]:
-                return True
+        x, y = obj
+        if not self._in_bounds(x, y):
+            return False
 
-        return False
+        return self._get(x - 1, y - 1)[Color.ALPHA] != 0
 
     @classmethod
-    def new_from_image(self, image):
-        pixelmap = PixelMap()
-        pixelmap.width, pixelmap.height = image.width, image.height
+    def new(self, width, height, indexed=False):
+        if width * height > PixelMap.MAX_DENSE_AREA:
+            return TiledPixelMap(width, height)
+
+        elif indexed:
+            return IndexedPixelMap(width, height)
+
+        return PixelMap(width, height)
+
+    @classmethod
+    def new_from_image(self, image, indexed=False):
+        pixelmap = self.new(image.width, image.height, indexed=indexed)
         pixelmap.load_data_from_image(image)
 
         return pixelmap
 
+    @property
+    def width(self):
+        return self._width
+
+    @width.setter
+    def width(self, value):
+        self._resize(value, self._height)
+
+    @property
+    def height(self):
+        return self._height
+
+    @height.setter
+    def height(self, value):
+        self._resize(self._width, value)
+
+    @property
+    def pixels(self):
+        # Solo se mantiene por compatibilidad, los objetos Pixel que
+        # devuelve son copias, modificarlos no cambia el PixelMap
+        pixels = []
+        for cx, cy, data in self.chunks():
+            ys, xs = numpy.nonzero(data[:, :, Color.ALPHA])
+            pixels.extend(Pixel(cx + x, cy + y, Color.array_to_cairo(data[y, x]))
+                          for y, x in zip(ys.tolist(), xs.tolist()))
+
+        return pixels
+
+    @property
+    def temp_pixels(self):
+        pixels = []
+        for tx, ty, data, mask in self._temp.tiles():
+            ys, xs = numpy.nonzero(mask)
+            pixels.extend(Pixel(tx + x + 1, ty + y + 1, Color.array_to_cairo(data[y, x]))
+                          for y, x in zip(ys.tolist(), xs.tolist()))
+
+        return pixels
+
+    def _in_bounds(self, x, y):
+        return 0 < x <= self._width and 0 < y <= self._height
+
+    def _damage(self, x0, y0, x1, y1):
+        for tracker in self._trackers:
+            tracker.add(x0, y0, x1, y1)
+
+    def _damage_all(self):
+        self._damage(0, 0, self._width, self._height)
+
+    def track_damage(self):
+        """
+        Devuelve un DamageTracker que acumula las regiones que cambian
+        desde ahora. Deja de actualizarse cuando no quedan referencias a él.
+        """
+
+        tracker = DamageTracker()
+        self._trackers.add(tracker)
+
+        return tracker
+
+    def _get(self, x, y):
+        return self._data[y, x]
+
+    def _detach(self):
+        if self._shared:
+            self._data = self._data.copy()
+            self._shared = False
+
+    def _put(self, x, y, values):
+        self._detach()
+        self._data[y, x] = values
+
+    def _read(self, x0, y0, x1, y1):
+        return self._data[y0:y1, x0:x1].copy()
+
+    def _write(self, x0, y0, values, mask=None):
+        self._detach()
+
+        height, width = values.shape[:2]
+        target = self._data[y0:y0 + height, x0:x0 + width]
+
+        if mask is None:
+            target[:] = values
+
+        else:
+            numpy.copyto(target, values, where=mask[:, :, None])
+
+    def _resize_storage(self, width, height):
+        data = numpy.zeros((height, width, 4), dtype=numpy.uint8)
+        h = min(height, self._height)
+        w = min(width, self._width)
+        data[:h, :w] = self._data[:h, :w]
+
+        self._data = data
+        self._shared = False
+
+    def _resize(self, width, height):
+        if (width, height) == (self._width, self._height):
+            return
+
+        self._resize_storage(width, height)
+        self._width = width
+        self._height = height
+
+        self._temp.crop(width, height)
+        self._damage_all()
+
+    def _clip_region(self, x, y, width, height):
+        """
+        Recorta la región (en coordenadas que empiezan en 1) a los límites
+        del PixelMap. Devuelve los slices para el PixelMap y los slices
+        equivalentes dentro de un array de tamaño (height, width), o None
+        si la región queda completamente afuera.
+        """
+
+        x0 = max(x - 1, 0)
+        y0 = max(y - 1, 0)
+        x1 = min(x - 1 + width, self._width)
+        y1 = min(y - 1 + height, self._height)
+
+        if x0 >= x1 or y0 >= y1:
+            return None
+
+        dst = (slice(y0, y1), slice(x0, x1))
+        src = (slice(y0 - (y - 1), y1 - (y - 1)),
+               slice(x0 - (x - 1), x1 - (x - 1)))
+
+        return dst, src
+
+    def chunks(self):
+        """
+        Itera sobre los bloques de píxeles que tienen memoria asignada,
+        devolviendo tuplas (x, y, data) donde (x, y) es la esquina superior
+        izquierda del bloque. data es de solo lectura.
+        """
+
+        yield 1, 1, self._data
+
     def get_pixel_at(self, x, y):
-        for pixel in self.pixels:
-            if pixel.x == x and pixel.y == y:
-                return pixel
+        color = self.get_pixel_color(x, y)
+        if color[Color.ALPHA] == 0:
+            return None
 
-        return None
+        return Pixel(x, y, color)
 
     def get_temp_pixel_at(self, x, y):
-        for pixel in self.temp_pixels:
-            if pixel.x == x and pixel.y == y:
-                return pixel
+        if not self._in_bounds(x, y):
+            return None
 
-        return None
+        values = self._temp.get(x - 1, y - 1)
+        if values is None:
+            return None
 
-    def get_pixel_color(self, x, y):
-        pixel = self.get_pixel_at(x, y)
-        if pixel is not None:
-            return pixel.color
+        return Pixel(x, y, Color.array_to_cairo(values))
 
-        else:
+    def get_pixel_color(self, x, y):
+        if not self._in_bounds(x, y):
             return Color.TRANSPARENT
 
+        return Color.array_to_cairo(self._get(x - 1, y - 1))
+
     def set_pixel_color(self, x, y, color):
-        if x <= 0 or x > self.width or y <= 0 or y > self.height:
+        if not self._in_bounds(x, y):
             return
 
-        pixel = self.get_pixel_at(x, y)
-        if pixel is None and color[Color.ALPHA] != 0:
-            pixel = Pixel(x, y, color)
-            self.pixels.append(pixel)
-
-        elif color[Color.ALPHA] != 0:
-            pixel.color = color
-
-        elif color[Color.ALPHA] == 0:
-            self.delete_pixel_at(x, y)
+        self._put(x - 1, y - 1, Color.cairo_to_array(color))
+        self._damage(x - 1, y - 1, x, y)
 
     def get_temp_pixel_color(self, x, y):
         pixel = self.get_temp_pixel_at(x, y)
-        if pixel is not None:
-            return pixel.color
-
-        else:
+        if pixel is None:
             return Color.TRANSPARENT
 
+        return pixel.color
+
     def set_temp_pixel_color(self, x, y, color):
-        if x <= 0 or x > self.width or y <= 0 or y > self.height:
+        if not self._in_bounds(x, y):
             return
 
-        pixel = self.get_temp_pixel_at(x, y)
-        if pixel is None:
-            if self.get_pixel_at(x, y) is None and color[Color.ALPHA] == 0:
+        current = self._temp.get(x - 1, y - 1)
+        if current is None:
+            if color[Color.ALPHA] == 0 and (x, y) not in self:
                 return
 
-            pixel = Pixel(x, y, color)
-            self.temp_pixels.append(pixel)
+            self._temp.put(x - 1, y - 1, Color.cairo_to_array(color))
 
         elif color[Color.ALPHA] != 0:
-            pixel.color = color
+            self._temp.put(x - 1, y - 1, Color.cairo_to_array(color))
+
+        else:
+            return
+
+        self._damage(x - 1, y - 1, x, y)
+
+    def get_temp_bounds(self):
+        """
+        Devuelve el rectángulo (x, y, ancho, alto) que contiene a todos los
+        píxeles temporales, o None si no hay ninguno.
+        """
+
+        if self._temp.bounds is None:
+            return None
+
+        x0, y0, x1, y1 = self._temp.bounds
+        return x0 + 1, y0 + 1, x1 - x0, y1 - y0
+
+    def set_temp_region(self, x, y, data, mask=None):
+        """
+        Igual que set_region, pero escribe en la capa de píxeles temporales.
+        """
+
+        height, width = data.shape[:2]
+        clip = self._clip_region(x, y, width, height)
+        if clip is None:
+            return
+
+        (ys, xs), src = clip
+        values = numpy.array(data[src], dtype=numpy.uint8)
+        values[values[:, :, Color.ALPHA] == 0] = 0
+
+        if mask is None:
+            _mask = numpy.ones(values.shape[:2], dtype=bool)
+
+        else:
+            _mask = mask[src]
+
+        self._temp.write(xs.start, ys.start, values, _mask)
+        self._damage(xs.start, ys.start, xs.stop, ys.stop)
+
+    def fill_temp_region(self, x, y, mask, color):
+        height, width = mask.shape
+        data = numpy.empty((height, width, 4), dtype=numpy.uint8)
+        data[:] = Color.cairo_to_array(color)
+        self.set_temp_region(x, y, data, mask)
+
+    def get_region(self, x, y, width, height):
+        """
+        Devuelve una copia de la región como un array (height, width, 4)
+        de uint8. Lo que quede fuera del PixelMap es transparente.
+        """
+
+        region = numpy.zeros((height, width, 4), dtype=numpy.uint8)
+        clip = self._clip_region(x, y, width, height)
+        if clip is not None:
+            (ys, xs), src = clip
+            region[src] = self._read(xs.start, ys.start, xs.stop, ys.stop)
+
+        return region
+
+    def set_region(self, x, y, data, mask=None):
+        """
+        Copia un array (alto, ancho, 4) de uint8 en la posición (x, y).
+        Si se pasa mask (un array de booleanos de (alto, ancho)), solo se
+        escriben los píxeles donde mask es True.
+        """
+
+        height, width = data.shape[:2]
+        clip = self._clip_region(x, y, width, height)
+        if clip is None:
+            return
+
+        (ys, xs), src = clip
+        values = numpy.array(data[src], dtype=numpy.uint8)
+        values[values[:, :, Color.ALPHA] == 0] = 0
+
+        self._write(xs.start, ys.start, values,
+                    None if mask is None else mask[src])
+        self._damage(xs.start, ys.start, xs.stop, ys.stop)
+
+    def fill_region(self, x, y, mask, color):
+        """
+        Pinta con color todos los píxeles donde mask es True, con mask
+        ubicada en la posición (x, y).
+        """
+
+        height, width = mask.shape
+        clip = self._clip_region(x, y, width, height)
+        if clip is None:
+            return
+
+        # Sin copiar el color en un array del tamaño de la región
+        (ys, xs), src = clip
+        values = numpy.broadcast_to(Color.cairo_to_array(color),
+                                    (ys.stop - ys.start, xs.stop - xs.start, 4))
+
+        self._write(xs.start, ys.start, values, mask[src])
+        self._damage(xs.start, ys.start, xs.stop, ys.stop)
+
+    def get_visible_region(self, x, y, width, height):
+        """
+        Igual que get_region, pero con los píxeles temporales encima, que
+        es lo que se ve en el canvas.
+        """
+
+        region = self.get_region(x, y, width, height)
+        clip = self._clip_region(x, y, width, height)
+        if clip is None:
+            return region
+
+        (ys, xs), src = clip
+        temp = self._temp.read(xs.start, ys.start, xs.stop, ys.stop)
+        if temp is not None:
+            values, mask = temp
+            region[src][mask] = values[mask]
+
+        if self._preview is not None:
+            px, py, mask, values = self._preview
+            height, width = mask.shape
+
+            # Intersección de la vista previa con la región
+            x0, y0 = max(xs.start, px), max(ys.start, py)
+            x1, y1 = min(xs.stop, px + width), min(ys.stop, py + height)
+            if x0 < x1 and y0 < y1:
+                src = (slice(y0 - py, y1 - py), slice(x0 - px, x1 - px))
+                dst = region[y0 - y + 1:y1 - y + 1, x0 - x + 1:x1 - x + 1]
+                dst[mask[src]] = values[src][mask[src]]
+
+        return region
+
+    def set_preview(self, x, y, mask, color):
+        """
+        Reemplaza la vista previa por los píxeles donde mask es True,
+        pintados con color, con mask ubicada en la posición (x, y). Solo se
+        redibuja la unión de la vista previa anterior y la nueva.
+        """
+
+        values = numpy.broadcast_to(Color.cairo_to_array(color), mask.shape + (4,))
+        self.set_preview_region(x, y, values, mask)
+
+    def set_preview_region(self, x, y, data, mask):
+        """
+        Igual que set_preview, pero con los colores de cada píxel dados en
+        un array (alto, ancho, 4) de uint8.
+        """
+
+        self.clear_preview()
+
+        self._preview = (x - 1, y - 1, mask, data)
+        self._damage_preview()
+
+    def clear_preview(self):
+        if self._preview is None:
+            return
+
+        self._damage_preview()
+        self._preview = None
+
+    def _damage_preview(self):
+        x, y, mask, values = self._preview
+        height, width = mask.shape
+        self._damage(max(x, 0), max(y, 0),
+                     min(x + width, self._width), min(y + height, self._height))
+
+    def apply_preview(self):
+        """
+        Pasa la vista previa a los píxeles temporales, así se guarda
+        junto con ellos en untemp_pixels.
+        """
+
+        if self._preview is None:
+            return
+
+        x, y, mask, values = self._preview
+        self.set_temp_region(x + 1, y + 1, values, mask)
+
+        self.clear_preview()
+
+    def to_array(self):
+        array = numpy.zeros((self._height, self._width, 4), dtype=numpy.uint8)
+        for x, y, data in self.chunks():
+            height, width = data.shape[:2]
+            array[y - 1:y - 1 + height, x - 1:x - 1 + width] = data
+
+        return array
 
     def delete_pixel_at(self, x, y):
-        for pixel in self.pixels:
-            if pixel.x == x and pixel.y == y:
-                del self.pixels[self.pixels.index(pixel)]
-                break
+        self.set_pixel_color(x, y, Color.TRANSPARENT)
 
     def delete_temp_pixel(self, pixel):
-        del self.temp_pixels[self.temp_pixels.index(pixel)]
+        self.delete_temp_pixel_at(pixel.x, pixel.y)
 
     def delete_temp_pixel_at(self, x, y):
-        for pixel in self.temp_pixels:
-            if pixel.x == x and pixel.y == y:
-                self.delete_temp_pixel(pixel)
-                break
+        if self._in_bounds(x, y):
+            self._temp.delete(x - 1, y - 1)
+            self._damage(x - 1, y - 1, x, y)
 
     def delete_temp_pixels(self):
-        while len(self.temp_pixels) > 0:
-            self.delete_temp_pixel(self.temp_pixels[0])
+        if self._temp.bounds is not None:
+            self._damage(*self._temp.bounds)
+
+        self._temp.clear()
+
+    def untemp_pixels(self, step=None):
+        """
+        Guarda los píxeles temporales en el PixelMap. Si se pasa step (un
+        HistoryStep), se le agregan los píxeles que cambiaron.
+        """
 
-    def untemp_pixels(self):
-        for pixel in self.temp_pixels:
-            self.set_pixel_color(pixel.x, pixel.y, pixel.color)
+        # Un solo set_region con máscara por cada tile de la capa temporal
+        size = TempLayer.TILE_SIZE
+        for x, y, data, mask in self._temp.tiles():
+            if step is not None:
+                after = data.copy()
+                after[after[:, :, Color.ALPHA] == 0] = 0
+                before = self.get_region(x + 1, y + 1, size, size)
+
+                changed = mask & (before != after).any(axis=2)
+                step.add(x + 1, y + 1, changed, before[changed], after[changed])
+
+            self.set_region(x + 1, y + 1, data, mask)
 
         self.delete_temp_pixels()
 
-    def load_data_from_image(self, image):
-        self.pixels = []
+    def clear(self):
+        self._data = numpy.zeros_like(self._data)
+        self._shared = False
+        self._damage_all()
 
+    def load_data_from_array(self, array):
+        height, width = array.shape[:2]
+        self._resize(width, height)
+        self.clear()
+        self.set_region(1, 1, array)
+
+    def load_data_from_image(self, image):
         image = image.convert("RGBA")
+        self.load_data_from_array(numpy.asarray(image, dtype=numpy.uint8))
+
+    def copy(self):
+        pixelmap = PixelMap(0, 0)
+        pixelmap._width, pixelmap._height = self._width, self._height
+        pixelmap._data = self._data
+        pixelmap._temp = self._temp.copy()
+        pixelmap.duration = self.duration
+
+        self._shared = pixelmap._shared = True
+
+        return pixelmap
+
+    def is_empty(self):
+        for x, y, data in self.chunks():
+            if data[:, :, Color.ALPHA].any():
+                return False
+
+        return True
+
+    @property
+    def nbytes(self):
+        # Memoria que ocupan los píxeles (sin contar los temporales)
+        return self._data.nbytes
+
+    def get_bounds(self):
+        """
+        Devuelve el rectángulo (x, y, ancho, alto) que contiene a todos los
+        píxeles que no son transparentes, o None si no hay ninguno.
+        """
+
+        x0 = y0 = x1 = y1 = None
+        for x, y, data in self.chunks():
+            alpha = data[:, :, Color.ALPHA]
+            rows = numpy.nonzero(alpha.any(axis=1))[0]
+            if len(rows) == 0:
+                continue
+
+            columns = numpy.nonzero(alpha.any(axis=0))[0]
+            _x0, _y0 = x + int(columns[0]), y + int(rows[0])
+            _x1, _y1 = x + int(columns[-1]) + 1, y + int(rows[-1]) + 1
+
+            if x0 is None:
+                x0, y0, x1, y1 = _x0, _y0, _x1, _y1
+
+            else:
+                x0, y0 = min(x0, _x0), min(y0, _y0)
+                x1, y1 = max(x1, _x1), max(y1, _y1)
+
+        if x0 is None:
+            return None
+
+        return x0, y0, x1 - x0, y1 - y0
+
+
+class TiledPixelMap(PixelMap):
+    """
+    PixelMap dividido en tiles de TILE_SIZE x TILE_SIZE que solo se crean
+    cuando se pinta algo en ellos (y se liberan cuando vuelven a quedar
+    vacíos), así la memoria depende del área pintada y no del tamaño del
+    sprite. Pensado para sprites de hasta 8192x8192.
+
+    Al copiarlo se comparten todos los tiles, y cada uno se duplica recién
+    cuando se modifica.
+    """
+
+    TILE_SIZE = 64
+
+    def __init__(self, width=48, height=48):
+        self._width = width
+        self._height = height
+
+        self._tiles = {}
+        self._shared = set()
+        self._temp = TempLayer()
+        self._preview = None
+        self._trackers = weakref.WeakSet()
+        self.duration = PixelMap.DEFAULT_DURATION
+
+    def _tile_range(self, start, stop):
+        return range(start // self.TILE_SIZE, (stop - 1) // self.TILE_SIZE + 1)
 
-        for x in range(0, image.size[0]):
-            for y in range(0, image.size[1]):
-                r, g, b, a = image.getpixel((x, y))
+    def _new_tile(self):
+        return numpy.zeros((self.TILE_SIZE, self.TILE_SIZE, 4), dtype=numpy.uint8)
 
-                if a == 0:
+    def _writable_tile(self, key):
+        tile = self._tiles.get(key, None)
+        if tile is not None and key in self._shared:
+            tile = self._tiles[key] = tile.copy()
+            self._shared.discard(key)
+
+        return tile
+
+    def _delete_tile(self, key):
+        del self._tiles[key]
+        self._shared.discard(key)
+
+    def _get(self, x, y):
+        size = self.TILE_SIZE
+        tile = self._tiles.get((x // size, y // size), None)
+        if tile is None:
+            return numpy.zeros(4, dtype=numpy.uint8)
+
+        return tile[y % size, x % size]
+
+    def _put(self, x, y, values):
+        size = self.TILE_SIZE
+        key = (x // size, y // size)
+        tile = self._writable_tile(key)
+
+        if tile is None:
+            if values[Color.ALPHA] == 0:
+                return
+
+            tile = self._tiles[key] = self._new_tile()
+
+        tile[y % size, x % size] = values
+
+        if values[Color.ALPHA] == 0 and not tile[:, :, Color.ALPHA].any():
+            self._delete_tile(key)
+
+    def _read(self, x0, y0, x1, y1):
+        size = self.TILE_SIZE
+        region = numpy.zeros((y1 - y0, x1 - x0, 4), dtype=numpy.uint8)
+
+        for ty in self._tile_range(y0, y1):
+            for tx in self._tile_range(x0, x1):
+                tile = self._tiles.get((tx, ty), None)
+                if tile is None:
                     continue
 
-                color = Color.rgba_to_cairo((r, g, b, a))
-                self.pixels.append(Pixel(x + 1, y + 1, color))
+                ax0, ay0 = max(x0, tx * size), max(y0, ty * size)
+                ax1, ay1 = min(x1, (tx + 1) * size), min(y1, (ty + 1) * size)
+                region[ay0 - y0:ay1 - y0, ax0 - x0:ax1 - x0] = \
+                    tile[ay0 - ty * size:ay1 - ty * size, ax0 - tx * size:ax1 - tx * size]
+
+        return region
+
+    def _write(self, x0, y0, values, mask=None):
+        size = self.TILE_SIZE
+        height, width = values.shape[:2]
+        x1, y1 = x0 + width, y0 + height
+
+        for ty in self._tile_range(y0, y1):
+            for tx in self._tile_range(x0, x1):
+                ax0, ay0 = max(x0, tx * size), max(y0, ty * size)
+                ax1, ay1 = min(x1, (tx + 1) * size), min(y1, (ty + 1) * size)
+
+                src = (slice(ay0 - y0, ay1 - y0), slice(ax0 - x0, ax1 - x0))
+                dst = (slice(ay0 - ty * size, ay1 - ty * size),
+                       slice(ax0 - tx * size, ax1 - tx * size))
+
+                _values = values[src]
+                _mask = None if mask is None else mask[src]
+                opaque = _values[:, :, Color.ALPHA] != 0
+                if _mask is not None:
+                    opaque &= _mask
+
+                tile = self._writable_tile((tx, ty))
+                if tile is None:
+                    if not opaque.any():
+                        # Escribir píxeles transparentes en un tile que no
+                        # existe no cambia nada
+                        continue
+
+                    tile = self._tiles[(tx, ty)] = self._new_tile()
+
+                if _mask is None:
+                    tile[dst] = _values
+
+                else:
+                    numpy.copyto(tile[dst], _values, where=_mask[:, :, None])
+
+                if not opaque.all() and not tile[:, :, Color.ALPHA].any():
+                    self._delete_tile((tx, ty))
+
+    def _resize_storage(self, width, height):
+        size = self.TILE_SIZE
+        for (tx, ty) in list(self._tiles.keys()):
+            if tx * size >= width or ty * size >= height:
+                self._delete_tile((tx, ty))
+                continue
+
+            if (tx + 1) * size <= width and (ty + 1) * size <= height:
+                continue
+
+            # Borro lo que quede fuera del nuevo tamaño dentro de los tiles
+            # del borde, para que no reaparezca si se vuelve a agrandar
+            tile = self._writable_tile((tx, ty))
+            tile[:, max(width - tx * size, 0):] = 0
+            tile[max(height - ty * size, 0):, :] = 0
+
+            if not tile[:, :, Color.ALPHA].any():
+                self._delete_tile((tx, ty))
+
+    def chunks(self):
+        size = self.TILE_SIZE
+        for (tx, ty), tile in self._tiles.items():
+            width = min(size, self._width - tx * size)
+            height = min(size, self._height - ty * size)
+            yield tx * size + 1, ty * size + 1, tile[:height, :width]
+
+    def clear(self):
+        self._tiles = {}
+        self._shared = set()
+        self._damage_all()
+
+    @property
+    def nbytes(self):
+        return sum(tile.nbytes for tile in self._tiles.values())
 
     def copy(self):
-        pixelmap = PixelMap(self.width, self.height)
-        pixelmap.pixels = self.pixels.copy()
-        pixelmap.temp_pixels = self.temp_pixels.copy()
+        pixelmap = TiledPixelMap(self._width, self._height)
+        pixelmap._tiles = self._tiles.copy()
+        pixelmap._temp = self._temp.copy()
+        pixelmap.duration = self.duration
+
+        self._shared = set(self._tiles.keys())
+        pixelmap._shared = set(self._shared)
 
         return pixelmap
 
+
+class IndexedPixelMap(PixelMap):
+    """
+    PixelMap de colores indexados: por cada píxel se guarda un índice
+    (uint8, o uint16 si hay más de 256 colores) a una paleta de colores
+    RGBA. El índice 0 siempre es el color transparente.
+
+    Cambiar un color de la paleta recolorea todos los píxeles que lo
+    usan sin tener que recorrerlos. Igual que en PixelMap, las copias
+    comparten los índices hasta que se modifican.
+
+    Si un cambio necesita más de MAX_COLORS colores, se convierte en un
+    PixelMap común (ver _make_dense) en vez de fallar.
+    """
+
+    MAX_COLORS = 65536
+
+    indexed = True
+
+    def __init__(self, width=48, height=48):
+        self._width = width
+        self._height = height
+
+        self._indices = numpy.zeros((height, width), dtype=numpy.uint8)
+        self._shared = False
+        self._palette = numpy.zeros((1, 4), dtype=numpy.uint8)
+        self._palette_lookup = {0: 0}
+        self._temp = TempLayer()
+        self._preview = None
+        self._trackers = weakref.WeakSet()
+        self.duration = PixelMap.DEFAULT_DURATION
+
+    @property
+    def palette(self):
+        return [Color.array_to_cairo(values) for values in self._palette]
+
+    def _key(self, values):
+        return int(numpy.ascontiguousarray(values, dtype=numpy.uint8).view(numpy.uint32)[0])
+
+    def _set_palette(self, palette):
+        self._palette = palette
+        self._palette_lookup = {}
+
+        # Si hay colores repetidos, se usa siempre el primer índice
+        keys = numpy.ascontiguousarray(palette).view(numpy.uint32)[:, 0]
+        for index in range(len(keys) - 1, -1, -1):
+            self._palette_lookup[int(keys[index])] = index
+
+        self._palette_lookup[0] = 0
+
+        if len(palette) > 256 and self._indices.dtype == numpy.uint8:
+            self._indices = self._indices.astype(numpy.uint16)
+            self._shared = False
+
+    def _detach(self):
+        if self._shared:
+            self._indices = self._indices.copy()
+            self._shared = False
+
+    def _compact_palette(self):
+        used = numpy.unique(numpy.append(self._indices, 0))
+        lut = numpy.zeros(len(self._palette), dtype=numpy.uint16)
+        lut[used] = numpy.arange(len(used))
+
+        dtype = numpy.uint8 if len(used) <= 256 else numpy.uint16
+        self._indices = lut[self._indices].astype(dtype)
+        self._shared = False
+        self._set_palette(self._palette[used])
+
+    def _make_dense(self):
+        # Se pasa a guardar los colores directamente. Los pasos del
+        # historial guardan colores y no índices, así que siguen sirviendo
+        self._data = self._palette[self._indices]
+        self._shared = False
+
+        del self._indices, self._palette, self._palette_lookup
+        self.__class__ = PixelMap
+
+    def _indices_for(self, keys):
+        """
+        Devuelve el índice de la paleta de cada color (empaquetado como
+        uint32), agregando a la paleta los que no estén, o None si no
+        entran en la paleta.
+        """
+
+        keys = keys.tolist()
+        missing = [key for key in set(keys) if key not in self._palette_lookup]
+
+        if len(self._palette) + len(missing) > self.MAX_COLORS:
+            self._compact_palette()
+
+            if len(self._palette) + len(missing) > self.MAX_COLORS:
+                return None
+
+        if missing:
+            start = len(self._palette)
+            values = numpy.array(missing, dtype=numpy.uint32).view(numpy.uint8).reshape(-1, 4)
+            self._palette = numpy.vstack((self._palette, values))
+
+            for index, key in enumerate(missing):
+                self._palette_lookup[key] = start + index
+
+            if len(self._palette) > 256 and self._indices.dtype == numpy.uint8:
+                self._indices = self._indices.astype(numpy.uint16)
+                self._shared = False
+
+        return numpy.array([self._palette_lookup[key] for key in keys],
+                           dtype=self._indices.dtype)
+
+    def _get(self, x, y):
+        return self._palette[self._indices[y, x]]
+
+    def _put(self, x, y, values):
+        indices = self._indices_for(numpy.array([self._key(values)], dtype=numpy.uint32))
+        if indices is None:
+            self._make_dense()
+            PixelMap._put(self, x, y, values)
+            return
+
+        self._detach()
+        self._indices[y, x] = indices[0]
+
+    def _read(self, x0, y0, x1, y1):
+        return self._palette[self._indices[y0:y1, x0:x1]]
+
+    def _write(self, x0, y0, values, mask=None):
+        height, width = values.shape[:2]
+        keys = numpy.ascontiguousarray(values).view(numpy.uint32)[:, :, 0]
+        if mask is not None:
+            keys = keys[mask]
+
+        unique, inverse = numpy.unique(keys, return_inverse=True)
+        lut = self._indices_for(unique)
+        if lut is None:
+            self._make_dense()
+            PixelMap._write(self, x0, y0, values, mask)
+            return
+
+        self._detach()
+
+        target = self._indices[y0:y0 + height, x0:x0 + width]
+        if mask is None:
+            target[:] = lut[inverse].reshape(height, width)
+
+        else:
+            target[mask] = lut[inverse.ravel()]
+
+    def _resize_storage(self, width, height):
+        indices = numpy.zeros((height, width), dtype=self._indices.dtype)
+        h = min(height, self._height)
+        w = min(width, self._width)
+        indices[:h, :w] = self._indices[:h, :w]
+
+        self._indices = indices
+        self._shared = False
+
+    def __contains__(self, obj):
+        x, y = obj
+        if not self._in_bounds(x, y):
+            return False
+
+        return self._indices[y - 1, x - 1] != 0
+
+    def chunks(self):
+        yield 1, 1, self._palette[self._indices]
+
+    def clear(self):
+        self._indices = numpy.zeros((self._height, self._width), dtype=numpy.uint8)
+        self._shared = False
+        self._set_palette(self._palette[:1])
+        self._damage_all()
+
     def is_empty(self):
-        return len(self.pixels) == 0
+        return not self._indices.any()
+
+    @property
+    def nbytes(self):
+        return self._indices.nbytes + self._palette.nbytes
+
+    def get_pixel_index(self, x, y):
+        if not self._in_bounds(x, y):
+            return 0
+
+        return int(self._indices[y - 1, x - 1])
+
+    def set_palette_color(self, index, color):
+        """
+        Cambia el color de la entrada index de la paleta, lo que recolorea
+        todos los píxeles que la usan.
+        """
+
+        if index == 0:
+            return
+
+        values = Color.cairo_to_array(color)
+        if values[Color.ALPHA] == 0:
+            # La transparencia siempre es el índice 0
+            self._detach()
+            self._indices[self._indices == index] = 0
+            self._damage_all()
+            return
+
+        palette = self._palette.copy()
+        palette[index] = values
+        self._set_palette(palette)
+        self._damage_all()
+
+    def replace_color(self, current_color, new_color):
+        """
+        Cambia current_color por new_color en la paleta. Devuelve la máscara
+        de los píxeles que cambiaron, o None si current_color no está en la
+        paleta (o es transparente).
+        """
+
+        index = self._palette_lookup.get(self._key(Color.cairo_to_array(current_color)), None)
+        if index is None or index == 0:
+            return None
+
+        mask = self._indices == index
+        self.set_palette_color(index, new_color)
+
+        return mask
+
+    def load_data_from_image(self, image):
+        if image.mode != "P" or image.getpalette() is None:
+            PixelMap.load_data_from_image(self, image)
+            return
+
+        # Se usa directamente la paleta de la imagen, sin cuantizar
+        indices = numpy.asarray(image, dtype=numpy.uint8)
+        height, width = indices.shape
+        self._resize(width, height)
+
+        colors = numpy.zeros((256, 4), dtype=numpy.uint8)
+        rgb = numpy.array(image.getpalette()[:768], dtype=numpy.uint8).reshape(-1, 3)
+        colors[:len(rgb), :3] = rgb
+        colors[:, Color.ALPHA] = 255
+
+        transparency = image.info.get("transparency", None)
+        if isinstance(transparency, int):
+            colors[transparency] = 0
+
+        used = numpy.unique(indices)
+        opaque = used[colors[used, Color.ALPHA] != 0]
+
+        lut = numpy.zeros(256, dtype=numpy.uint16)
+        lut[opaque] = numpy.arange(1, len(opaque) + 1)
+
+        self._indices = lut[indices].astype(numpy.uint8 if len(opaque) < 256 else numpy.uint16)
+        self._shared = False
+        self._set_palette(numpy.vstack((numpy.zeros((1, 4), dtype=numpy.uint8), colors[opaque])))
+        self._damage_all()
+
+    def to_image(self):
+        """
+        Devuelve una imagen en modo P (con el índice 0 transparente) usando
+        la paleta propia, o None si tiene más de 256 colores o alguno es
+        semitransparente.
+        """
+
+        if len(self._palette) > 256 or \
+           ((self._palette[1:, Color.ALPHA] != 255).any()):
+            return None
+
+        image = Image.fromarray(self._indices.astype(numpy.uint8), "P")
+        palette = numpy.zeros((256, 3), dtype=numpy.uint8)
+        palette[:len(self._palette)] = self._palette[:, :3]
+        image.putpalette(palette.ravel().tolist())
+        image.info["transparency"] = 0
+
+        return image
+
+    def copy(self):
+        pixelmap = IndexedPixelMap(0, 0)
+        pixelmap._width, pixelmap._height = self._width, self._height
+        pixelmap._indices = self._indices
+        pixelmap._palette = self._palette
+        pixelmap._palette_lookup = self._palette_lookup.copy()
+        pixelmap._temp = self._temp.copy()
+        pixelmap.duration = self.duration
+
+        self._shared = pixelmap._shared = True
+
+        return pixelmap
 
 
 class CanvasConfig:
@@ -166,6 +1242,7 @@ class CanvasConfig:
     DEFAULT_LAYOUT_SIZE = (16, 16)
     DEFAULT_TOOL = ToolType.PENCIL
     DEFAULT_TOOL_SIZE = 1
+    DEFAULT_BRUSH_SHAPE = BrushShape.SQUARE
     DEFAULT_PRIMARY_COLOR = Color.BLACK
     DEFAULT_SECONDARY_COLOR = Color.WHITE
     DEFAULT_ZOOM = 2000
@@ -174,18 +1251,46 @@ class CanvasConfig:
     DEFAULT_EDITABLE = True
     DEFAULT_FILE = None
     DEFAULT_MODIFIED = False
+    DEFAULT_HISTORY_BUDGET = 64 * 1024 * 1024  # En bytes, por canvas
+    DEFAULT_JOURNAL = False
+    DEFAULT_INDEXED = False  # Si los frames nuevos usan una paleta, ver IndexedPixelMap
+    DEFAULT_FILL_CONNECTIVITY = 4  # 4 u 8, ver PaintAlgorithms.flood_fill
+    DEFAULT_REPLACE_TOLERANCE = 0  # Ver PaintAlgorithms.color_mask
+    DEFAULT_REPLACE_SCOPE = ReplaceScope.FRAME
+    DEFAULT_ADJUSTMENT = ColorAdjustment.LIGHTEN
+    DEFAULT_ADJUSTMENT_AMOUNT = 8  # En porcentaje, ver PaintAlgorithms.adjust_colors
+    DEFAULT_DITHER_PATTERN = DitherPattern.BAYER_2
+    DEFAULT_DITHER_LEVEL = 50  # En porcentaje, ver PaintAlgorithms.dither_mask
+    DEFAULT_SYMMETRY_MODE = SymmetryMode.NONE
+    DEFAULT_SYMMETRY_CENTER = None  # El centro del sprite, ver Symmetry
+    DEFAULT_SYMMETRY_FOLDS = 6
 
     def __init__(self, layout_size=DEFAULT_LAYOUT_SIZE, tool=DEFAULT_TOOL,
                  tool_size=DEFAULT_TOOL_SIZE,
+                 brush_shape=DEFAULT_BRUSH_SHAPE,
                  primary_color=DEFAULT_PRIMARY_COLOR,
                  secondary_color=DEFAULT_SECONDARY_COLOR,
                  zoom=DEFAULT_ZOOM, show_grid=DEFAULT_SHOW_GRID,
                  resizable=DEFAULT_RESIZABLE, editable=DEFAULT_EDITABLE,
-                 file=DEFAULT_FILE, modified=DEFAULT_MODIFIED):
+                 file=DEFAULT_FILE, modified=DEFAULT_MODIFIED,
+                 history_budget=DEFAULT_HISTORY_BUDGET,
+                 journal=DEFAULT_JOURNAL,
+                 indexed=DEFAULT_INDEXED,
+                 fill_connectivity=DEFAULT_FILL_CONNECTIVITY,
+                 replace_tolerance=DEFAULT_REPLACE_TOLERANCE,
+                 replace_scope=DEFAULT_REPLACE_SCOPE,
+                 adjustment=DEFAULT_ADJUSTMENT,
+                 adjustment_amount=DEFAULT_ADJUSTMENT_AMOUNT,
+                 dither_pattern=DEFAULT_DITHER_PATTERN,
+                 dither_level=DEFAULT_DITHER_LEVEL,
+                 symmetry_mode=DEFAULT_SYMMETRY_MODE,
+                 symmetry_center=DEFAULT_SYMMETRY_CENTER,
+                 symmetry_folds=DEFAULT_SYMMETRY_FOLDS):
 
         self._layout_size = layout_size
         self._tool = tool
         self._tool_size = tool_size
+        self._brush_shape = brush_shape
         self._primary_color = primary_color
         self._secondary_color = secondary_color
         self._zoom = zoom
@@ -194,6 +1299,19 @@ class CanvasConfig:
         self._editable = editable
         self._file = file
         self._modified = modified
+        self._history_budget = history_budget
+        self._journal = journal
+        self._indexed = indexed
+        self._fill_connectivity = fill_connectivity
+        self._replace_tolerance = replace_tolerance
+        self._replace_scope = replace_scope
+        self._adjustment = adjustment
+        self._adjustment_amount = adjustment_amount
+        self._dither_pattern = dither_pattern
+        self._dither_level = dither_level
+        self._symmetry_mode = symmetry_mode
+        self._symmetry_center = symmetry_center
+        self._symmetry_folds = symmetry_folds
 
         self._callbacks = {}
 
@@ -204,6 +1322,11 @@ class CanvasConfig:
 
         self._callbacks[property_name].append(callback)
 
+    def disconnect(self, property_name, callback):
+        property_name = property_name.replace("-", "_")
+        if callback in self._callbacks.get(property_name, []):
+            self._callbacks[property_name].remove(callback)
+
     def emit(self, property_name):
         property_name = property_name.replace("-", "_")
         if property_name not in self._callbacks.keys():
@@ -243,6 +1366,15 @@ class CanvasConfig:
         self._tool_size = value
         self.emit("tool-size")
 
+    @property
+    def brush_shape(self):
+        return self._brush_shape
+
+    @brush_shape.setter
+    def brush_shape(self, value):
+        self._brush_shape = value
+        self.emit("brush-shape")
+
     @property
     def primary_color(self):
         return self._primary_color
@@ -316,6 +1448,123 @@ class CanvasConfig:
             self._modified = value
             self.emit("modified")
 
+    @property
+    def history_budget(self):
+        return self._history_budget
+
+    @history_budget.setter
+    def history_budget(self, value):
+        self._history_budget = value
+        self.emit("history-budget")
+
+    @property
+    def journal(self):
+        return self._journal
+
+    @journal.setter
+    def journal(self, value):
+        self._journal = value
+        self.emit("journal")
+
+    @property
+    def indexed(self):
+        return self._indexed
+
+    @indexed.setter
+    def indexed(self, value):
+        self._indexed = value
+        self.emit("indexed")
+
+    @property
+    def fill_connectivity(self):
+        return self._fill_connectivity
+
+    @fill_connectivity.setter
+    def fill_connectivity(self, value):
+        self._fill_connectivity = value
+        self.emit("fill-connectivity")
+
+    @property
+    def replace_tolerance(self):
+        return self._replace_tolerance
+
+    @replace_tolerance.setter
+    def replace_tolerance(self, value):
+        self._replace_tolerance = value
+        self.emit("replace-tolerance")
+
+    @property
+    def replace_scope(self):
+        return self._replace_scope
+
+    @replace_scope.setter
+    def replace_scope(self, value):
+        self._replace_scope = value
+        self.emit("replace-scope")
+
+    @property
+    def adjustment(self):
+        return self._adjustment
+
+    @adjustment.setter
+    def adjustment(self, value):
+        self._adjustment = value
+        self.emit("adjustment")
+
+    @property
+    def adjustment_amount(self):
+        return self._adjustment_amount
+
+    @adjustment_amount.setter
+    def adjustment_amount(self, value):
+        self._adjustment_amount = value
+        self.emit("adjustment-amount")
+
+    @property
+    def dither_pattern(self):
+        return self._dither_pattern
+
+    @dither_pattern.setter
+    def dither_pattern(self, value):
+        self._dither_pattern = value
+        self.emit("dither-pattern")
+
+    @property
+    def dither_level(self):
+        return self._dither_level
+
+    @dither_level.setter
+    def dither_level(self, value):
+        self._dither_level = value
+        self.emit("dither-level")
+
+    @property
+    def symmetry_mode(self):
+        return self._symmetry_mode
+
+    @symmetry_mode.setter
+    def symmetry_mode(self, value):
+        self._symmetry_mode = value
+        self.emit("symmetry-mode")
+
+    @property
+    def symmetry_center(self):
+        return self._symmetry_center
+
+    @symmetry_center.setter
+    def symmetry_center(self, value):
+        self._symmetry_center = value
+        self.emit("symmetry-center")
+
+    @property
+    def symmetry_folds(self):
+        return self._symmetry_folds
+
+    @symmetry_folds.setter
+    def symmetry_folds(self, value):
+        self._symmetry_folds = value
+        self.emit("symmetry-folds")
+
 
 class Canvas(Gtk.DrawingArea):
 
@@ -324,8 +1573,13 @@ class Canvas(Gtk.DrawingArea):
         "secondary-color-picked": (GObject.SIGNAL_RUN_LAST, None, [GObject.TYPE_PYOBJECT]),
         "changed": (GObject.SIGNAL_RUN_LAST, None, []),
         "size-changed": (GObject.SIGNAL_RUN_LAST, None, []),
+        "replace-color-in-frames": (GObject.SIGNAL_RUN_LAST, None, [GObject.TYPE_PYOBJECT, GObject.TYPE_PYOBJECT]),
     }
 
+    # Contorno de la selección ("marching ants")
+    ANTS_DASH = 4  # Largo de cada trazo, en píxeles de la pantalla
+    ANTS_INTERVAL = 120  # Cada cuánto se mueven, en milisegundos
+
     def __init__(self, config=None, *args, **kargs):
         super(Canvas, self).__init__()
 
@@ -338,19 +1592,67 @@ class Canvas(Gtk.DrawingArea):
         self.config.connect("layout-size", self.set_layout_size)
         self.config.connect("zoom", self._zoom_changed_cb)
         self.config.connect("file", self._file_changed_cb)
+        self.config.connect("history-budget", self._history_budget_changed_cb)
+        self.config.connect("journal", self._journal_changed_cb)
+        self.config.connect("indexed", self._indexed_changed_cb)
+        self.config.connect("tool", self._symmetry_changed_cb)
+        self.config.connect("symmetry-mode", self._symmetry_changed_cb)
+        self.config.connect("symmetry-center", self._symmetry_changed_cb)
+        self.config.connect("symmetry-folds", self._symmetry_changed_cb)
 
-        self.pixelmap = PixelMap(*self.config.layout_size)
+        self.pixelmap = PixelMap.new(*self.config.layout_size, indexed=self.config.indexed)
 
         self._pending_tool = None
         self._pressed_buttons = []
         self._mouse_position = (-1, -1)
         self._click_mouse_position = (None, None)
-        self._hovered_pixels = []
-        self._selected_pixels = []
-        self._history = [self.pixelmap]
-        self._last_saved_pixelmap = self.pixelmap
+        # Lo que se marca debajo del mouse como (x, y, mask), ver
+        # Tool.get_hover, sus copias simétricas y las superficies A8 con
+        # las que se dibujan
+        self._hover = None
+        self._mirrored_hover = []
+        self._hover_surfaces = None
+        self._symmetry = None
+        self._drawn_symmetry = None
+        self.selection = Selection(self.pixelmap.width, self.pixelmap.height)
+        self._history = History(self.config.history_budget)
+        self._stroke = None
         self._current_layout_size = self.config.layout_size
         self._waiting_for_allocate = False
+        self._surfaces = SurfaceCache()
+        self._patterns = PatternCache()
+        self._scheduler = RedrawScheduler(self)
+
+        # Mientras se usa una herramienta de selección, la selección que
+        # había al empezar y cómo se combina con la nueva figura
+        self._selection_base = None
+        self._selection_mode = SelectionMode.REPLACE
+        self._selection_surface = None
+        self._ants_offset = 0
+        self._ants_timeout = None
+
+        # Píxeles que se están moviendo con la herramienta Move: posición
+        # (x, y) de la que se sacaron, desplazamiento, colores y máscara.
+        # Ver lift_floating
+        self._floating = None
+        self._floating_surface = None
+
+        # Píxeles por los que pasó el mouse con una herramienta a mano
+        # alzada que todavía no se pintaron (el primero ya se pintó), o
+        # None si no se está pintando. Ver _flush_motion
+        self._motion_points = None
+        self._motion_color = Color.PRIMARY
+        self._motion_time = None
+        self._motion_tick = None
+
+        # Parte visible del widget (x0, y0, x1, y1) dentro del
+        # ScrolledWindow, o None si no se sabe (se considera todo visible)
+        self._viewport = None
+
+        # Cambios del PixelMap que todavía no se pidieron redibujar
+        self._damage = None
+        self._damage_pixelmap = None
+        self._track_damage()
 
         self.set_vexpand(False)
         self.set_hexpand(False)
@@ -371,6 +1673,11 @@ class Canvas(Gtk.DrawingArea):
 
         self.connect("draw", self._draw_cb)
         self.connect("size-allocate", self._size_allocate_cb)
+        self.connect("destroy", self._destroy_cb)
+        self.connect("style-updated", self._style_updated_cb)
+
+        if self.config.journal:
+            self._journal_changed_cb(True)
 
     def _scroll_cb(self, canvas, event):
         if event.state != Gdk.ModifierType.CONTROL_MASK:
@@ -393,43 +1700,171 @@ class Canvas(Gtk.DrawingArea):
     def _button_motion_cb(self, canvas, event):
         self._mouse_position = (event.x, event.y)
 
-        hovered_pixels = self.get_hovered_pixels()
-        if hovered_pixels == self._hovered_pixels:
-            self.redraw()
-            return
+        if self._motion_points is not None:
+            self._queue_motion(event)
+
+        hover = self.get_hover()
+        if self._hover is not None and hover[:2] == self._hover[:2] and \
+           hover[2] is self._hover[2]:
+            return
+
+        self._set_hover(hover)
+
+        # Mientras se junta el movimiento se pinta en el próximo frame,
+        # ver _flush_motion
+        if self._motion_points is None:
+            if Gdk.BUTTON_PRIMARY in self._pressed_buttons:
+                self.apply_tool_to_hovered_pixels(color=Color.PRIMARY)
+
+            elif Gdk.BUTTON_SECONDARY in self._pressed_buttons:
+                self.apply_tool_to_hovered_pixels(color=Color.SECONDARY)
+
+        self.redraw_dirty()
+
+    def _button_press_cb(self, canvas, event):
+        button = event.get_button()[1]
+        if button == Gdk.BUTTON_MIDDLE:
+            return
+
+        self._click_mouse_position = (event.x, event.y)
+
+        if ToolType.is_selection_tool(self.config.tool):
+            if self._pressed_buttons == []:
+                self._selection_mode = self._get_selection_mode(event.state)
+                self._selection_base = self.selection.copy()
+
+        elif self.config.tool in [ToolType.MOVE, ToolType.DITHER_GRADIENT]:
+            # Se usa lo seleccionado
+            pass
+
+        elif self.config.tool != ToolType.SPECIAL_BUCKET or \
+             self.config.replace_scope != ReplaceScope.SELECTION:
+            self.unselect_all_pixels()
+
+        if self._pressed_buttons == []:
+            self._stroke = HistoryStep()
+
+            tool = TOOLS.get(self.config.tool, None)
+            if tool is not None:
+                tool.start(self)
+
+        if button not in self._pressed_buttons:
+            self._pressed_buttons.append(button)
+
+        if ToolType.is_freehand(self.config.tool) and \
+           button in [Gdk.BUTTON_PRIMARY, Gdk.BUTTON_SECONDARY]:
+            # Una línea de largo 0: se estampa el pincel una vez
+            point = self.get_relative_coords(event.x, event.y)
+            self._motion_points = [point, point]
+            self._motion_color = Color.PRIMARY if button == Gdk.BUTTON_PRIMARY else Color.SECONDARY
+            self._motion_time = event.time
+            self._flush_motion()
+
+        elif button == Gdk.BUTTON_PRIMARY:
+            self.apply_tool_to_hovered_pixels(color=Color.PRIMARY)
+
+        elif button == Gdk.BUTTON_SECONDARY:
+            self.apply_tool_to_hovered_pixels(color=Color.SECONDARY)
+
+        self.redraw_dirty()
+
+    def _get_selection_mode(self, state):
+        # Igual que en GIMP: Shift suma, Ctrl resta y los dos intersecan
+        shift = state & Gdk.ModifierType.SHIFT_MASK
+        control = state & Gdk.ModifierType.CONTROL_MASK
+
+        if shift and control:
+            return SelectionMode.INTERSECT
+
+        elif shift:
+            return SelectionMode.UNION
+
+        elif control:
+            return SelectionMode.SUBTRACT
+
+        return SelectionMode.REPLACE
+
+    def _get_motion_history(self, event):
+        """
+        Devuelve las posiciones por las que pasó el puntero entre el
+        evento anterior y este, si el dispositivo las guarda.
+        """
+
+        device = event.get_device()
+        if device is None or self._motion_time is None:
+            return []
+
+        found, coords = device.get_history(self.get_window(), self._motion_time, event.time)
+        if not found:
+            return []
+
+        positions = []
+        for coord in coords:
+            found_x, x = device.get_axis(coord.axes, Gdk.AxisUse.X)
+            found_y, y = device.get_axis(coord.axes, Gdk.AxisUse.Y)
+            if found_x and found_y:
+                positions.append((x, y))
+
+        return positions
+
+    def _queue_motion(self, event):
+        positions = self._get_motion_history(event)
+        positions.append((event.x, event.y))
+        self._motion_time = event.time
 
-        if self.config.tool in [ToolType.STROKE, ToolType.RECTANGLE]:
-            self.pixelmap.delete_temp_pixels()
+        for position in positions:
+            point = self.get_relative_coords(*position)
+            if point != self._motion_points[-1]:
+                self._motion_points.append(point)
 
-        self._hovered_pixels = hovered_pixels
+        if self._motion_tick is None and len(self._motion_points) > 1:
+            self._motion_tick = self.add_tick_callback(self._motion_tick_cb)
 
-        if Gdk.BUTTON_PRIMARY in self._pressed_buttons:
-            self.apply_tool_to_hovered_pixels(color=Color.PRIMARY)
+    def _motion_tick_cb(self, canvas, clock):
+        self._motion_tick = None
+        self._flush_motion()
 
-        elif Gdk.BUTTON_SECONDARY in self._pressed_buttons:
-            self.apply_tool_to_hovered_pixels(color=Color.SECONDARY)
+        return GLib.SOURCE_REMOVE
 
-        self.redraw()
+    def _flush_motion(self):
+        """
+        Une con líneas los puntos por los que pasó el mouse desde el
+        último frame y aplica la herramienta una sola vez sobre todos los
+        píxeles que cubre el pincel a lo largo de ellas.
+        """
 
-    def _button_press_cb(self, canvas, event):
-        button = event.get_button()[1]
-        if button == Gdk.BUTTON_MIDDLE:
+        if self._motion_points is None or len(self._motion_points) < 2:
             return
 
-        self._click_mouse_position = (event.x, event.y)
+        tool = TOOLS.get(self.config.tool, None)
+        if tool is None:
+            return
 
-        # TODO: Si la tecla Ctrl está apretada, no deseleccionar pixeles
-        # anteriormente seleccionados
-        self.unselect_all_pixels()
+        brush, offset = PaintAlgorithms.brush_mask(self.config.tool_size,
+                                                   self.config.brush_shape)
+        x, y, mask = PaintAlgorithms.stamp_path(self._motion_points, brush, offset)
+        self._motion_points = self._motion_points[-1:]
 
-        if button not in self._pressed_buttons:
-            self._pressed_buttons.append(button)
+        redraw = tool.apply_mask(self, x, y, mask, self._motion_color,
+                                 self.config.primary_color, self.config.secondary_color)
 
-        if button == Gdk.BUTTON_PRIMARY:
-            self.apply_tool_to_hovered_pixels(color=Color.PRIMARY)
+        symmetry = self.get_symmetry()
+        if symmetry is not None:
+            for _x, _y, _mask in symmetry.map_mask(x, y, mask):
+                redraw = tool.apply_mask(self, _x, _y, _mask, self._motion_color,
+                                         self.config.primary_color, self.config.secondary_color) or redraw
 
-        elif button == Gdk.BUTTON_SECONDARY:
-            self.apply_tool_to_hovered_pixels(color=Color.SECONDARY)
+        if redraw:
+            self.redraw_dirty()
+
+    def _stop_motion(self):
+        if self._motion_tick is not None:
+            self.remove_tick_callback(self._motion_tick)
+            self._motion_tick = None
+
+        self._flush_motion()
+        self._motion_points = None
+        self._motion_time = None
 
     def _button_release_cb(self, canvas, event):
         button = event.get_button()[1]
@@ -439,94 +1874,170 @@ class Canvas(Gtk.DrawingArea):
         if button in self._pressed_buttons:
             self._pressed_buttons.remove(button)
 
+        if self._pressed_buttons == []:
+            self._stop_motion()
+            self._selection_base = None
+
+            tool = TOOLS.get(self.config.tool, None)
+            if tool is not None:
+                tool.finish(self)
+
         if self._pending_tool is not None and self._pressed_buttons == []:
             self.config.tool = self._pending_tool
             self.redraw()
 
         self._click_mouse_position = (None, None)
 
-        self._history = self._history[:self._history.index(self.pixelmap) + 1]
-        prev = self.pixelmap
-        self.pixelmap = PixelMap(self.pixelmap.width, self.pixelmap.height)
+        if self._stroke is None:
+            self._stroke = HistoryStep()
 
-        for pixel in prev.pixels + prev.temp_pixels:
-            self.pixelmap.set_pixel_color(pixel.x, pixel.y, pixel.color)
+        self.pixelmap.apply_preview()
+        self.pixelmap.untemp_pixels(self._stroke)
 
-        self._history.append(self.pixelmap)
+        if self._pressed_buttons == []:
+            self._history.push(self._stroke)
+            self._stroke = None
 
-        prev.delete_temp_pixels()
-
-        self.config.modified = True
+        self.config.modified = self._history.is_modified()
         self.emit("changed")
 
     def _draw_cb(self, canvas, ctx):
-        alloc = self.get_allocation()
-        w = h = self.config.zoom / 100
+        self._draw_bg(ctx)
+
+        self._surfaces.update(self.pixelmap, self.get_visible_region())
+        self._surfaces.paint(ctx, self.config.zoom / 100)
+        self._draw_floating(ctx)
 
         if self.config.show_grid and self.config.zoom >= 150 and self.config.editable:
-            margin = 0.5
+            self._draw_grid(ctx)
 
-        else:
-            margin = 0
+        self._draw_symmetry_axes(ctx)
+        self._draw_hover(ctx)
+        self._draw_selected_pixels(ctx)
 
-        self._draw_bg(ctx)
+    def _draw_bg(self, ctx):
+        # GTK ya recorta ctx a la región que hay que redibujar
+        ctx.set_source(self._patterns.checkerboard)
+        ctx.paint()
 
-        painted = []
+    def _draw_grid(self, ctx):
+        width, height = self.config.layout_size
+        factor = self.config.zoom / 100
 
-        # Los pixeles temporales tienen preferencia
-        for pixel in self.pixelmap.temp_pixels + self.pixelmap.pixels:
-            coords = (pixel.x, pixel.y)
-            if coords in painted:
-                continue
+        # Sin las líneas del borde izquierdo y superior del sprite
+        ctx.save()
+        ctx.rectangle(1, 1, width * factor - 1, height * factor - 1)
+        ctx.clip()
+
+        ctx.set_source(self._patterns.grid(self.config.zoom))
+        ctx.paint()
+        ctx.restore()
 
-            painted.append(coords)
-            x, y = self.get_absolute_coords(*coords)
+    def _draw_symmetry_axes(self, ctx):
+        symmetry = self.get_symmetry()
+        if symmetry is None:
+            return
 
-            ctx.set_source_rgba(*pixel.color)
-            ctx.rectangle(x + margin, y + margin, w - 2 * margin, h - 2 * margin)
-            ctx.fill()
+        factor = self.config.zoom / 100
 
-        self._draw_hovered_pixels(ctx)
-        self._draw_selected_pixels(ctx)
+        ctx.save()
+        ctx.rectangle(0, 0, symmetry.width * factor, symmetry.height * factor)
+        ctx.clip()
 
-    def _draw_bg(self, ctx):
-        size = 13  # Esto es 100% arbitrario
-        c1 = (0.4, 0.4, 0.4)
-        c2 = (0.5, 0.5, 0.5)
+        for x0, y0, x1, y1 in symmetry.get_axes():
+            ctx.move_to(x0 * factor, y0 * factor)
+            ctx.line_to(x1 * factor, y1 * factor)
 
-        alloc = self.get_allocation()
+        ctx.set_source_rgba(*Color.SYMMETRY_AXIS)
+        ctx.set_line_width(1)
+        ctx.stroke()
+        ctx.restore()
 
-        for i in range(0, alloc.width // size + 1):
-            for j in range(0, alloc.height // size + 1):
-                if (i + j) % 2 == 0:
-                    ctx.set_source_rgb(*c1)
+    def _draw_hover(self, ctx):
+        if self._hover is None:
+            return
 
-                else:
-                    ctx.set_source_rgb(*c2)
+        if self._hover_surfaces is None:
+            self._hover_surfaces = [(x, y, render_mask(mask))
+                                    for x, y, mask in [self._hover] + self._mirrored_hover]
 
-                #print(i, j, c1 if (i + j) % 2 == 0 else c2)
-                ctx.rectangle(i * size, j * size, size, size)
-                ctx.fill()
+        factor = self.config.zoom / 100
 
-    def _draw_hovered_pixels(self, ctx):
+        ctx.save()
+        ctx.scale(factor, factor)
         ctx.set_source_rgba(1, 1, 1, 0.2)
 
-        for x, y in self._hovered_pixels:
-            x, y = self.get_absolute_coords(x, y)
-            w = h = self.config.zoom / 100
-            margin = 1 if self.config.zoom >= 100 else 0
-            ctx.rectangle(x + margin, y + margin, w - 2 * margin, h - 2 * margin)
-            ctx.fill()
+        for x, y, surface in self._hover_surfaces:
+            pattern = cairo.SurfacePattern(surface)
+            pattern.set_filter(cairo.FILTER_NEAREST)
+            pattern.set_matrix(cairo.Matrix(x0=1 - x, y0=1 - y))
+            ctx.mask(pattern)
+
+        ctx.restore()
+
+    def _draw_floating(self, ctx):
+        if self._floating is None:
+            return
+
+        x, y, width, height = self._get_floating_rect()
+        factor = self.config.zoom / 100
+
+        ctx.save()
+        ctx.scale(factor, factor)
+        ctx.set_source_surface(self._floating_surface, x - 1, y - 1)
+        ctx.get_source().set_filter(cairo.FILTER_NEAREST)
+        ctx.rectangle(x - 1, y - 1, width, height)
+        ctx.fill()
+        ctx.restore()
 
     def _draw_selected_pixels(self, ctx):
-        ctx.set_source_rgba(*Color.SELECTED_PIXEL)
+        bounds = self.selection.get_bounds()
+        if bounds is None:
+            return
+
+        x, y, width, height = bounds
+        factor = self.config.zoom / 100
 
-        for x, y in self._selected_pixels:
-            x, y = self.get_absolute_coords(x, y)
-            w = h = self.config.zoom / 100
-            margin = 1 if self.config.zoom >= 100 else 0
-            ctx.rectangle(x + margin, y + margin, w - 2 * margin, h - 2 * margin)
-            ctx.fill()
+        ctx.save()
+        if self._floating is not None:
+            # La selección acompaña a los píxeles que se están moviendo
+            dx, dy = self._floating[2:4]
+            ctx.translate(dx * factor, dy * factor)
+
+        if self._selection_surface is None:
+            mask = self.selection.mask[y - 1:y - 1 + height, x - 1:x - 1 + width]
+            self._selection_surface = render_mask(mask, Color.SELECTED_PIXEL)
+
+        ctx.save()
+        ctx.scale(factor, factor)
+        ctx.set_source_surface(self._selection_surface, x - 1, y - 1)
+        ctx.get_source().set_filter(cairo.FILTER_NEAREST)
+        ctx.rectangle(x - 1, y - 1, width, height)
+        ctx.fill()
+        ctx.restore()
+
+        # Solo los segmentos del contorno que tocan la región a redibujar
+        cx0, cy0, cx1, cy1 = ctx.clip_extents()
+        cx0, cy0 = cx0 / factor - 1, cy0 / factor - 1
+        cx1, cy1 = cx1 / factor + 1, cy1 / factor + 1
+
+        for x0, y0, x1, y1 in self.selection.get_outline():
+            if x1 >= cx0 and x0 <= cx1 and y1 >= cy0 and y0 <= cy1:
+                ctx.move_to(x0 * factor + 0.5, y0 * factor + 0.5)
+                ctx.line_to(x1 * factor + 0.5, y1 * factor + 0.5)
+
+        ctx.set_line_width(1)
+        ctx.set_source_rgb(1, 1, 1)
+        ctx.stroke_preserve()
+
+        ctx.set_dash([self.ANTS_DASH], self._ants_offset)
+        ctx.set_source_rgb(0, 0, 0)
+        ctx.stroke()
+        ctx.restore()
+
+    def _style_updated_cb(self, canvas):
+        self._patterns.clear()
+        self.redraw()
 
     def _size_allocate_cb(self, canvas, alloc):
         if self._waiting_for_allocate:
@@ -534,7 +2045,105 @@ class Canvas(Gtk.DrawingArea):
             self.resize()
 
     def redraw(self):
-        GLib.idle_add(self.queue_draw)
+        # Se redibuja todo, así que los cambios pendientes ya no importan
+        self._track_damage()
+        self._scheduler.queue()
+
+    def _track_damage(self):
+        self._damage_pixelmap = self.pixelmap
+        self._damage = self.pixelmap.track_damage()
+
+    def invalidate_region(self, x, y, width, height):
+        """
+        Pide redibujar la región del sprite (en coordenadas que empiezan
+        en 1) en el próximo frame.
+        """
+
+        factor = self.config.zoom / 100
+
+        # Un píxel de margen por las líneas de la grilla
+        x0 = int(factor * (x - 1)) - 1
+        y0 = int(factor * (y - 1)) - 1
+        x1 = int(math.ceil(factor * (x - 1 + width))) + 1
+        y1 = int(math.ceil(factor * (y - 1 + height))) + 1
+
+        if self._viewport is not None:
+            # Lo que no se ve se dibuja cuando aparezca al hacer scroll
+            vx0, vy0, vx1, vy1 = self._viewport
+            x0, y0 = max(x0, vx0), max(y0, vy0)
+            x1, y1 = min(x1, vx1), min(y1, vy1)
+
+            if x0 >= x1 or y0 >= y1:
+                return
+
+        self._scheduler.queue((x0, y0, x1, y1))
+
+    def invalidate_mask(self, x, y, mask):
+        # Todo el rectángulo de la máscara, ubicada en la posición (x, y)
+        height, width = mask.shape
+        self.invalidate_region(x, y, width, height)
+
+    def _set_hover(self, hover):
+        self._invalidate_hover()
+        self._hover = hover
+        self._mirrored_hover = self.get_mirrored_hover(hover)
+        self._hover_surfaces = None
+        self._invalidate_hover()
+
+    def _invalidate_hover(self):
+        if self._hover is None:
+            return
+
+        for x, y, mask in [self._hover] + self._mirrored_hover:
+            self.invalidate_mask(x, y, mask)
+
+    def redraw_dirty(self):
+        """
+        Pide redibujar solo lo que cambió en el PixelMap. Si se cambió de
+        PixelMap, se redibuja todo.
+        """
+
+        if self.pixelmap is not self._damage_pixelmap:
+            self.redraw()
+            return
+
+        rect = self._damage.pop()
+        if rect is not None:
+            x0, y0, x1, y1 = rect
+            self.invalidate_region(x0 + 1, y0 + 1, x1 - x0, y1 - y0)
+
+    def set_viewport(self, x, y, width, height):
+        """
+        Indica qué parte del widget (en sus coordenadas) se ve, para no
+        pedir redibujar lo que queda fuera del ScrolledWindow.
+        """
+
+        self._viewport = (x, y, x + width, y + height)
+
+    def get_visible_region(self):
+        """
+        Devuelve la región del sprite (x, y, ancho, alto) que se ve, en
+        coordenadas que empiezan en 1.
+        """
+
+        width, height = self.config.layout_size
+        if self._viewport is None:
+            return 1, 1, width, height
+
+        vx0, vy0, vx1, vy1 = self._viewport
+        x0, y0 = self.get_relative_coords(max(vx0, 0), max(vy0, 0))
+        x1, y1 = self.get_relative_coords(max(vx1 - 1, 0), max(vy1 - 1, 0))
+        x1, y1 = min(x1, width), min(y1, height)
+
+        return x0, y0, max(x1 - x0 + 1, 0), max(y1 - y0 + 1, 0)
+
+    def get_redraw_counters(self):
+        """
+        Devuelve cuántas veces se pidió redibujar el canvas y cuántas
+        veces se redibujó realmente (como mucho una por frame).
+        """
+
+        return self._scheduler.requested, self._scheduler.performed
 
     def resize(self):
         width, height = self.config.layout_size
@@ -559,24 +2168,36 @@ class Canvas(Gtk.DrawingArea):
         # no se cambie el tamaño
 
     def set_layout_size(self, size):
-        new_width, new_height = size
-        current_width, current_height = self._current_layout_size
-
-        for x in range(new_width + 1, current_width + 1):
-            for y in range(1, current_height + 1):
-                self.pixelmap.delete_pixel_at(x, y)
-
-        for x in range(1, new_width + 1):
-            for y in range(new_height + 1, current_height + 1):
-                self.pixelmap.delete_pixel_at(x, y)
-
-        self.set_sprite_size((new_width, new_height))
+        # Al cambiar el tamaño del PixelMap se borran los píxeles que
+        # quedan fuera del nuevo layout
+        self.set_sprite_size(size)
         self.config.modified = True
         self.emit("size-changed")
 
     def set_sprite_size(self, size):
         self._current_layout_size = size
-        self.pixelmap.width, self.pixelmap.height = self.config.layout_size
+
+        width, height = self.config.layout_size
+        tiled = width * height > PixelMap.MAX_DENSE_AREA
+        if tiled != isinstance(self.pixelmap, TiledPixelMap):
+            # Un PixelMap denso de 8192x8192 ocupa 256MB, así que al pasar
+            # cierto tamaño se cambia a uno por tiles (y viceversa)
+            pixelmap = PixelMap.new(width, height, indexed=self.config.indexed)
+            pixelmap.duration = self.pixelmap.duration
+            for x, y, data in self.pixelmap.chunks():
+                pixelmap.set_region(x, y, data)
+
+            # Los HistoryStep siguen sirviendo porque guardan coordenadas,
+            # pero los ReplaceStep guardan referencias al PixelMap
+            self._history.replace_pixelmap(self.pixelmap, pixelmap)
+            self.pixelmap = pixelmap
+
+        else:
+            self.pixelmap.width, self.pixelmap.height = width, height
+
+        self.selection.resize(width, height)
+
+        self._write_journal_base()
         self.resize()
 
     def _zoom_changed_cb(self, zoom):
@@ -592,40 +2213,108 @@ class Canvas(Gtk.DrawingArea):
 
     def apply_tool_to_hovered_pixels(self, color=Color.PRIMARY):
         tool = TOOLS.get(self.config.tool, None)
+        if tool is None or self._hover is None:
+            return
 
-        if tool is not None:
-            redraw = tool.apply(self, self._hovered_pixels, color, self.config.primary_color, self.config.secondary_color)
-            if redraw:
-                self.redraw()
+        # Las copias simétricas son las mismas que se marcan con el mouse
+        redraw = False
+        for x, y, mask in [self._hover] + self._mirrored_hover:
+            redraw = tool.apply_mask(self, x, y, mask, color, self.config.primary_color,
+                                     self.config.secondary_color) or redraw
 
-    def get_hovered_pixels(self, start=None):
+        if redraw:
+            self.redraw_dirty()
+
+    def get_mouse_position(self):
+        # El píxel (x, y) debajo del mouse
+        return self.get_relative_coords(*self._mouse_position)
+
+    def get_click_position(self):
+        # El píxel (x, y) donde se hizo click, o None si no hay ningún
+        # botón apretado
+        if self._click_mouse_position == (None, None):
+            return None
+
+        return self.get_relative_coords(*self._click_mouse_position)
+
+    def get_hover(self, start=None):
         if start is None:
-            x, y = self.get_relative_coords(*self._mouse_position)
+            x, y = self.get_mouse_position()
 
         else:
             x, y = self.get_relative_coords(*start)
 
         tool = TOOLS.get(self.config.tool, None)
         if tool is not None:
-            return tool.get_hovered_pixels(self, x, y)
+            return tool.get_hover(self, x, y)
+
+        return x, y, Tool._pixel
+
+    def get_symmetry(self):
+        """
+        Devuelve el Symmetry con el que se copia lo que pinta la
+        herramienta actual, o None si no se usa simetría. Solo se crea de
+        nuevo (con sus tablas) cuando cambia la configuración o el tamaño.
+        """
+
+        tool = TOOLS.get(self.config.tool, None)
+        if tool is None or not ToolType.is_symmetric(self.config.tool):
+            return None
 
-        return [(x, y)]
+        mode = self.config.symmetry_mode
+        if mode == SymmetryMode.NONE:
+            mode = tool.symmetry
+
+        if mode == SymmetryMode.NONE:
+            return None
+
+        key = (self.pixelmap.width, self.pixelmap.height, mode,
+               self.config.symmetry_center, self.config.symmetry_folds)
+        if self._symmetry is None or self._symmetry.key != key:
+            self._symmetry = Symmetry(*key)
+
+        return self._symmetry
+
+    def get_mirrored_hover(self, hover):
+        symmetry = self.get_symmetry()
+        if symmetry is None:
+            return []
+
+        return symmetry.map_mask(*hover)
+
+    def _symmetry_changed_cb(self, value):
+        # Lo que se marca con el mouse (y sus copias) cambia con la
+        # herramienta y la simetría
+        if self._hover is not None:
+            self._set_hover(self.get_hover())
+
+        # Solo se redibuja todo si cambian los ejes que se ven
+        symmetry = self.get_symmetry()
+        if symmetry is not self._drawn_symmetry:
+            self._drawn_symmetry = symmetry
+            self.redraw()
 
     def get_pixelmap(self):
         return self.pixelmap
 
     def set_pixelmap(self, pixelmap, refresh=True, reset=False):
-        self.pixelmap = pixelmap
         if reset:
-            self._history = [self.pixelmap]
+            self._history.reset()
 
         else:
-            self._history.append(self.pixelmap)
+            self._history.push(ReplaceStep(self.pixelmap, pixelmap))
+
+        changed = pixelmap is not self.pixelmap
+        self.pixelmap = pixelmap
+        self.selection.resize(pixelmap.width, pixelmap.height)
+
+        if changed:
+            self._write_journal_base()
 
         self.config.modified = False
 
         if refresh:
-            self.redraw()
+            self.redraw_dirty()
 
     def _file_changed_cb(self, filename):
         self.config.layout_size = FileManagement.get_image_dimensions(filename)
@@ -642,40 +2331,467 @@ class Canvas(Gtk.DrawingArea):
             self.config._file = file
             self.config.modified = False
 
+    def mark_saved(self):
+        # El estado actual del historial es el que quedó en el archivo
+        self._history.mark_saved()
+        self.config.modified = False
+
+    def set_duration(self, duration):
+        # Se guarda en el historial para que se pueda deshacer y para que
+        # deshacer otros cambios no la dé por guardada
+        step = DurationStep(self.pixelmap.duration, duration)
+        if step.is_empty():
+            return
+
+        step.redo(self)
+        self._history.push(step)
+
+        self.config.modified = self._history.is_modified()
+        self.emit("changed")
+
     def get_sprite_size(self):
         return self.config.layout_size
 
     def undo(self):
-        index = self._history.index(self.pixelmap)
-        if index > 0:
-            self.pixelmap = self._history[index - 1]
-            self.redraw()
+        if self._history.undo(self):
+            self.redraw_dirty()
 
-            self.config.modified = self.pixelmap != self._last_saved_pixelmap
+            self.config.modified = self._history.is_modified()
             self.emit("changed")
 
     def redo(self):
-        index = self._history.index(self.pixelmap)
-        if index < len(self._history) - 1:
-            self.pixelmap = self._history[index + 1]
-            self.redraw()
+        if self._history.redo(self):
+            self.redraw_dirty()
 
-            self.config.modified = self.pixelmap != self._last_saved_pixelmap
+            self.config.modified = self._history.is_modified()
             self.emit("changed")
 
+    def record_change(self, x, y, mask, before, after):
+        """
+        Las herramientas que modifican el PixelMap directamente (sin usar
+        los píxeles temporales) tienen que registrar el cambio con esta
+        función para que se pueda deshacer. Ver HistoryStep.add.
+        """
+
+        if self._stroke is None:
+            self._stroke = HistoryStep()
+
+        self._stroke.add(x, y, mask, before, after)
+
+    def _history_budget_changed_cb(self, budget):
+        self._history.budget = budget
+        self._history.shrink()
+
+    def _journal_changed_cb(self, enabled):
+        if not self.config.editable:
+            return
+
+        if enabled and self._history.journal is None:
+            # Todos los canvas de un mismo archivo comparten la
+            # configuración, así se pueden agrupar al recuperarlos
+            path = HistoryJournal.new_path(id(self.config))
+            self._history.journal = HistoryJournal(path)
+            self._write_journal_base()
+
+        elif not enabled:
+            self._history.close_journal()
+
+    def _indexed_changed_cb(self, indexed):
+        # Solo cambian los frames que todavía no se usaron
+        if len(self._history) > 0 or self.pixelmap.get_bounds() is not None:
+            return
+
+        pixelmap = PixelMap.new(self.pixelmap.width, self.pixelmap.height, indexed=indexed)
+        if type(pixelmap) is type(self.pixelmap):
+            return
+
+        pixelmap.duration = self.pixelmap.duration
+        self.pixelmap = pixelmap
+
+        self._write_journal_base()
+        self.redraw()
+
+    def _write_journal_base(self):
+        if self._history.journal is not None:
+            self._history.journal.write_base(self.pixelmap, self._history.position)
+
+    def _destroy_cb(self, canvas):
+        self._scheduler.cancel()
+
+        if self._motion_tick is not None:
+            self.remove_tick_callback(self._motion_tick)
+            self._motion_tick = None
+
+        if self._ants_timeout is not None:
+            GLib.source_remove(self._ants_timeout)
+            self._ants_timeout = None
+
+        # La configuración sobrevive al canvas, no debería volver a abrir
+        # un journal para un canvas que ya no existe
+        self.config.disconnect("journal", self._journal_changed_cb)
+        self.config.disconnect("indexed", self._indexed_changed_cb)
+
+        # Si Spryte se cierra normalmente, no hace falta recuperar nada
+        self._history.close_journal(delete=True, load=False)
+
+    def recover_journal(self, path):
+        """
+        Restaura el PixelMap y el historial a partir de un journal que
+        quedó de una sesión que no se cerró correctamente. El journal se
+        sigue usando para los próximos cambios.
+        """
+
+        journal, base, steps, cursor = HistoryJournal.recover(path)
+        if base is None:
+            journal.close(delete=True)
+            return False
+
+        width, height, duration, indexed, chunks = base
+        if tuple(self.config.layout_size) != (width, height):
+            self.config.layout_size = (width, height)
+
+        pixelmap = PixelMap.new(width, height, indexed=indexed)
+        pixelmap.duration = duration
+        for x, y, data in chunks:
+            pixelmap.set_region(x, y, data)
+
+        self.pixelmap = pixelmap
+
+        self._history.close_journal(delete=True, load=False)
+        self._history.restore(steps, cursor)
+        self._history.journal = journal
+
+        for step in steps[:cursor]:
+            step.redo(self)
+
+        self.config.modified = True
+        self.emit("changed")
+        self.redraw()
+
+        return True
+
+    def replace_color(self, current_color, new_color, mask=None):
+        """
+        Cambia current_color (o los colores a menos de
+        config.replace_tolerance de él) por new_color, solo donde mask es
+        True si se pasa una máscara del tamaño del PixelMap. El cambio se
+        hace directamente en el PixelMap: si hay un trazo en curso se agrega
+        a él, si no se guarda como un paso nuevo del historial.
+        """
+
+        tolerance = self.config.replace_tolerance
+        if current_color == new_color and tolerance == 0:
+            return False
+
+        changed = None
+        x = y = 1
+        replace = getattr(self.pixelmap, "replace_color", None)
+        if replace is not None and tolerance == 0 and mask is None:
+            # En un IndexedPixelMap alcanza con cambiar la paleta
+            changed = replace(current_color, new_color)
+            before = Color.cairo_to_array(current_color)
+
+        if changed is None:
+            changed = PaintAlgorithms.color_mask(self.pixelmap, current_color, tolerance)
+            if mask is not None:
+                changed &= mask
+
+            crop = PaintAlgorithms.crop_mask(changed)
+            if crop is None:
+                return False
+
+            x, y, changed = crop
+            x, y = x + 1, y + 1
+
+            if tolerance == 0:
+                # Todos eran de current_color
+                before = Color.cairo_to_array(current_color)
+
+            else:
+                height, width = changed.shape
+                before = self.pixelmap.get_region(x, y, width, height)[changed]
+
+            self.pixelmap.fill_region(x, y, changed, new_color)
+
+        self.commit_change(changed, before, Color.cairo_to_array(new_color), x, y)
+
+        return True
+
+    def adjust_colors(self, adjustment, amount, mask=None):
+        """
+        Ajusta los colores de los píxeles no transparentes (ver
+        PaintAlgorithms.adjust_colors), solo donde mask es True si se pasa
+        una máscara del tamaño del PixelMap. Igual que replace_color, el
+        cambio se hace directamente en el PixelMap.
+        """
+
+        # Solo se lee el rectángulo que contiene a la máscara, o a los
+        # píxeles no transparentes si no hay máscara
+        bounds = None
+        if mask is None:
+            bounds = self.pixelmap.get_bounds()
+
+        else:
+            crop = PaintAlgorithms.crop_mask(mask)
+            if crop is not None:
+                x, y, mask = crop
+                bounds = (x + 1, y + 1, mask.shape[1], mask.shape[0])
+
+        if bounds is None:
+            return False
+
+        x, y, width, height = bounds
+        array = self.pixelmap.get_region(x, y, width, height)
+        changed = array[:, :, Color.ALPHA] > 0
+        if mask is not None:
+            changed &= mask
+
+        # Cada píxel visto como un solo entero, para copiarlos y
+        # compararlos más rápido
+        keys = array.view(numpy.uint32)[:, :, 0]
+        before = keys[changed]
+        after = PaintAlgorithms.adjust_colors(before.view(numpy.uint8).reshape(-1, 4),
+                                              adjustment, amount).view(numpy.uint32)[:, 0]
+
+        # Solo se guardan los píxeles que cambiaron de verdad
+        different = before != after
+        if not different.any():
+            return False
+
+        changed[changed] = different
+        before, after = before[different], after[different]
+
+        keys[changed] = after
+        self.pixelmap.set_region(x, y, array, changed)
+
+        before = before.view(numpy.uint8).reshape(-1, 4)
+        after = after.view(numpy.uint8).reshape(-1, 4)
+
+        self.commit_change(changed, before, after, x, y)
+
+        return True
+
+    def commit_change(self, mask, before, after, x=1, y=1):
+        """
+        Como record_change, para los cambios que pueden hacerse fuera de
+        un trazo: si hay uno en curso el cambio se agrega a él, si no se
+        guarda como un paso nuevo del historial.
+        """
+
+        if self._stroke is not None:
+            self._stroke.add(x, y, mask, before, after)
+            return
+
+        step = HistoryStep()
+        step.add(x, y, mask, before, after)
+        self._history.push(step)
+
+        self.config.modified = self._history.is_modified()
+        self.emit("changed")
+        self.redraw_dirty()
+
+    def get_selection_mask(self):
+        """
+        Devuelve la máscara (alto, ancho) de los píxeles seleccionados, de
+        solo lectura, o None si no hay ninguno.
+        """
+
+        if self.selection.is_empty():
+            return None
+
+        return self.selection.mask
+
+    def use_selection_as_brush(self):
+        """
+        Usa los píxeles seleccionados como la forma del pincel
+        BrushShape.CUSTOM. Devuelve False si no hay nada seleccionado.
+        """
+
+        bounds = self.selection.get_bounds()
+        if bounds is None:
+            return False
+
+        x, y, width, height = bounds
+        PaintAlgorithms.set_custom_brush(self.selection.mask[y - 1:y - 1 + height, x - 1:x - 1 + width])
+
+        return True
+
+    def use_selection_as_pattern(self):
+        """
+        Usa los píxeles seleccionados como la trama DitherPattern.CUSTOM.
+        Devuelve False si no hay nada seleccionado.
+        """
+
+        bounds = self.selection.get_bounds()
+        if bounds is None:
+            return False
+
+        x, y, width, height = bounds
+        PaintAlgorithms.set_custom_pattern(self.selection.mask[y - 1:y - 1 + height, x - 1:x - 1 + width])
+
+        return True
+
+    def set_selection(self, selection):
+        bounds = self.selection.get_bounds()
+        self.selection = selection
+        self._selection_changed(bounds)
+
+    def update_selection(self, x, y, mask):
+        """
+        Reemplaza la selección por la que había al empezar a usar la
+        herramienta de selección, combinada con los píxeles donde mask es
+        True (con mask en la posición (x, y)) según las teclas que se
+        apretaron al hacer click. Ver _get_selection_mode.
+        """
+
+        if self._selection_base is None:
+            selection = self.selection.copy()
+
+        else:
+            selection = self._selection_base.copy()
+
+        selection.combine(x, y, mask, self._selection_mode)
+        self.set_selection(selection)
+
+    def _selection_changed(self, old_bounds):
+        self._selection_surface = None
+
+        # Lo que estaba seleccionado y lo que lo está ahora
+        for bounds in [old_bounds, self.selection.get_bounds()]:
+            if bounds is not None:
+                self.invalidate_region(*bounds)
+
+        if self.selection.is_empty():
+            if self._ants_timeout is not None:
+                GLib.source_remove(self._ants_timeout)
+                self._ants_timeout = None
+
+        elif self._ants_timeout is None:
+            self._ants_timeout = GLib.timeout_add(self.ANTS_INTERVAL, self._ants_cb)
+
+    def _ants_cb(self):
+        self._ants_offset = (self._ants_offset + 1) % (2 * self.ANTS_DASH)
+
+        bounds = self.selection.get_bounds()
+        if bounds is not None:
+            self.invalidate_region(*bounds)
+
+        return GLib.SOURCE_CONTINUE
+
+    def lift_floating(self):
+        """
+        Saca del PixelMap los píxeles seleccionados (o todos si no hay
+        selección) a una capa flotante que se mueve con move_floating sin
+        modificar el PixelMap, hasta que se vuelve a pegar con
+        drop_floating. Los dos cambios forman parte del mismo trazo.
+        """
+
+        if self.selection.is_empty():
+            bounds = self.pixelmap.get_bounds()
+            if bounds is None:
+                return
+
+            x, y, width, height = bounds
+            mask = numpy.ones((height, width), dtype=bool)
+
+        else:
+            x, y, width, height = self.selection.get_bounds()
+            mask = self.selection.mask[y - 1:y - 1 + height, x - 1:x - 1 + width]
+
+        data = self.pixelmap.get_region(x, y, width, height)
+        mask = mask & (data[:, :, Color.ALPHA] != 0)
+        if not mask.any():
+            return
+
+        self.pixelmap.fill_region(x, y, mask, Color.TRANSPARENT)
+        self.record_change(x, y, mask, data[mask], Color.cairo_to_array(Color.TRANSPARENT))
+
+        data[~mask] = 0
+        self._floating_surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+        upload_region(self._floating_surface, 0, 0, data)
+
+        self._floating = [x, y, 0, 0, data, mask]
+        self.redraw_dirty()
+
+    def _get_floating_rect(self):
+        x, y, dx, dy, data, mask = self._floating
+        height, width = mask.shape
+
+        return x + dx, y + dy, width, height
+
+    def _invalidate_floating(self):
+        self.invalidate_region(*self._get_floating_rect())
+
+        bounds = self.selection.get_bounds()
+        if bounds is not None:
+            x, y, width, height = bounds
+            dx, dy = self._floating[2:4]
+            self.invalidate_region(x + dx, y + dy, width, height)
+
+    def move_floating(self, dx, dy):
+        """
+        Mueve la capa flotante (dx, dy) píxeles desde donde se sacó.
+        """
+
+        if self._floating is None or self._floating[2:4] == [dx, dy]:
+            return
+
+        self._invalidate_floating()
+        self._floating[2:4] = [dx, dy]
+        self._invalidate_floating()
+
+    def drop_floating(self):
+        """
+        Pega la capa flotante en el PixelMap, en su posición actual. La
+        selección se mueve con ella.
+        """
+
+        if self._floating is None:
+            return
+
+        self._invalidate_floating()
+
+        x, y, dx, dy, data, mask = self._floating
+        height, width = mask.shape
+        x, y = x + dx, y + dy
+
+        # Lo que queda fuera del PixelMap se pierde
+        inside = numpy.zeros_like(mask)
+        x0, y0 = max(1 - x, 0), max(1 - y, 0)
+        x1, y1 = min(self.pixelmap.width - x + 1, width), min(self.pixelmap.height - y + 1, height)
+        if x0 < x1 and y0 < y1:
+            inside[y0:y1, x0:x1] = mask[y0:y1, x0:x1]
+
+        before = self.pixelmap.get_region(x, y, width, height)
+        self.pixelmap.set_region(x, y, data, inside)
+        self.record_change(x, y, inside, before[inside], data[inside])
+
+        if not self.selection.is_empty() and (dx, dy) != (0, 0):
+            selection = self.selection.copy()
+            selection.translate(dx, dy)
+            self.set_selection(selection)
+
+        self._floating = None
+        self._floating_surface = None
+        self.redraw_dirty()
+
     def select_pixel(self, x, y):
-        coord = (x, y)
-        if not coord in self._selected_pixels:
-            self._selected_pixels.append(coord)
+        if (x, y) not in self.selection:
+            bounds = self.selection.get_bounds()
+            self.selection.set_pixel(x, y, True)
+            self._selection_changed(bounds)
 
     def unselect_pixel(self, x, y):
-        coord = (x, y)
-        if coord in self._selected_pixels:
-            self._selected_pixels.remove(coord)
+        if (x, y) in self.selection:
+            bounds = self.selection.get_bounds()
+            self.selection.set_pixel(x, y, False)
+            self._selection_changed(bounds)
 
     def unselect_all_pixels(self):
-        while len(self._selected_pixels) > 0:
-            self.unselect_pixel(*self._selected_pixels[0])
+        if not self.selection.is_empty():
+            bounds = self.selection.get_bounds()
+            self.selection.clear()
+            self._selection_changed(bounds)
 
 
 class CanvasContainer(Gtk.Box):
@@ -685,6 +2801,7 @@ class CanvasContainer(Gtk.Box):
         "secondary-color-picked": (GObject.SIGNAL_RUN_LAST, None, [GObject.TYPE_PYOBJECT]),
         "changed": (GObject.SIGNAL_RUN_LAST, None, []),
         "size-changed": (GObject.SIGNAL_RUN_LAST, None, []),
+        "replace-color-in-frames": (GObject.SIGNAL_RUN_LAST, None, [GObject.TYPE_PYOBJECT, GObject.TYPE_PYOBJECT]),
     }
 
     def __init__(self, *args, **kargs):
@@ -708,11 +2825,27 @@ class CanvasContainer(Gtk.Box):
         self.canvas.connect("size-changed", self._size_changed_cb)
         self.canvas.connect("primary-color-picked", self._primary_color_picked_cb)
         self.canvas.connect("secondary-color-picked", self._secondary_color_picked_cb)
+        self.canvas.connect("replace-color-in-frames", self._replace_color_in_frames_cb)
         box2.pack_start(self.canvas, True, False, 0)
 
         self.config = self.canvas.config
         self.pixelmap = self.canvas.pixelmap
 
+        for adjustment in [self.scroll.get_hadjustment(), self.scroll.get_vadjustment()]:
+            adjustment.connect("value-changed", self._viewport_changed_cb)
+            adjustment.connect("changed", self._viewport_changed_cb)
+
+    def _viewport_changed_cb(self, adjustment):
+        # El ScrolledWindow solo dibuja las franjas que aparecen al hacer
+        # scroll, pero el canvas tiene que saber qué parte se ve para no
+        # redibujar lo que quedó afuera
+        coords = self.scroll.translate_coordinates(self.canvas, 0, 0)
+        if coords is None:
+            return
+
+        alloc = self.scroll.get_allocation()
+        self.canvas.set_viewport(coords[0], coords[1], alloc.width, alloc.height)
+
     def _changed_cb(self, canvas):
         self.emit("changed")
 
@@ -725,15 +2858,42 @@ class CanvasContainer(Gtk.Box):
     def _secondary_color_picked_cb(self, canvas, color):
         self.emit("secondary-color-picked", color)
 
+    def _replace_color_in_frames_cb(self, canvas, current_color, new_color):
+        self.emit("replace-color-in-frames", current_color, new_color)
+
     def get_pixelmap(self):
         return self.canvas.get_pixelmap()
 
+    def replace_color(self, current_color, new_color, mask=None):
+        return self.canvas.replace_color(current_color, new_color, mask)
+
+    def adjust_colors(self, adjustment, amount, mask=None):
+        return self.canvas.adjust_colors(adjustment, amount, mask)
+
+    def get_selection_mask(self):
+        return self.canvas.get_selection_mask()
+
+    def use_selection_as_brush(self):
+        return self.canvas.use_selection_as_brush()
+
+    def use_selection_as_pattern(self):
+        return self.canvas.use_selection_as_pattern()
+
     def set_pixelmap(self, pixelmap, *args, **kargs):
         self.canvas.set_pixelmap(pixelmap, *args, **kargs)
 
     def set_file(self, file, refresh=True):
         self.canvas.set_file(file, refresh=refresh)
 
+    def mark_saved(self):
+        self.canvas.mark_saved()
+
+    def set_duration(self, duration):
+        self.canvas.set_duration(duration)
+
+    def recover_journal(self, path):
+        return self.canvas.recover_journal(path)
+
     def get_file(self):
         return self.canvas.get_file()
 
@@ -3,9 +3,10 @@
 
 from .utils import Color
 from .utils import FileManagement
-from .canvas import Canvas
 from .canvas import CanvasConfig
 from .canvas import CanvasContainer
+from .renderer import PatternCache
+from .renderer import render_thumbnail
 
 from gi.repository import Gtk
 from gi.repository import Gdk
@@ -13,7 +14,75 @@ from gi.repository import GLib
 from gi.repository import GObject
 
 
-TAB_CANVAS_CONFIG = None
+class FrameThumbnail(Gtk.DrawingArea):
+    """
+    Miniatura de un frame. Se dibuja desde una superficie ya escalada
+    que se regenera un rato después del último cambio (no al dibujar),
+    y solo si la pestaña se ve; si no, se regenera cuando aparece.
+    """
+
+    SIZE = 100
+    DELAY = 300  # En milisegundos
+
+    def __init__(self, associated_canvas):
+        Gtk.DrawingArea.__init__(self)
+
+        self._associated = associated_canvas
+        self._surface = None
+        self._stale = True
+        self._timeout_update = None
+        self._patterns = PatternCache()
+
+        self.set_size_request(self.SIZE, self.SIZE)
+
+        self.connect("draw", self._draw_cb)
+        self.connect("map", self._map_cb)
+        self.connect("destroy", self._destroy_cb)
+
+    def _draw_cb(self, widget, ctx):
+        ctx.set_source(self._patterns.checkerboard)
+        ctx.paint()
+
+        if self._surface is None:
+            return
+
+        alloc = self.get_allocation()
+        x = (alloc.width - self._surface.get_width()) // 2
+        y = (alloc.height - self._surface.get_height()) // 2
+
+        ctx.set_source_surface(self._surface, x, y)
+        ctx.paint()
+
+    def _map_cb(self, widget):
+        if self._stale:
+            self.update()
+
+    def _destroy_cb(self, widget):
+        if self._timeout_update is not None:
+            GLib.source_remove(self._timeout_update)
+            self._timeout_update = None
+
+    def _timeout_update_cb(self):
+        self._timeout_update = None
+
+        if self.get_mapped():
+            self.update()
+
+        return GLib.SOURCE_REMOVE
+
+    def queue_update(self):
+        self._stale = True
+
+        if self._timeout_update is not None:
+            GLib.source_remove(self._timeout_update)
+
+        self._timeout_update = GLib.timeout_add(self.DELAY, self._timeout_update_cb)
+
+    def update(self):
+        self._surface = render_thumbnail(self._associated.get_pixelmap(),
+                                         self.SIZE, self.SIZE)
+        self._stale = False
+        self.queue_draw()
 
 
 class CanvasNotebookTab(Gtk.Box):
@@ -43,23 +112,8 @@ class CanvasNotebookTab(Gtk.Box):
         self.overlay.connect("leave-notify-event", self._leave_cb)
         self.pack_start(self.overlay, True, True, 0)
 
-        # FIXME: El tamaño del canvas de los tabs debería ser fijo, siempre
-        # Si cierro el programa y lo abro con algún proyecto a medias,
-        # probablemente el tamaño de las pestañas cambie, el siguiente código
-        # solo previene que un tab nuevo tenga un tamaño diferente (al haber
-        # cambiado el tamaño del canvas antes de que se cree este tab.
-        global TAB_CANVAS_CONFIG
-        if TAB_CANVAS_CONFIG is None:
-            TAB_CANVAS_CONFIG = CanvasConfig(
-                zoom=500,
-                layout_size=self._associated.config.layout_size,
-                resizable=False,
-                editable=False)
-
-        self.canvas = Canvas(config=TAB_CANVAS_CONFIG)
-        self.canvas.set_size_request(100, 100)
-        # self.canvas.set_resizable(False)
-        self.overlay.add(self.canvas)
+        self.thumbnail = FrameThumbnail(self._associated)
+        self.overlay.add(self.thumbnail)
 
         overlay_box = Gtk.Box()
 
@@ -128,8 +182,8 @@ class CanvasNotebookTab(Gtk.Box):
 
         self._timeout_leave = GLib.timeout_add(200, hide_revealers, None)
 
-    def get_canvas(self):
-        return self.canvas
+    def get_thumbnail(self):
+        return self.thumbnail
 
     def set_index(self, index):
         self.index_label.set_label(str(index))
@@ -140,6 +194,7 @@ class CanvasesNotebook(Gtk.Notebook):
     __gsignals__ = {
         "primary-color-picked": (GObject.SIGNAL_RUN_LAST, None, [GObject.TYPE_PYOBJECT]),
         "secondary-color-picked": (GObject.SIGNAL_RUN_LAST, None, [GObject.TYPE_PYOBJECT]),
+        "frame-changed": (GObject.SIGNAL_RUN_LAST, None, [GObject.TYPE_PYOBJECT]),
     }
 
     def __init__(self):
@@ -165,14 +220,12 @@ class CanvasesNotebook(Gtk.Notebook):
             self.set_current_page(self.get_n_pages() - 2)
 
     def _canvas_changed_cb(self, canvas):
-        tab_canvas = self.canvases[canvas].get_canvas()
-        tab_canvas.set_pixelmap(canvas.get_pixelmap())
+        self.canvases[canvas].get_thumbnail().queue_update()
+        self.emit("frame-changed", canvas)
 
     def _canvas_size_changed_cb(self, canvas):
-        tab_canvas = self.canvases[canvas].get_canvas()
-
-        tab_canvas.config._layout_size = canvas.config.layout_size
-        tab_canvas.resize()
+        self.canvases[canvas].get_thumbnail().queue_update()
+        self.emit("frame-changed", canvas)
 
     def _copy_tab_cb(self, tab):
         idx = self.get_children().index(tab._associated)
@@ -208,6 +261,9 @@ class CanvasesNotebook(Gtk.Notebook):
     def _secondary_color_picked_cb(self, canvas, color):
         self.emit("secondary-color-picked", color)
 
+    def _replace_color_in_frames_cb(self, canvas, current_color, new_color):
+        self.replace_color(current_color, new_color)
+
     def _page_reordered_cb(self, notebook, child, page_num):
         if page_num == len(self.get_children()) - 1:
             self.append_page()
@@ -228,6 +284,7 @@ class CanvasesNotebook(Gtk.Notebook):
         canvas.connect("size-changed", self._canvas_size_changed_cb)
         canvas.connect("primary-color-picked", self._primary_color_picked_cb)
         canvas.connect("secondary-color-picked", self._secondary_color_picked_cb)
+        canvas.connect("replace-color-in-frames", self._replace_color_in_frames_cb)
 
         tab = CanvasNotebookTab(canvas)
         tab.connect("copy", self._copy_tab_cb)
@@ -258,6 +315,30 @@ class CanvasesNotebook(Gtk.Notebook):
     def set_tool_size(self, size):
         self._canvas_config.tool_size = size
 
+    def set_brush_shape(self, shape):
+        self._canvas_config.brush_shape = shape
+
+    def use_selection_as_brush(self):
+        return self.get_current_canvas().use_selection_as_brush()
+
+    def set_dither_pattern(self, pattern):
+        self._canvas_config.dither_pattern = pattern
+
+    def set_dither_level(self, level):
+        self._canvas_config.dither_level = level
+
+    def use_selection_as_pattern(self):
+        return self.get_current_canvas().use_selection_as_pattern()
+
+    def set_symmetry_mode(self, mode):
+        self._canvas_config.symmetry_mode = mode
+
+    def set_symmetry_folds(self, folds):
+        self._canvas_config.symmetry_folds = folds
+
+    def set_symmetry_center(self, center):
+        self._canvas_config.symmetry_center = center
+
     def set_layout_size(self, size):
         self._canvas_config.layout_size = size
 
@@ -274,7 +355,7 @@ class CanvasesNotebook(Gtk.Notebook):
         return self.get_children()[self.get_current_page()]
 
     def open_file(self, file):
-        pixelmaps = FileManagement.open(file)
+        pixelmaps = FileManagement.open(file, self._canvas_config.indexed)
         canvases_dict = self.canvases.copy()
 
         canvases = []
@@ -290,16 +371,75 @@ class CanvasesNotebook(Gtk.Notebook):
         if len(pixelmaps) > 1:
             self.append_page()
 
+    def recover_journals(self, paths):
+        canvases_dict = self.canvases.copy()
+
+        canvases = []
+        for path in paths:
+            canvas = self.append_page()
+            canvas.recover_journal(path)
+            self._canvas_changed_cb(canvas)
+            canvases.append(canvas)
+
+        for canvas in canvases_dict.keys():
+            if canvas not in canvases:
+                self._delete_tab_cb(canvases_dict[canvas])
+
+        if len(paths) > 1:
+            self.append_page()
+
+    def set_journal(self, enabled):
+        self._canvas_config.journal = enabled
+
+    def set_indexed(self, indexed):
+        self._canvas_config.indexed = indexed
+
+    def set_fill_connectivity(self, connectivity):
+        self._canvas_config.fill_connectivity = connectivity
+
+    def set_replace_tolerance(self, tolerance):
+        self._canvas_config.replace_tolerance = tolerance
+
+    def set_replace_scope(self, scope):
+        self._canvas_config.replace_scope = scope
+
+    def set_adjustment(self, adjustment):
+        self._canvas_config.adjustment = adjustment
+
+    def set_adjustment_amount(self, amount):
+        self._canvas_config.adjustment_amount = amount
+
+    def adjust_colors(self):
+        # Sobre la selección, o sobre todo el frame si no hay nada
+        # seleccionado
+        canvas = self.get_current_canvas()
+        return canvas.adjust_colors(self._canvas_config.adjustment,
+                                    self._canvas_config.adjustment_amount / 100,
+                                    canvas.get_selection_mask())
+
+    def replace_color(self, current_color, new_color):
+        # Cada frame guarda el cambio en su propio historial
+        for canvas in self.get_frames():
+            canvas.replace_color(current_color, new_color)
+
     def get_file(self):
         return self._canvas_config.file
 
     def set_file(self, file, refresh=True):
         self._canvas_config.file = file
 
+    def mark_saved(self):
+        for canvas in self.get_frames():
+            canvas.mark_saved()
+
+    def get_frames(self):
+        # La última página siempre es la que agrega un frame nuevo
+        return self.get_children()[:-1]
+
     def get_pixelmaps(self):
         pixelmaps = []
 
-        for canvas in self.get_children()[:-1]:
+        for canvas in self.get_frames():
             pixelmaps.append(canvas.get_pixelmap())
 
         return pixelmaps
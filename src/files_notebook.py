@@ -144,6 +144,9 @@ class FilesNotebook(Gtk.Notebook):
             idx = self.get_children().index(notebook)
             super().remove_page(idx)
 
+            del self.notebooks[notebook]
+            notebook.destroy()
+
         if self.get_n_pages() == 0:
             self.append_page()
 
@@ -2,23 +2,48 @@
 # -*- coding: utf-8 -*-
 
 from .canvas import CanvasConfig
+from .utils import BrushShape
+from .utils import ReplaceScope
+from .utils import ColorAdjustment
+from .utils import DitherPattern
+from .symmetry import SymmetryMode
 from .utils import gtk_version_newer_than
 
 from gi.repository import Gtk
 from gi.repository import GObject
 
+MAX_LAYOUT_SIZE = 8192
+MAX_TOOL_SIZE = 256
+
 
 class HeaderBar(Gtk.HeaderBar):
 
     __gsignals__ = {
         "tool-size-changed": (GObject.SIGNAL_RUN_LAST, None, [GObject.TYPE_INT]),
+        "brush-shape-changed": (GObject.SIGNAL_RUN_LAST, None, [GObject.TYPE_INT]),
+        "brush-from-selection": (GObject.SIGNAL_RUN_LAST, None, []),
         "layout-size-changed": (GObject.SIGNAL_RUN_LAST, None, [GObject.TYPE_PYOBJECT]),
+        "journal-changed": (GObject.SIGNAL_RUN_LAST, None, [GObject.TYPE_BOOLEAN]),
+        "indexed-changed": (GObject.SIGNAL_RUN_LAST, None, [GObject.TYPE_BOOLEAN]),
+        "fill-connectivity-changed": (GObject.SIGNAL_RUN_LAST, None, [GObject.TYPE_INT]),
+        "replace-tolerance-changed": (GObject.SIGNAL_RUN_LAST, None, [GObject.TYPE_INT]),
+        "replace-scope-changed": (GObject.SIGNAL_RUN_LAST, None, [GObject.TYPE_INT]),
+        "adjustment-changed": (GObject.SIGNAL_RUN_LAST, None, [GObject.TYPE_INT]),
+        "adjustment-amount-changed": (GObject.SIGNAL_RUN_LAST, None, [GObject.TYPE_INT]),
+        "adjust-colors": (GObject.SIGNAL_RUN_LAST, None, []),
+        "dither-pattern-changed": (GObject.SIGNAL_RUN_LAST, None, [GObject.TYPE_INT]),
+        "dither-level-changed": (GObject.SIGNAL_RUN_LAST, None, [GObject.TYPE_INT]),
+        "pattern-from-selection": (GObject.SIGNAL_RUN_LAST, None, []),
+        "symmetry-mode-changed": (GObject.SIGNAL_RUN_LAST, None, [GObject.TYPE_INT]),
+        "symmetry-folds-changed": (GObject.SIGNAL_RUN_LAST, None, [GObject.TYPE_INT]),
+        "symmetry-center-changed": (GObject.SIGNAL_RUN_LAST, None, [GObject.TYPE_PYOBJECT]),
     }
 
     def __init__(self):
         super(HeaderBar, self).__init__()
 
         self._layout_size = list(CanvasConfig.DEFAULT_LAYOUT_SIZE)
+        self._symmetry_center = CanvasConfig.DEFAULT_SYMMETRY_CENTER
 
         self.set_show_close_button(True)
         self._create_tool_size_buttons()
@@ -33,6 +58,12 @@ class HeaderBar(Gtk.HeaderBar):
 
         self._create_options_popover()
 
+        preview_button = Gtk.Button.new_from_icon_name("media-playback-start-symbolic",
+                                                       Gtk.IconSize.BUTTON)
+        preview_button.set_tooltip_text("Vista previa de la animación")
+        preview_button.set_action_name("app.preview")
+        self.pack_end(preview_button)
+
     def _options_button_toggled_cb(self, button):
         if self.options_button.get_active():
             self.options_popover.show_all()
@@ -47,22 +78,22 @@ class HeaderBar(Gtk.HeaderBar):
         self.options_button.set_active(False)
 
     def _create_tool_size_buttons(self):
-        hbox = Gtk.Box()
-        hbox.set_orientation(Gtk.Orientation.HORIZONTAL)
-        hbox.get_style_context().add_class("linked")
-
-        _button = None
-        for x in range(1, 5):
-            button = Gtk.RadioButton.new_with_mnemonic_from_widget(
-                _button, "_%d" % x)
+        tool_size_spinner = Gtk.SpinButton.new_with_range(1, MAX_TOOL_SIZE, 1)
+        tool_size_spinner.set_value(CanvasConfig.DEFAULT_TOOL_SIZE)
+        tool_size_spinner.set_tooltip_text("Tamaño de la herramienta")
+        tool_size_spinner.connect("value-changed", self._tool_size_changed)
 
-            button.set_mode(False)
-            button.connect("toggled", self._tool_size_changed, x)
-            hbox.pack_start(button, False, False, 0)
+        self.pack_start(tool_size_spinner)
 
-            _button = button
+        self.brush_shape_combo = Gtk.ComboBoxText()
+        self.brush_shape_combo.append(str(BrushShape.SQUARE), "Cuadrado")
+        self.brush_shape_combo.append(str(BrushShape.ROUND), "Redondo")
+        self.brush_shape_combo.append(str(BrushShape.CUSTOM), "Personalizado")
+        self.brush_shape_combo.set_active_id(str(CanvasConfig.DEFAULT_BRUSH_SHAPE))
+        self.brush_shape_combo.set_tooltip_text("Forma del pincel")
+        self.brush_shape_combo.connect("changed", self._brush_shape_changed)
 
-        self.pack_start(hbox)
+        self.pack_start(self.brush_shape_combo)
 
     def _create_options_popover(self):
         self.options_popover = Gtk.Popover()
@@ -86,7 +117,7 @@ class HeaderBar(Gtk.HeaderBar):
 
         default_width, default_height = self._layout_size
 
-        width_spinner = Gtk.SpinButton.new_with_range(1, 1024, 1)
+        width_spinner = Gtk.SpinButton.new_with_range(1, MAX_LAYOUT_SIZE, 1)
         width_spinner.set_value(default_width)
         row.pack_end(width_spinner, False, False, 0)
 
@@ -96,15 +127,236 @@ class HeaderBar(Gtk.HeaderBar):
         label = Gtk.Label.new("Alto:")
         row.pack_start(label, False, False, 0)
 
-        height_spinner = Gtk.SpinButton.new_with_range(1, 1024, 1)
+        height_spinner = Gtk.SpinButton.new_with_range(1, MAX_LAYOUT_SIZE, 1)
         height_spinner.set_value(default_height)
         row.pack_end(height_spinner, False, False, 0)
 
         width_spinner.connect("value-changed", self._layout_size_changed, 0)
         height_spinner.connect("value-changed", self._layout_size_changed, 1)
 
-    def _tool_size_changed(self, button, size):
-        self.emit("tool-size-changed", size)
+        brush_button = Gtk.Button.new_with_label("Usar la selección como pincel")
+        brush_button.connect("clicked", self._brush_from_selection)
+        vbox.pack_start(brush_button, False, False, 0)
+
+        journal_check = Gtk.CheckButton.new_with_label("Guardar el historial en disco")
+        journal_check.set_active(CanvasConfig.DEFAULT_JOURNAL)
+        journal_check.connect("toggled", self._journal_changed)
+        vbox.pack_start(journal_check, False, False, 0)
+
+        indexed_check = Gtk.CheckButton.new_with_label("Usar una paleta en los frames nuevos")
+        indexed_check.set_active(CanvasConfig.DEFAULT_INDEXED)
+        indexed_check.connect("toggled", self._indexed_changed)
+        vbox.pack_start(indexed_check, False, False, 0)
+
+        diagonal_check = Gtk.CheckButton.new_with_label("Rellenar también en diagonal")
+        diagonal_check.set_active(CanvasConfig.DEFAULT_FILL_CONNECTIVITY == 8)
+        diagonal_check.connect("toggled", self._fill_connectivity_changed)
+        vbox.pack_start(diagonal_check, False, False, 0)
+
+        row = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+        vbox.pack_start(row, False, False, 0)
+
+        label = Gtk.Label.new("Tolerancia al reemplazar:")
+        row.pack_start(label, False, False, 0)
+
+        # 510 es la distancia entre transparente y blanco
+        tolerance_spinner = Gtk.SpinButton.new_with_range(0, 510, 1)
+        tolerance_spinner.set_value(CanvasConfig.DEFAULT_REPLACE_TOLERANCE)
+        tolerance_spinner.connect("value-changed", self._replace_tolerance_changed)
+        row.pack_end(tolerance_spinner, False, False, 0)
+
+        row = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+        vbox.pack_start(row, False, False, 0)
+
+        label = Gtk.Label.new("Reemplazar en:")
+        row.pack_start(label, False, False, 0)
+
+        scope_combo = Gtk.ComboBoxText()
+        scope_combo.append(str(ReplaceScope.FRAME), "Este frame")
+        scope_combo.append(str(ReplaceScope.SELECTION), "La selección")
+        scope_combo.append(str(ReplaceScope.ALL_FRAMES), "Todos los frames")
+        scope_combo.set_active_id(str(CanvasConfig.DEFAULT_REPLACE_SCOPE))
+        scope_combo.connect("changed", self._replace_scope_changed)
+        row.pack_end(scope_combo, False, False, 0)
+
+        row = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+        vbox.pack_start(row, False, False, 0)
+
+        label = Gtk.Label.new("Ajuste de color:")
+        row.pack_start(label, False, False, 0)
+
+        adjustment_combo = Gtk.ComboBoxText()
+        adjustment_combo.append(str(ColorAdjustment.LIGHTEN), "Aclarar")
+        adjustment_combo.append(str(ColorAdjustment.DARKEN), "Oscurecer")
+        adjustment_combo.append(str(ColorAdjustment.HUE), "Tono")
+        adjustment_combo.append(str(ColorAdjustment.SATURATION), "Saturación")
+        adjustment_combo.set_active_id(str(CanvasConfig.DEFAULT_ADJUSTMENT))
+        adjustment_combo.connect("changed", self._adjustment_changed)
+        row.pack_end(adjustment_combo, False, False, 0)
+
+        row = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+        vbox.pack_start(row, False, False, 0)
+
+        label = Gtk.Label.new("Cantidad (%):")
+        row.pack_start(label, False, False, 0)
+
+        amount_spinner = Gtk.SpinButton.new_with_range(1, 100, 1)
+        amount_spinner.set_value(CanvasConfig.DEFAULT_ADJUSTMENT_AMOUNT)
+        amount_spinner.connect("value-changed", self._adjustment_amount_changed)
+        row.pack_end(amount_spinner, False, False, 0)
+
+        adjust_button = Gtk.Button.new_with_label("Ajustar la selección")
+        adjust_button.set_tooltip_text("Si no hay nada seleccionado se ajusta todo el frame")
+        adjust_button.connect("clicked", self._adjust_colors)
+        vbox.pack_start(adjust_button, False, False, 0)
+
+        row = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+        vbox.pack_start(row, False, False, 0)
+
+        label = Gtk.Label.new("Trama:")
+        row.pack_start(label, False, False, 0)
+
+        self.dither_pattern_combo = Gtk.ComboBoxText()
+        self.dither_pattern_combo.append(str(DitherPattern.BAYER_2), "Bayer 2x2")
+        self.dither_pattern_combo.append(str(DitherPattern.BAYER_4), "Bayer 4x4")
+        self.dither_pattern_combo.append(str(DitherPattern.BAYER_8), "Bayer 8x8")
+        self.dither_pattern_combo.append(str(DitherPattern.CUSTOM), "Personalizada")
+        self.dither_pattern_combo.set_active_id(str(CanvasConfig.DEFAULT_DITHER_PATTERN))
+        self.dither_pattern_combo.connect("changed", self._dither_pattern_changed)
+        row.pack_end(self.dither_pattern_combo, False, False, 0)
+
+        row = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+        vbox.pack_start(row, False, False, 0)
+
+        label = Gtk.Label.new("Densidad de la trama (%):")
+        row.pack_start(label, False, False, 0)
+
+        level_spinner = Gtk.SpinButton.new_with_range(0, 100, 1)
+        level_spinner.set_value(CanvasConfig.DEFAULT_DITHER_LEVEL)
+        level_spinner.connect("value-changed", self._dither_level_changed)
+        row.pack_end(level_spinner, False, False, 0)
+
+        pattern_button = Gtk.Button.new_with_label("Usar la selección como trama")
+        pattern_button.connect("clicked", self._pattern_from_selection)
+        vbox.pack_start(pattern_button, False, False, 0)
+
+        row = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+        vbox.pack_start(row, False, False, 0)
+
+        label = Gtk.Label.new("Simetría:")
+        row.pack_start(label, False, False, 0)
+
+        symmetry_combo = Gtk.ComboBoxText()
+        symmetry_combo.append(str(SymmetryMode.NONE), "Ninguna")
+        symmetry_combo.append(str(SymmetryMode.VERTICAL), "Vertical")
+        symmetry_combo.append(str(SymmetryMode.HORIZONTAL), "Horizontal")
+        symmetry_combo.append(str(SymmetryMode.BOTH), "Vertical y horizontal")
+        symmetry_combo.append(str(SymmetryMode.RADIAL), "Radial")
+        symmetry_combo.set_active_id(str(CanvasConfig.DEFAULT_SYMMETRY_MODE))
+        symmetry_combo.connect("changed", self._symmetry_mode_changed)
+        row.pack_end(symmetry_combo, False, False, 0)
+
+        row = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+        vbox.pack_start(row, False, False, 0)
+
+        label = Gtk.Label.new("Copias (radial):")
+        row.pack_start(label, False, False, 0)
+
+        folds_spinner = Gtk.SpinButton.new_with_range(2, 16, 1)
+        folds_spinner.set_value(CanvasConfig.DEFAULT_SYMMETRY_FOLDS)
+        folds_spinner.connect("value-changed", self._symmetry_folds_changed)
+        row.pack_end(folds_spinner, False, False, 0)
+
+        row = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+        vbox.pack_start(row, False, False, 0)
+
+        label = Gtk.Label.new("Centro:")
+        row.pack_start(label, False, False, 0)
+
+        center_button = Gtk.Button.new_with_label("Centrar")
+        center_button.connect("clicked", self._symmetry_centered)
+        row.pack_end(center_button, False, False, 0)
+
+        # De a medio píxel, así el eje puede pasar por el medio de un
+        # píxel o entre dos
+        self.symmetry_center_spinners = []
+        for size in reversed(self._layout_size):
+            spinner = Gtk.SpinButton.new_with_range(0, MAX_LAYOUT_SIZE, 0.5)
+            spinner.set_digits(1)
+            spinner.set_value(size / 2)
+            spinner.connect("value-changed", self._symmetry_center_changed)
+            row.pack_end(spinner, False, False, 0)
+
+            self.symmetry_center_spinners.insert(0, spinner)
+
+    def _tool_size_changed(self, spinner):
+        self.emit("tool-size-changed", int(spinner.get_value()))
+
+    def _brush_shape_changed(self, combo):
+        self.emit("brush-shape-changed", int(combo.get_active_id()))
+
+    def _brush_from_selection(self, button):
+        self.emit("brush-from-selection")
+        self.brush_shape_combo.set_active_id(str(BrushShape.CUSTOM))
+
+    def _journal_changed(self, button):
+        self.emit("journal-changed", button.get_active())
+
+    def _indexed_changed(self, button):
+        self.emit("indexed-changed", button.get_active())
+
+    def _fill_connectivity_changed(self, button):
+        self.emit("fill-connectivity-changed", 8 if button.get_active() else 4)
+
+    def _replace_tolerance_changed(self, spinner):
+        self.emit("replace-tolerance-changed", int(spinner.get_value()))
+
+    def _replace_scope_changed(self, combo):
+        self.emit("replace-scope-changed", int(combo.get_active_id()))
+
+    def _adjustment_changed(self, combo):
+        self.emit("adjustment-changed", int(combo.get_active_id()))
+
+    def _adjustment_amount_changed(self, spinner):
+        self.emit("adjustment-amount-changed", int(spinner.get_value()))
+
+    def _adjust_colors(self, button):
+        self.emit("adjust-colors")
+
+    def _dither_pattern_changed(self, combo):
+        self.emit("dither-pattern-changed", int(combo.get_active_id()))
+
+    def _dither_level_changed(self, spinner):
+        self.emit("dither-level-changed", int(spinner.get_value()))
+
+    def _pattern_from_selection(self, button):
+        self.emit("pattern-from-selection")
+        self.dither_pattern_combo.set_active_id(str(DitherPattern.CUSTOM))
+
+    def _symmetry_mode_changed(self, combo):
+        self.emit("symmetry-mode-changed", int(combo.get_active_id()))
+
+    def _symmetry_folds_changed(self, spinner):
+        self.emit("symmetry-folds-changed", int(spinner.get_value()))
+
+    def _symmetry_center_changed(self, spinner):
+        self._symmetry_center = tuple(spinner.get_value() for spinner in self.symmetry_center_spinners)
+        self.emit("symmetry-center-changed", self._symmetry_center)
+
+    def _symmetry_centered(self, button):
+        self._symmetry_center = None
+        self._update_symmetry_center()
+        self.emit("symmetry-center-changed", None)
+
+    def _update_symmetry_center(self):
+        # Sin un centro elegido, los spinners muestran el del sprite
+        if self._symmetry_center is not None:
+            return
+
+        for spinner, size in zip(self.symmetry_center_spinners, self._layout_size):
+            spinner.handler_block_by_func(self._symmetry_center_changed)
+            spinner.set_value(size / 2)
+            spinner.handler_unblock_by_func(self._symmetry_center_changed)
 
     def _layout_size_changed(self, widget, index):
         """
@@ -125,4 +377,5 @@ class HeaderBar(Gtk.HeaderBar):
         """
 
         self._layout_size[index] = int(widget.get_value())
+        self._update_symmetry_center()
         self.emit("layout-size-changed", tuple(self._layout_size))
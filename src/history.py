@@ -0,0 +1,694 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import mmap
+import zlib
+import struct
+import numpy
+
+from gi.repository import GLib
+
+
+class HistoryStep(object):
+    """
+    Cambios hechos por un trazo. Por cada región modificada se guarda la
+    máscara de los píxeles que cambiaron y sus colores (RGBA uint8) antes
+    y después del cambio, así deshacer y rehacer cuestan lo mismo que el
+    trazo y no dependen del tamaño del canvas.
+    """
+
+    def __init__(self):
+        self.changes = []
+
+    def add(self, x, y, mask, before, after):
+        """
+        (x, y) es la esquina superior izquierda de mask, en coordenadas que
+        empiezan en 1. before y after son arrays (n, 4) con los colores de
+        los n píxeles donde mask es True, o un solo color si todos los
+        píxeles tenían (o tienen) el mismo.
+        """
+
+        # Solo se guarda el rectángulo que contiene a los píxeles cambiados
+        # (buscando las filas y columnas, sin armar la lista de píxeles)
+        rows = numpy.flatnonzero(mask.any(axis=1))
+        if len(rows) == 0:
+            return
+
+        columns = numpy.flatnonzero(mask.any(axis=0))
+        y0, y1 = int(rows[0]), int(rows[-1]) + 1
+        x0, x1 = int(columns[0]), int(columns[-1]) + 1
+
+        self.changes.append((x + x0, y + y0, mask[y0:y1, x0:x1].copy(),
+                             numpy.array(before, dtype=numpy.uint8),
+                             numpy.array(after, dtype=numpy.uint8)))
+
+    def is_empty(self):
+        return len(self.changes) == 0
+
+    @property
+    def nbytes(self):
+        return sum(mask.nbytes + before.nbytes + after.nbytes
+                   for x, y, mask, before, after in self.changes)
+
+    def _apply(self, pixelmap, changes, index):
+        for change in changes:
+            x, y, mask = change[:3]
+            data = numpy.zeros(mask.shape + (4,), dtype=numpy.uint8)
+            data[mask] = change[index]
+            pixelmap.set_region(x, y, data, mask)
+
+    def undo(self, canvas):
+        self._apply(canvas.pixelmap, reversed(self.changes), 3)
+
+    def redo(self, canvas):
+        self._apply(canvas.pixelmap, self.changes, 4)
+
+
+class ReplaceStep(object):
+    """
+    Cambio de un PixelMap por otro (por ejemplo, al usar
+    Canvas.set_pixelmap sin reiniciar el historial).
+    """
+
+    def __init__(self, before, after):
+        self.before = before
+        self.after = after
+
+        # Se calcula una sola vez, History lleva la cuenta del total
+        self.nbytes = 0 if self.is_empty() else before.nbytes + after.nbytes
+
+    def is_empty(self):
+        return self.before is self.after
+
+    def undo(self, canvas):
+        canvas.pixelmap = self.before
+
+    def redo(self, canvas):
+        canvas.pixelmap = self.after
+
+
+class DurationStep(object):
+    """
+    Cambio de la duración (en ms) del frame, para la vista previa.
+    """
+
+    nbytes = 0
+
+    def __init__(self, before, after):
+        self.before = before
+        self.after = after
+
+    def is_empty(self):
+        return self.before == self.after
+
+    def undo(self, canvas):
+        canvas.pixelmap.duration = self.before
+
+    def redo(self, canvas):
+        canvas.pixelmap.duration = self.after
+
+
+class JournaledStep(object):
+    """
+    Paso guardado en un HistoryJournal. Se lee del disco recién cuando se
+    deshace o rehace.
+    """
+
+    nbytes = 0
+
+    def __init__(self, journal, offset):
+        self.journal = journal
+        self.offset = offset
+
+    def is_empty(self):
+        return False
+
+    def load(self):
+        return self.journal.read_step(self.offset)
+
+    def undo(self, canvas):
+        self.load().undo(canvas)
+
+    def redo(self, canvas):
+        self.load().redo(canvas)
+
+
+class HistoryJournal(object):
+    """
+    Archivo donde se van agregando (nunca modificando) los pasos del
+    historial de un canvas, comprimidos con zlib. Se lee con mmap, así que
+    los pasos viejos se cargan recién cuando hacen falta.
+
+    Cada registro tiene un encabezado HEADER (tipo, número, largo) y los
+    datos. Hay cuatro tipos:
+      BASE: el contenido completo del canvas. Los pasos que siguen se
+            numeran desde 0 a partir de acá.
+      STEP: el paso número n (descarta los pasos >= n anteriores, como
+            pasa al pintar después de deshacer).
+      DURATION: como STEP, pero para un DurationStep.
+      CURSOR: cuántos pasos están aplicados, después de deshacer/rehacer.
+
+    Leyendo el archivo de principio a fin se puede reconstruir el estado
+    del canvas si Spryte se cierra inesperadamente.
+    """
+
+    BASE = 0
+    STEP = 1
+    CURSOR = 2
+    DURATION = 3
+
+    HEADER = struct.Struct("<BiI")
+    CHANGE = struct.Struct("<iiIIII")
+    BASE_HEADER = struct.Struct("<IIII?")
+    CHUNK = struct.Struct("<iiII")
+    DURATIONS = struct.Struct("<II")
+
+    DIRECTORY = os.path.join(GLib.get_user_cache_dir(), "spryte", "journal")
+    EXTENSION = ".journal"
+
+    _count = 0
+
+    def __init__(self, path):
+        self.path = path
+        self.first = 0  # Posición del historial al escribir la última base
+
+        self._file = open(path, "ab+")
+        self._mmap = None
+
+    @classmethod
+    def new_path(self, session):
+        """
+        Los archivos se llaman <pid>-<session>-<n>.journal, donde session
+        identifica al archivo abierto y n el orden en que se crearon.
+        """
+
+        os.makedirs(self.DIRECTORY, exist_ok=True)
+        HistoryJournal._count += 1
+
+        name = "%d-%s-%d%s" % (os.getpid(), session, HistoryJournal._count, self.EXTENSION)
+        return os.path.join(self.DIRECTORY, name)
+
+    @classmethod
+    def _get_owner(self, path):
+        # El pid del proceso que creó el journal, o None si no es un journal
+        name = os.path.basename(path)
+        if not name.endswith(self.EXTENSION):
+            return None
+
+        parts = name[:-len(self.EXTENSION)].split("-")
+        if len(parts) != 3 or not parts[0].isdigit():
+            return None
+
+        return int(parts[0])
+
+    @classmethod
+    def is_orphan(self, path):
+        """
+        Un journal está huérfano si el proceso que lo creó ya no existe
+        (por ejemplo, si se cerró inesperadamente). Los de otras
+        instancias de Spryte que siguen abiertas no lo están.
+        """
+
+        pid = self._get_owner(path)
+        if pid is None or pid == os.getpid():
+            return False
+
+        try:
+            # No manda ninguna señal, solo comprueba que el proceso exista
+            # (si es de otro usuario da PermissionError, pero existe)
+            os.kill(pid, 0)
+
+        except ProcessLookupError:
+            return True
+
+        except PermissionError:
+            pass
+
+        return False
+
+    @classmethod
+    def find_orphans(self):
+        """
+        Devuelve los journals que dejaron procesos que ya no existen (que
+        no se cerraron correctamente) agrupados por sesión y ordenados.
+        """
+
+        if not os.path.isdir(self.DIRECTORY):
+            return []
+
+        sessions = {}
+        for name in os.listdir(self.DIRECTORY):
+            if not name.endswith(self.EXTENSION):
+                continue
+
+            path = os.path.join(self.DIRECTORY, name)
+            if not self.is_orphan(path):
+                continue
+
+            parts = name[:-len(self.EXTENSION)].split("-")
+
+            key = (parts[0], parts[1])
+            sessions.setdefault(key, []).append((int(parts[2]), path))
+
+        return [[path for n, path in sorted(paths)] for key, paths in sorted(sessions.items())]
+
+    def _write(self, kind, number, payload=b""):
+        self._file.seek(0, os.SEEK_END)
+        offset = self._file.tell()
+
+        self._file.write(self.HEADER.pack(kind, number, len(payload)))
+        self._file.write(payload)
+        self._file.flush()
+
+        return offset
+
+    def _record(self, offset):
+        end = offset + self.HEADER.size
+        if self._mmap is None or end > len(self._mmap):
+            self._remap()
+
+        kind, number, length = self.HEADER.unpack_from(self._mmap, offset)
+        if end + length > len(self._mmap):
+            self._remap()
+
+        return kind, number, self._mmap[end:end + length]
+
+    def _remap(self):
+        if self._mmap is not None:
+            self._mmap.close()
+
+        self._file.flush()
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def write_base(self, pixelmap, position):
+        """
+        Guarda el contenido de pixelmap bloque por bloque (ver
+        PixelMap.chunks), así no hace falta armar una copia de todo el
+        canvas y las partes vacías de un TiledPixelMap no ocupan lugar.
+        También se guarda la duración y si el PixelMap usa una paleta.
+        """
+
+        width, height = pixelmap.width, pixelmap.height
+        chunks = list(pixelmap.chunks())
+
+        compressor = zlib.compressobj(1)
+        parts = [compressor.compress(self.BASE_HEADER.pack(
+            width, height, pixelmap.duration, len(chunks), pixelmap.indexed))]
+
+        for x, y, data in chunks:
+            _height, _width = data.shape[:2]
+            parts.append(compressor.compress(self.CHUNK.pack(x, y, _width, _height)))
+            parts.append(compressor.compress(numpy.ascontiguousarray(data)))
+
+        parts.append(compressor.flush())
+
+        self._write(self.BASE, 0, b"".join(parts))
+        self.first = position
+
+    def write_step(self, position, step):
+        """
+        Agrega el paso que ocupa la posición position del historial y
+        devuelve un JournaledStep para leerlo, o None si el paso se queda
+        en memoria. Los DurationStep se guardan igual, para no dejar un
+        hueco en la numeración; los ReplaceStep no, porque después de
+        ellos siempre se escribe una base nueva.
+        """
+
+        number = position - self.first
+
+        if isinstance(step, DurationStep):
+            self._write(self.DURATION, number, self.DURATIONS.pack(step.before, step.after))
+            return None
+
+        if not isinstance(step, HistoryStep):
+            return None
+
+        offset = self._write(self.STEP, number, zlib.compress(self._serialize(step), 1))
+        return JournaledStep(self, offset)
+
+    def write_cursor(self, position):
+        self._write(self.CURSOR, position - self.first)
+
+    def read_step(self, offset):
+        kind, number, payload = self._record(offset)
+        return self._deserialize(zlib.decompress(payload))
+
+    def _serialize(self, step):
+        parts = [struct.pack("<I", len(step.changes))]
+
+        for x, y, mask, before, after in step.changes:
+            before = before.reshape(-1, 4)
+            after = after.reshape(-1, 4)
+            height, width = mask.shape
+
+            parts.append(self.CHANGE.pack(x, y, width, height, len(before), len(after)))
+            parts.append(numpy.packbits(mask).tobytes())
+            parts.append(before.tobytes())
+            parts.append(after.tobytes())
+
+        return b"".join(parts)
+
+    def _deserialize(self, payload):
+        step = HistoryStep()
+        count, = struct.unpack_from("<I", payload, 0)
+        offset = 4
+
+        for i in range(count):
+            x, y, width, height, nbefore, nafter = self.CHANGE.unpack_from(payload, offset)
+            offset += self.CHANGE.size
+
+            size = (width * height + 7) // 8
+            bits = numpy.frombuffer(payload, dtype=numpy.uint8, count=size, offset=offset)
+            mask = numpy.unpackbits(bits)[:width * height].reshape(height, width).astype(bool)
+            offset += size
+
+            before = numpy.frombuffer(payload, dtype=numpy.uint8, count=nbefore * 4, offset=offset)
+            offset += nbefore * 4
+
+            after = numpy.frombuffer(payload, dtype=numpy.uint8, count=nafter * 4, offset=offset)
+            offset += nafter * 4
+
+            step.changes.append((x, y, mask, before.reshape(-1, 4), after.reshape(-1, 4)))
+
+        return step
+
+    @classmethod
+    def _read_base(self, payload):
+        width, height, duration, count, indexed = self.BASE_HEADER.unpack_from(payload, 0)
+        offset = self.BASE_HEADER.size
+        chunks = []
+
+        for i in range(count):
+            x, y, _width, _height = self.CHUNK.unpack_from(payload, offset)
+            offset += self.CHUNK.size
+
+            size = _width * _height * 4
+            data = numpy.frombuffer(payload, dtype=numpy.uint8, count=size, offset=offset)
+            chunks.append((x, y, data.reshape(_height, _width, 4)))
+            offset += size
+
+        return width, height, duration, indexed, chunks
+
+    @classmethod
+    def recover(self, path):
+        """
+        Lee un journal completo. Devuelve el journal (listo para seguir
+        agregando pasos), la última base como (ancho, alto, duración,
+        indexed, bloques), los pasos que le siguen y cuántos de ellos
+        estaban aplicados. Los bloques son tuplas (x, y, data) como las de
+        PixelMap.chunks. Si no hay ninguna base se devuelve None en su
+        lugar.
+        """
+
+        journal = HistoryJournal(path)
+        journal._file.seek(0, os.SEEK_END)
+        size = journal._file.tell()
+
+        base = None
+        steps = {}
+        cursor = 0
+        offset = 0
+
+        if size > 0:
+            journal._remap()
+
+        while offset + self.HEADER.size <= size:
+            kind, number, length = self.HEADER.unpack_from(journal._mmap, offset)
+            end = offset + self.HEADER.size + length
+            if end > size:
+                break  # Registro incompleto, se cortó mientras se escribía
+
+            if kind == self.BASE:
+                base = self._read_base(zlib.decompress(journal._mmap[offset + self.HEADER.size:end]))
+                steps = {}
+                cursor = 0
+
+            elif kind in [self.STEP, self.DURATION]:
+                for _number in [n for n in steps.keys() if n >= number]:
+                    del steps[_number]
+
+                if kind == self.STEP:
+                    steps[number] = JournaledStep(journal, offset)
+
+                else:
+                    start = offset + self.HEADER.size
+                    steps[number] = DurationStep(*self.DURATIONS.unpack_from(journal._mmap, start))
+
+                cursor = number + 1
+
+            elif kind == self.CURSOR:
+                cursor = number
+
+            offset = end
+
+        if offset < size:
+            # Descarto el registro incompleto para poder seguir agregando
+            if journal._mmap is not None:
+                journal._mmap.close()
+                journal._mmap = None
+
+            journal._file.truncate(offset)
+
+        _steps = []
+        for number in range(0, len(steps)):
+            if number not in steps:
+                break
+
+            _steps.append(steps[number])
+
+        return journal, base, _steps, max(0, min(cursor, len(_steps)))
+
+    def close(self, delete=False):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+        self._file.close()
+
+        if delete and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class History(object):
+    """
+    Lista de pasos con un cursor que indica cuántos están aplicados. Si
+    los pasos ocupan más de budget bytes, se descartan los más viejos, o
+    si hay un journal, se dejan solo en el disco.
+    """
+
+    def __init__(self, budget, journal=None):
+        self.budget = budget
+        self.journal = journal
+
+        self._steps = []
+        self._spilled = []  # El JournaledStep de cada paso, o None
+        self._first = 0  # Posición del primer paso de self._steps
+        self._cursor = 0
+        self._saved = 0
+        self._size = 0
+
+    def __len__(self):
+        return len(self._steps)
+
+    @property
+    def cursor(self):
+        return self._cursor
+
+    @property
+    def position(self):
+        # A diferencia de cursor, no cambia cuando se descartan pasos viejos
+        return self._first + self._cursor
+
+    def reset(self):
+        self._steps = []
+        self._spilled = []
+        self._first = 0
+        self._cursor = 0
+        self._saved = 0
+        self._size = 0
+
+    def restore(self, steps, cursor):
+        """
+        Reemplaza el historial por steps (por ejemplo, los pasos de un
+        journal recuperado), con los primeros cursor pasos aplicados.
+        """
+
+        self.reset()
+        self._steps = list(steps)
+        self._spilled = [step if isinstance(step, JournaledStep) else None for step in steps]
+        self._size = sum(step.nbytes for step in steps)
+        self._cursor = cursor
+        self._saved = -1
+
+    def push(self, step):
+        if step.is_empty():
+            return
+
+        self._truncate(self._cursor)
+
+        spilled = None
+        if self.journal is not None:
+            spilled = self.journal.write_step(self.position, step)
+
+        self._steps.append(step)
+        self._spilled.append(spilled)
+        self._cursor += 1
+        self._size += step.nbytes
+
+        self.shrink()
+
+    def _truncate(self, index):
+        # Descarta los pasos desde index (que no puede ser menor que el
+        # cursor), como al pintar después de deshacer
+        for step in self._steps[index:]:
+            self._size -= step.nbytes
+
+        del self._steps[index:]
+        del self._spilled[index:]
+        if self._saved > index:
+            # El estado guardado ya no se puede alcanzar
+            self._saved = -1
+
+    def _drop(self, count):
+        # Descarta los count pasos más viejos. Solo se pueden descartar
+        # pasos aplicados, los que se pueden rehacer se conservan
+        count = min(count, self._cursor)
+
+        for step in self._steps[:count]:
+            self._size -= step.nbytes
+
+        del self._steps[:count]
+        del self._spilled[:count]
+        self._first += count
+        self._cursor -= count
+
+        if self._saved >= count:
+            self._saved -= count
+
+        else:
+            self._saved = -1
+
+    def shrink(self):
+        # Siempre se conserva el último paso en memoria, aunque no entre
+        # en el límite
+        index = 0
+        while self._size > self.budget and index < len(self._steps) - 1:
+            step = self._steps[index]
+            if self._spilled[index] is not None:
+                self._size -= step.nbytes
+                self._steps[index] = self._spilled[index]
+                index += 1
+
+            elif step.nbytes == 0 or index >= self._cursor:
+                index += 1
+
+            else:
+                self._drop(index + 1)
+                index = 0
+
+    def close_journal(self, delete=True, load=True):
+        """
+        Deja de usar el journal. Si load es True, los pasos que estaban
+        solo en el disco se vuelven a cargar en memoria (empezando por los
+        más nuevos, hasta llenar budget; los que se pueden rehacer se
+        cargan siempre).
+        """
+
+        if self.journal is None:
+            return
+
+        if load:
+            size = self._size
+            for index in range(len(self._steps) - 1, -1, -1):
+                step = self._steps[index]
+                if not isinstance(step, JournaledStep):
+                    continue
+
+                if size >= self.budget and index < self._cursor:
+                    self._drop(index + 1)
+                    break
+
+                step = self._steps[index] = step.load()
+                size += step.nbytes
+                self._size += step.nbytes
+
+        else:
+            # Sin el journal, los pasos que estaban en disco se pierden: no
+            # se puede rehacer más allá del primero que se pierde después
+            # del cursor, ni deshacer más allá del último antes del cursor
+            journaled = [isinstance(step, JournaledStep) for step in self._steps]
+
+            for index in range(self._cursor, len(self._steps)):
+                if journaled[index]:
+                    self._truncate(index)
+                    break
+
+            for index in range(self._cursor - 1, -1, -1):
+                if journaled[index]:
+                    self._drop(index + 1)
+                    break
+
+        self._spilled = [None] * len(self._steps)
+        self.journal.close(delete)
+        self.journal = None
+
+    def can_undo(self):
+        return self._cursor > 0
+
+    def can_redo(self):
+        return self._cursor < len(self._steps)
+
+    def undo(self, canvas):
+        if not self.can_undo():
+            return False
+
+        self._cursor -= 1
+        self._steps[self._cursor].undo(canvas)
+
+        if self.journal is not None:
+            self.journal.write_cursor(self.position)
+
+        return True
+
+    def redo(self, canvas):
+        if not self.can_redo():
+            return False
+
+        self._steps[self._cursor].redo(canvas)
+        self._cursor += 1
+
+        if self.journal is not None:
+            self.journal.write_cursor(self.position)
+
+        return True
+
+    def replace_pixelmap(self, old, new):
+        """
+        Hace que los ReplaceStep que apuntan a old apunten a new, cuando
+        el canvas cambia su PixelMap por uno con los mismos píxeles (por
+        ejemplo, al pasar a uno por tiles).
+        """
+
+        for step in self._steps:
+            if not isinstance(step, ReplaceStep):
+                continue
+
+            self._size -= step.nbytes
+
+            if step.before is old:
+                step.before = new
+
+            if step.after is old:
+                step.after = new
+
+            step.nbytes = 0 if step.is_empty() else step.before.nbytes + step.after.nbytes
+            self._size += step.nbytes
+
+        self.shrink()
+
+    def mark_saved(self):
+        self._saved = self._cursor
+
+    def is_modified(self):
+        return self._cursor != self._saved
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+import bisect
+import cairo
+import collections
+
+from .canvas import PixelMap
+from .renderer import PatternCache
+from .renderer import upload_region
+
+from gi.repository import Gtk
+from gi.repository import GLib
+from gi.repository import GObject
+
+
+class FrameCache(object):
+    """
+    Superficies ARGB32 con los frames ya dibujados, de las que se descartan
+    las menos usadas cuando ocupan más de budget bytes. Los frames son los
+    CanvasContainer de un CanvasesNotebook.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+
+        self._surfaces = collections.OrderedDict()
+        self._size = 0
+
+    def __contains__(self, frame):
+        return frame in self._surfaces
+
+    def _nbytes(self, surface):
+        return surface.get_stride() * surface.get_height()
+
+    def get(self, frame):
+        surface = self._surfaces.get(frame, None)
+        if surface is not None:
+            self._surfaces.move_to_end(frame)
+
+        return surface
+
+    def render(self, frame):
+        self.invalidate(frame)
+
+        pixelmap = frame.get_pixelmap()
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, pixelmap.width, pixelmap.height)
+        upload_region(surface, 0, 0, pixelmap.to_array())
+
+        self._surfaces[frame] = surface
+        self._size += self._nbytes(surface)
+
+        # Siempre se conserva el último, aunque no entre en el límite
+        while self._size > self.budget and len(self._surfaces) > 1:
+            frame, _surface = self._surfaces.popitem(last=False)
+            self._size -= self._nbytes(_surface)
+
+        return surface
+
+    def invalidate(self, frame):
+        surface = self._surfaces.pop(frame, None)
+        if surface is not None:
+            self._size -= self._nbytes(surface)
+
+    def clear(self):
+        self._surfaces.clear()
+        self._size = 0
+
+
+class PlaybackPreview(Gtk.DrawingArea):
+    """
+    Reproduce los frames de un CanvasesNotebook respetando la duración de
+    cada uno. El frame que se muestra se calcula a partir del tiempo del
+    frame clock, así que si no se llega a dibujar a tiempo se saltean
+    frames en lugar de atrasarse. Mientras se muestra un frame se dibuja
+    el siguiente en el FrameCache.
+    """
+
+    __gsignals__ = {
+        "fps-changed": (GObject.SIGNAL_RUN_LAST, None, [GObject.TYPE_FLOAT, GObject.TYPE_INT]),
+    }
+
+    CACHE_BUDGET = 128 * 1024 * 1024  # En bytes
+    MIN_DURATION = PixelMap.MIN_DURATION
+
+    def __init__(self, notebook):
+        Gtk.DrawingArea.__init__(self)
+
+        self.fps = 0
+        self.skipped = 0  # Frames salteados en el último segundo
+
+        self._notebook = notebook
+        self._cache = FrameCache(self.CACHE_BUDGET)
+        self._patterns = PatternCache()
+        self._frame = None
+        self._index = None
+        self._tick_id = None
+        self._start_time = None
+
+        # Para calcular los fps: cuántas veces se pasó a otro frame y
+        # cuántos frames se saltearon desde _fps_time
+        self._shown = 0
+        self._skipped = 0
+        self._fps_time = None
+
+        self._frame_changed_id = notebook.connect("frame-changed", self._frame_changed_cb)
+
+        self.set_size_request(200, 200)
+        self.connect("draw", self._draw_cb)
+        self.connect("destroy", self._destroy_cb)
+
+    def _destroy_cb(self, widget):
+        if self._tick_id is not None:
+            self.remove_tick_callback(self._tick_id)
+            self._tick_id = None
+
+        self._notebook.disconnect(self._frame_changed_id)
+        self._cache.clear()
+
+    def _frame_changed_cb(self, notebook, frame):
+        self._cache.invalidate(frame)
+
+        if frame is self._frame:
+            self.queue_draw()
+
+    def _get_surface(self, frame):
+        surface = self._cache.get(frame)
+        if surface is None:
+            surface = self._cache.render(frame)
+
+        return surface
+
+    def _draw_cb(self, widget, ctx):
+        ctx.set_source(self._patterns.checkerboard)
+        ctx.paint()
+
+        frames = self._notebook.get_frames()
+        if self._frame not in frames:
+            if len(frames) == 0:
+                return
+
+            self._frame = frames[0]
+
+        surface = self._get_surface(self._frame)
+
+        alloc = self.get_allocation()
+        width, height = surface.get_width(), surface.get_height()
+        scale = min(alloc.width / width, alloc.height / height)
+
+        ctx.translate((alloc.width - width * scale) / 2,
+                      (alloc.height - height * scale) / 2)
+        ctx.scale(scale, scale)
+
+        ctx.set_source_surface(surface, 0, 0)
+        ctx.get_source().set_filter(cairo.FILTER_NEAREST)
+        ctx.paint()
+
+    def _tick_cb(self, widget, clock):
+        now = clock.get_frame_time() / 1000  # En milisegundos
+        frames = self._notebook.get_frames()
+        if len(frames) == 0:
+            return GLib.SOURCE_CONTINUE
+
+        ends = []
+        total = 0
+        for frame in frames:
+            total += max(frame.get_pixelmap().duration, self.MIN_DURATION)
+            ends.append(total)
+
+        if self._start_time is None:
+            self._start_time = now
+            self._fps_time = now
+            self._index = None
+            self._shown = 0
+            self._skipped = 0
+
+        index = bisect.bisect_right(ends, (now - self._start_time) % total)
+        frame = frames[index]
+        if frame is not self._frame:
+            if self._index is not None:
+                # Los frames entre el anterior y este no se llegaron a ver
+                self._shown += 1
+                self._skipped += (index - self._index - 1) % len(frames)
+
+            self._frame = frame
+            self.queue_draw()
+
+        self._index = index
+
+        # Se prepara el siguiente frame mientras se muestra este
+        next_frame = frames[(index + 1) % len(frames)]
+        if next_frame not in self._cache:
+            self._cache.render(next_frame)
+
+        if now - self._fps_time >= 1000:
+            self.fps = self._shown * 1000 / (now - self._fps_time)
+            self.skipped = self._skipped
+            self._fps_time = now
+            self._shown = 0
+            self._skipped = 0
+            self.emit("fps-changed", self.fps, self.skipped)
+
+        return GLib.SOURCE_CONTINUE
+
+    def is_playing(self):
+        return self._tick_id is not None
+
+    def play(self):
+        if self._tick_id is None:
+            self._start_time = None
+            self._tick_id = self.add_tick_callback(self._tick_cb)
+
+    def stop(self):
+        if self._tick_id is not None:
+            self.remove_tick_callback(self._tick_id)
+            self._tick_id = None
+
+        self.fps = 0
+        self.skipped = 0
+        self.emit("fps-changed", self.fps, self.skipped)
+
+
+class PreviewWindow(Gtk.Window):
+
+    def __init__(self, notebook, *args, **kargs):
+        super(PreviewWindow, self).__init__(*args, **kargs)
+
+        self.set_title("Vista previa")
+        self.set_default_size(300, 340)
+
+        self._notebook = notebook
+
+        vbox = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+        self.add(vbox)
+
+        self.preview = PlaybackPreview(notebook)
+        self.preview.connect("fps-changed", self._fps_changed_cb)
+        vbox.pack_start(self.preview, True, True, 0)
+
+        hbox = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+        hbox.set_border_width(4)
+        vbox.pack_end(hbox, False, False, 0)
+
+        self.play_button = Gtk.ToggleButton()
+        self.play_button.set_image(Gtk.Image.new_from_icon_name(
+            "media-playback-start-symbolic", Gtk.IconSize.BUTTON))
+        self.play_button.connect("toggled", self._play_toggled_cb)
+        hbox.pack_start(self.play_button, False, False, 0)
+
+        self.fps_label = Gtk.Label.new("0 fps")
+        hbox.pack_start(self.fps_label, False, False, 4)
+
+        self.duration_spinner = Gtk.SpinButton.new_with_range(
+            PlaybackPreview.MIN_DURATION, 60000, 10)
+        self.duration_spinner.set_tooltip_text("Duración del frame (ms)")
+        self._duration_changed_id = self.duration_spinner.connect("value-changed", self._duration_changed_cb)
+        hbox.pack_end(self.duration_spinner, False, False, 0)
+
+        self._switch_page_id = notebook.connect("switch-page", self._switch_page_cb)
+        self._frame_changed_id = notebook.connect("frame-changed", self._frame_changed_cb)
+        self.connect("destroy", self._destroy_cb)
+
+        self._update_duration()
+
+    def _destroy_cb(self, window):
+        self._notebook.disconnect(self._switch_page_id)
+        self._notebook.disconnect(self._frame_changed_id)
+
+    def _play_toggled_cb(self, button):
+        if button.get_active():
+            self.preview.play()
+
+        else:
+            self.preview.stop()
+
+    def _fps_changed_cb(self, preview, fps, skipped):
+        if skipped > 0:
+            self.fps_label.set_label("%.1f fps (%d salteados)" % (fps, skipped))
+
+        else:
+            self.fps_label.set_label("%.1f fps" % fps)
+
+    def _switch_page_cb(self, notebook, canvas, num):
+        GLib.idle_add(self._update_duration)
+
+    def _frame_changed_cb(self, notebook, frame):
+        # Al deshacer o rehacer puede cambiar la duración
+        if frame is notebook.get_current_canvas():
+            self._update_duration()
+
+    def _update_duration(self):
+        # Solo se muestra la duración, no es un cambio del usuario
+        canvas = self._notebook.get_current_canvas()
+        self.duration_spinner.handler_block(self._duration_changed_id)
+        self.duration_spinner.set_value(canvas.get_pixelmap().duration)
+        self.duration_spinner.handler_unblock(self._duration_changed_id)
+
+        return GLib.SOURCE_REMOVE
+
+    def _duration_changed_cb(self, spinner):
+        canvas = self._notebook.get_current_canvas()
+        canvas.set_duration(int(spinner.get_value()))
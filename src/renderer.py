@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+import sys
+import math
+import cairo
+import numpy
+
+from .utils import Color
+
+from gi.repository import GLib
+
+
+# Posición de cada canal RGBA dentro de un píxel ARGB32, que cairo guarda
+# como un entero de 32 bits en el orden de bytes de la máquina
+if sys.byteorder == "little":
+    ARGB32_CHANNELS = [2, 1, 0, 3]
+
+else:
+    ARGB32_CHANNELS = [1, 2, 3, 0]
+
+
+def upload_region(surface, x, y, region):
+    """
+    Copia region (un array (alto, ancho, 4) de uint8 RGBA) en la posición
+    (x, y) de una superficie ARGB32.
+    """
+
+    surface.flush()
+
+    stride = surface.get_stride()
+    data = numpy.ndarray((surface.get_height(), stride // 4, 4),
+                         dtype=numpy.uint8, buffer=surface.get_data())
+
+    # cairo usa colores premultiplicados por la transparencia
+    alpha = region[:, :, Color.ALPHA:].astype(numpy.uint16)
+    premultiplied = numpy.empty(region.shape, dtype=numpy.uint8)
+    premultiplied[:, :, :3] = (region[:, :, :3] * alpha + 127) // 255
+    premultiplied[:, :, Color.ALPHA] = region[:, :, Color.ALPHA]
+
+    height, width = region.shape[:2]
+    data[y:y + height, x:x + width][:, :, ARGB32_CHANNELS] = premultiplied
+
+    surface.mark_dirty_rectangle(x, y, width, height)
+
+
+def render_mask(mask, color=None):
+    """
+    Devuelve una superficie ARGB32 del tamaño de mask con los píxeles
+    donde mask es True pintados con color (un color de cairo). Si no se
+    pasa color, devuelve una superficie A8 (solo transparencia) para usar
+    como máscara con cualquier color, ver cairo.Context.mask.
+    """
+
+    height, width = mask.shape
+
+    if color is None:
+        surface = cairo.ImageSurface(cairo.FORMAT_A8, max(width, 1), max(height, 1))
+        surface.flush()
+
+        data = numpy.ndarray((surface.get_height(), surface.get_stride()),
+                             dtype=numpy.uint8, buffer=surface.get_data())
+        data[:height, :width] = mask * numpy.uint8(255)
+
+        surface.mark_dirty()
+        return surface
+
+    region = numpy.zeros((height, width, 4), dtype=numpy.uint8)
+    region[mask] = Color.cairo_to_array(color)
+
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, max(width, 1), max(height, 1))
+    upload_region(surface, 0, 0, region)
+
+    return surface
+
+
+def render_thumbnail(pixelmap, max_width, max_height):
+    """
+    Devuelve una superficie ARGB32 con el PixelMap escalado (sin
+    interpolar) para que entre en max_width x max_height. Solo se leen los
+    píxeles que se van a usar, así que no depende del tamaño del sprite.
+    """
+
+    scale = min(max_width / pixelmap.width, max_height / pixelmap.height)
+    width = max(int(pixelmap.width * scale), 1)
+    height = max(int(pixelmap.height * scale), 1)
+
+    # El píxel del sprite (empezando en 0) que corresponde a cada columna
+    # y fila de la miniatura
+    columns = numpy.minimum((numpy.arange(width) / scale).astype(int), pixelmap.width - 1)
+    rows = numpy.minimum((numpy.arange(height) / scale).astype(int), pixelmap.height - 1)
+
+    thumbnail = numpy.zeros((height, width, 4), dtype=numpy.uint8)
+    for x, y, data in pixelmap.chunks():
+        chunk_height, chunk_width = data.shape[:2]
+        _columns = numpy.nonzero((columns >= x - 1) & (columns < x - 1 + chunk_width))[0]
+        _rows = numpy.nonzero((rows >= y - 1) & (rows < y - 1 + chunk_height))[0]
+        if len(_columns) == 0 or len(_rows) == 0:
+            continue
+
+        thumbnail[numpy.ix_(_rows, _columns)] = \
+            data[numpy.ix_(rows[_rows] - (y - 1), columns[_columns] - (x - 1))]
+
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+    upload_region(surface, 0, 0, thumbnail)
+
+    return surface
+
+
+class SurfaceCache(object):
+    """
+    Copia de lo que se ve de un PixelMap (los píxeles temporales encima de
+    los guardados) en superficies ARGB32 de TILE_SIZE x TILE_SIZE, así
+    dibujarlo es un paint escalado por tile en lugar de un rectángulo por
+    píxel, sin importar cuántos píxeles estén pintados.
+
+    Las superficies se crean al dibujarlas por primera vez (los tiles
+    vacíos no tienen) y después solo se actualiza la región que cambió.
+    """
+
+    TILE_SIZE = 256
+
+    def __init__(self):
+        self._pixelmap = None
+        self._tracker = None
+        self._size = (0, 0)
+        self._tiles = {}
+
+    def _tile_range(self, start, stop):
+        return range(start // self.TILE_SIZE, (stop - 1) // self.TILE_SIZE + 1)
+
+    def _tile_size(self, tx, ty):
+        width, height = self._size
+        return (min(self.TILE_SIZE, width - tx * self.TILE_SIZE),
+                min(self.TILE_SIZE, height - ty * self.TILE_SIZE))
+
+    def _surface(self, tx, ty):
+        key = (tx, ty)
+        if key in self._tiles:
+            return self._tiles[key]
+
+        size = self.TILE_SIZE
+        width, height = self._tile_size(tx, ty)
+        region = self._pixelmap.get_visible_region(tx * size + 1, ty * size + 1,
+                                                   width, height)
+
+        surface = None
+        if region[:, :, Color.ALPHA].any():
+            surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+            upload_region(surface, 0, 0, region)
+
+        self._tiles[key] = surface
+        return surface
+
+    def update(self, pixelmap, visible=None):
+        """
+        Actualiza las superficies con lo que cambió en pixelmap desde la
+        última llamada. Si es otro PixelMap (o cambió de tamaño), se
+        descartan todas.
+
+        visible es la región (x, y, ancho, alto) del sprite que se ve, en
+        coordenadas que empiezan en 1. Las superficies de los tiles que
+        cambiaron fuera de ella se descartan en lugar de actualizarse, y se
+        vuelven a crear si aparecen al hacer scroll.
+        """
+
+        size = (pixelmap.width, pixelmap.height)
+        if pixelmap is not self._pixelmap or size != self._size:
+            self._pixelmap = pixelmap
+            self._tracker = pixelmap.track_damage()
+            self._size = size
+            self._tiles = {}
+            return
+
+        rect = self._tracker.pop()
+        if rect is None:
+            return
+
+        x0, y0, x1, y1 = rect
+        x1, y1 = min(x1, size[0]), min(y1, size[1])
+        if x0 >= x1 or y0 >= y1:
+            return
+
+        if visible is None:
+            visible = (1, 1) + size
+
+        vx, vy, vwidth, vheight = visible
+        vx0, vy0, vx1, vy1 = vx - 1, vy - 1, vx - 1 + vwidth, vy - 1 + vheight
+
+        tile = self.TILE_SIZE
+        for ty in self._tile_range(y0, y1):
+            for tx in self._tile_range(x0, x1):
+                surface = self._tiles.get((tx, ty), None)
+                hidden = tx * tile >= vx1 or ty * tile >= vy1 or \
+                    (tx + 1) * tile <= vx0 or (ty + 1) * tile <= vy0
+
+                if surface is None or hidden:
+                    # Se vuelve a crear cuando se dibuje
+                    self._tiles.pop((tx, ty), None)
+                    continue
+
+                ax0, ay0 = max(x0, tx * tile), max(y0, ty * tile)
+                ax1, ay1 = min(x1, (tx + 1) * tile), min(y1, (ty + 1) * tile)
+
+                region = pixelmap.get_visible_region(ax0 + 1, ay0 + 1,
+                                                     ax1 - ax0, ay1 - ay0)
+                upload_region(surface, ax0 - tx * tile, ay0 - ty * tile, region)
+
+    def paint(self, ctx, scale):
+        """
+        Dibuja el PixelMap en ctx, con cada píxel de scale x scale.
+        """
+
+        width, height = self._size
+        if width == 0 or height == 0:
+            return
+
+        size = self.TILE_SIZE
+
+        ctx.save()
+        ctx.scale(scale, scale)
+
+        # Sin antialiasing para que no se vean las uniones entre tiles
+        ctx.set_antialias(cairo.ANTIALIAS_NONE)
+
+        # Solo los tiles que tocan la región a redibujar (clip_extents ya
+        # devuelve coordenadas del sprite por el scale)
+        x0, y0, x1, y1 = ctx.clip_extents()
+        x0, y0 = max(int(x0), 0), max(int(y0), 0)
+        x1, y1 = min(int(math.ceil(x1)), width), min(int(math.ceil(y1)), height)
+        if x0 >= x1 or y0 >= y1:
+            ctx.restore()
+            return
+
+        for ty in self._tile_range(y0, y1):
+            for tx in self._tile_range(x0, x1):
+                surface = self._surface(tx, ty)
+                if surface is None:
+                    continue
+
+                ctx.set_source_surface(surface, tx * size, ty * size)
+                ctx.get_source().set_filter(cairo.FILTER_NEAREST)
+                ctx.rectangle(tx * size, ty * size,
+                              surface.get_width(), surface.get_height())
+                ctx.fill()
+
+        ctx.restore()
+
+
+class PatternCache(object):
+    """
+    Patrones que se repiten para dibujar el fondo a cuadros y la grilla
+    del canvas con un solo paint cada uno. El de la grilla depende del
+    zoom, así que se guarda el último y se vuelve a crear cuando cambia.
+    clear() descarta todo (por ejemplo si cambia el tema).
+    """
+
+    CHECKERBOARD_SIZE = 13  # Esto es 100% arbitrario
+    CHECKERBOARD_COLORS = ((0.4, 0.4, 0.4), (0.5, 0.5, 0.5))
+
+    # Tamaño máximo de la superficie de la grilla, ver grid()
+    MAX_GRID_SIZE = 2048
+
+    def __init__(self):
+        self._checkerboard = None
+        self._grid = None
+        self._grid_zoom = None
+
+    def clear(self):
+        self._checkerboard = None
+        self._grid = None
+        self._grid_zoom = None
+
+    @property
+    def checkerboard(self):
+        if self._checkerboard is None:
+            size = self.CHECKERBOARD_SIZE
+            c1, c2 = self.CHECKERBOARD_COLORS
+
+            surface = cairo.ImageSurface(cairo.FORMAT_RGB24, size * 2, size * 2)
+            ctx = cairo.Context(surface)
+
+            ctx.set_source_rgb(*c2)
+            ctx.paint()
+
+            ctx.set_source_rgb(*c1)
+            ctx.rectangle(0, 0, size, size)
+            ctx.rectangle(size, size, size, size)
+            ctx.fill()
+
+            self._checkerboard = cairo.SurfacePattern(surface)
+            self._checkerboard.set_extend(cairo.EXTEND_REPEAT)
+            self._checkerboard.set_filter(cairo.FILTER_NEAREST)
+
+        return self._checkerboard
+
+    def grid(self, zoom):
+        """
+        Devuelve el patrón de la grilla para el zoom (en porcentaje), con
+        una línea de un píxel de la pantalla al principio de cada píxel
+        del sprite, en la misma posición que tendría si se dibujara cada
+        línea por separado.
+        """
+
+        zoom = int(round(zoom))
+        if self._grid is not None and self._grid_zoom == zoom:
+            return self._grid
+
+        factor = zoom / 100
+
+        # Con k píxeles del sprite por repetición el patrón mide un número
+        # entero de píxeles de la pantalla, así no se acumula error
+        k = 100 // math.gcd(zoom, 100)
+
+        if k * factor > self.MAX_GRID_SIZE:
+            k = 1
+
+        size = max(int(round(k * factor)), 1)
+
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, size, size)
+        ctx = cairo.Context(surface)
+        ctx.set_source_rgba(*Color.GRID)
+
+        for i in range(k):
+            position = int(i * factor)
+            ctx.rectangle(position, 0, 1, size)
+            ctx.rectangle(0, position, size, 1)
+
+        ctx.fill()
+
+        self._grid = cairo.SurfacePattern(surface)
+        self._grid.set_extend(cairo.EXTEND_REPEAT)
+        self._grid.set_filter(cairo.FILTER_NEAREST)
+
+        if size != k * factor:
+            # Solo pasa si se tuvo que achicar k
+            matrix = cairo.Matrix()
+            matrix.scale(size / (k * factor), size / (k * factor))
+            self._grid.set_matrix(matrix)
+
+        self._grid_zoom = zoom
+        return self._grid
+
+
+class RedrawScheduler(object):
+    """
+    Junta los pedidos de redibujado de un widget (todo el widget o un
+    rectángulo) y los hace en el próximo frame de su frame clock, así se
+    dibuja como mucho una vez por frame sin importar cuántos eventos
+    llegaron. requested y performed cuentan los pedidos y las veces que
+    realmente se redibujó.
+    """
+
+    def __init__(self, widget):
+        self._widget = widget
+        self._tick_id = None
+        self._full = False
+        self._rect = None
+
+        self.requested = 0
+        self.performed = 0
+
+    def queue(self, rect=None):
+        """
+        Pide redibujar el rectángulo (x0, y0, x1, y1) del widget, o todo
+        el widget si rect es None.
+        """
+
+        self.requested += 1
+
+        if rect is None:
+            self._full = True
+            self._rect = None
+
+        elif not self._full:
+            if self._rect is None:
+                self._rect = rect
+
+            else:
+                x0, y0, x1, y1 = rect
+                rx0, ry0, rx1, ry1 = self._rect
+                self._rect = (min(rx0, x0), min(ry0, y0), max(rx1, x1), max(ry1, y1))
+
+        if self._tick_id is None:
+            self._tick_id = self._widget.add_tick_callback(self._tick_cb)
+
+    def _tick_cb(self, widget, clock):
+        self._tick_id = None
+
+        if self._full:
+            widget.queue_draw()
+
+        elif self._rect is not None:
+            x0, y0, x1, y1 = self._rect
+            widget.queue_draw_area(x0, y0, x1 - x0, y1 - y0)
+
+        self._full = False
+        self._rect = None
+        self.performed += 1
+
+        return GLib.SOURCE_REMOVE
+
+    def cancel(self):
+        if self._tick_id is not None:
+            self._widget.remove_tick_callback(self._tick_id)
+            self._tick_id = None
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy
+
+from .utils import PaintAlgorithms
+
+
+class SelectionMode:
+    # Cómo se combina una figura con la selección que ya existe
+    REPLACE = 0
+    UNION = 1
+    INTERSECT = 2
+    SUBTRACT = 3
+
+
+class Selection(object):
+    """
+    Píxeles seleccionados de un PixelMap, guardados como una máscara de
+    booleanos (alto, ancho). Igual que en PixelMap, las coordenadas que
+    recibe la API empiezan en 1.
+
+    El rectángulo que contiene a la selección y su contorno se calculan
+    recién cuando se piden, y se guardan hasta el próximo cambio.
+    """
+
+    def __init__(self, width, height):
+        self._mask = numpy.zeros((height, width), dtype=bool)
+        self._changed()
+
+    def __contains__(self, obj):
+        x, y = obj
+        if not self._in_bounds(x, y):
+            return False
+
+        return bool(self._mask[y - 1, x - 1])
+
+    @property
+    def width(self):
+        return self._mask.shape[1]
+
+    @property
+    def height(self):
+        return self._mask.shape[0]
+
+    @property
+    def mask(self):
+        # De solo lectura, para cambiarla hay que usar combine
+        mask = self._mask.view()
+        mask.flags.writeable = False
+
+        return mask
+
+    def _in_bounds(self, x, y):
+        return 0 < x <= self.width and 0 < y <= self.height
+
+    def _changed(self):
+        self._bounds = None
+        self._outline = None
+        self._empty = None
+
+    def copy(self):
+        selection = Selection(0, 0)
+        selection._mask = self._mask.copy()
+
+        return selection
+
+    def resize(self, width, height):
+        if (width, height) == (self.width, self.height):
+            return
+
+        mask = numpy.zeros((height, width), dtype=bool)
+        _height, _width = min(height, self.height), min(width, self.width)
+        mask[:_height, :_width] = self._mask[:_height, :_width]
+
+        self._mask = mask
+        self._changed()
+
+    def is_empty(self):
+        if self._empty is None:
+            self._empty = not self._mask.any()
+
+        return self._empty
+
+    def clear(self):
+        if not self.is_empty():
+            self._mask[:] = False
+            self._changed()
+
+    def combine(self, x, y, mask, mode=SelectionMode.REPLACE):
+        """
+        Combina la selección con los píxeles donde mask es True, con mask
+        ubicada en la posición (x, y). Lo que quede fuera del PixelMap se
+        ignora.
+        """
+
+        height, width = mask.shape
+
+        # Recorte de mask a los límites de la selección
+        x0, y0 = max(x - 1, 0), max(y - 1, 0)
+        x1, y1 = min(x - 1 + width, self.width), min(y - 1 + height, self.height)
+
+        region = numpy.zeros_like(self._mask)
+        if x0 < x1 and y0 < y1:
+            region[y0:y1, x0:x1] = mask[y0 - y + 1:y1 - y + 1, x0 - x + 1:x1 - x + 1]
+
+        if mode == SelectionMode.UNION:
+            self._mask |= region
+
+        elif mode == SelectionMode.INTERSECT:
+            self._mask &= region
+
+        elif mode == SelectionMode.SUBTRACT:
+            self._mask &= ~region
+
+        else:
+            self._mask = region
+
+        self._changed()
+
+    def translate(self, dx, dy):
+        """
+        Mueve la selección (dx, dy) píxeles. Lo que queda fuera del
+        PixelMap se pierde.
+        """
+
+        mask = numpy.zeros_like(self._mask)
+        height, width = mask.shape
+
+        if abs(dx) < width and abs(dy) < height:
+            mask[max(dy, 0):height + min(dy, 0), max(dx, 0):width + min(dx, 0)] = \
+                self._mask[max(-dy, 0):height - max(dy, 0), max(-dx, 0):width - max(dx, 0)]
+
+        self._mask = mask
+        self._changed()
+
+    def select_rectangle(self, x, y, width, height, mode=SelectionMode.REPLACE):
+        self.combine(x, y, numpy.ones((height, width), dtype=bool), mode)
+
+    def select_polygon(self, points, mode=SelectionMode.REPLACE):
+        """
+        Selecciona el polígono cuyos vértices son los píxeles (x, y) de
+        points, incluyendo los píxeles de sus lados.
+        """
+
+        self.combine(1, 1, polygon_mask(points, self.width, self.height), mode)
+
+    def set_pixel(self, x, y, selected=True):
+        if self._in_bounds(x, y) and self._mask[y - 1, x - 1] != selected:
+            self._mask[y - 1, x - 1] = selected
+            self._changed()
+
+    def get_bounds(self):
+        """
+        Devuelve el rectángulo (x, y, ancho, alto) que contiene a la
+        selección, o None si está vacía.
+        """
+
+        if self.is_empty():
+            return None
+
+        if self._bounds is None:
+            rows = numpy.nonzero(self._mask.any(axis=1))[0]
+            columns = numpy.nonzero(self._mask.any(axis=0))[0]
+            self._bounds = (int(columns[0]) + 1, int(rows[0]) + 1,
+                            int(columns[-1] - columns[0]) + 1,
+                            int(rows[-1] - rows[0]) + 1)
+
+        return self._bounds
+
+    def get_outline(self):
+        """
+        Devuelve el contorno de la selección como una lista de segmentos
+        (x0, y0, x1, y1) horizontales o verticales sobre los bordes de los
+        píxeles (el píxel (1, 1) va de (0, 0) a (1, 1)). Los bordes
+        consecutivos se unen en un solo segmento.
+        """
+
+        if self._outline is None:
+            self._outline = []
+            if not self.is_empty():
+                padded = numpy.pad(self._mask, 1, mode="constant")
+
+                # Bordes horizontales: entre dos filas que difieren
+                for y, x0, x1 in _runs(padded[1:, 1:-1] != padded[:-1, 1:-1]):
+                    self._outline.append((x0, y, x1, y))
+
+                # Bordes verticales: entre dos columnas que difieren
+                for x, y0, y1 in _runs((padded[1:-1, 1:] != padded[1:-1, :-1]).T):
+                    self._outline.append((x, y0, x, y1))
+
+        return self._outline
+
+
+def _runs(mask):
+    """
+    Devuelve (fila, inicio, fin) por cada tramo de valores True seguidos
+    en las filas de mask.
+    """
+
+    height, width = mask.shape
+    padded = numpy.zeros((height, width + 2), dtype=numpy.int8)
+    padded[:, 1:-1] = mask
+
+    edges = numpy.diff(padded, axis=1)
+    rows, starts = numpy.nonzero(edges == 1)
+    ends = numpy.nonzero(edges == -1)[1]
+
+    return zip(rows.tolist(), starts.tolist(), ends.tolist())
+
+
+def polygon_mask(points, width, height):
+    """
+    Devuelve la máscara (alto, ancho) del polígono cuyos vértices son los
+    píxeles (x, y) de points (empezando en 1), con la regla par-impar: un
+    píxel está adentro si a su izquierda el polígono cruza su fila una
+    cantidad impar de veces. También se incluyen los píxeles de los lados.
+    """
+
+    mask = numpy.zeros((height, width), dtype=bool)
+    if len(points) == 0:
+        return mask
+
+    # Vértices en el centro de cada píxel, con coordenadas que empiezan
+    # en 0 (el centro del píxel (1, 1) es (0.5, 0.5))
+    vertices = numpy.array(points, dtype=float) - 0.5
+    x0, y0 = vertices[:, 0], vertices[:, 1]
+    x1, y1 = numpy.roll(x0, -1), numpy.roll(y0, -1)
+
+    # Filas cuyo centro corta cada lado, sin contar dos veces los vértices
+    low, high = numpy.minimum(y0, y1), numpy.maximum(y0, y1)
+    first = numpy.ceil(low - 0.5).astype(int)
+    counts = numpy.maximum(numpy.ceil(high - 0.5).astype(int) - first, 0)
+
+    edges = numpy.repeat(numpy.arange(len(vertices)), counts)
+    if len(edges) > 0:
+        starts = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+        rows = first[edges] + numpy.arange(len(edges)) - starts[edges]
+
+        t = (rows + 0.5 - y0[edges]) / (y1[edges] - y0[edges])
+        crossings = x0[edges] + t * (x1[edges] - x0[edges])
+
+        # Primer píxel cuyo centro queda a la derecha del cruce
+        columns = numpy.clip(numpy.ceil(crossings - 0.5).astype(int), 0, width)
+
+        inside = (rows >= 0) & (rows < height)
+        toggles = numpy.zeros((height, width + 1), dtype=numpy.int32)
+        numpy.add.at(toggles, (rows[inside], columns[inside]), 1)
+
+        mask = numpy.cumsum(toggles, axis=1)[:, :width] % 2 == 1
+
+    for (ax, ay), (bx, by) in zip(points, points[1:] + points[:1]):
+        xs, ys = PaintAlgorithms.line(ax, ay, bx, by)
+        inside = (xs > 0) & (xs <= width) & (ys > 0) & (ys <= height)
+        mask[ys[inside] - 1, xs[inside] - 1] = True
+
+    return mask
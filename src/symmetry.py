@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import math
+import numpy
+
+
+class SymmetryMode:
+    NONE = 0
+    VERTICAL = 1  # Espejo sobre un eje vertical (izquierda y derecha)
+    HORIZONTAL = 2  # Espejo sobre un eje horizontal (arriba y abajo)
+    BOTH = 3
+    RADIAL = 4  # folds copias girando alrededor del centro
+
+
+class Symmetry(object):
+    """
+    Copias simétricas de lo que se pinta en un PixelMap de width x height.
+    El centro (cx, cy) está en coordenadas de los bordes de los píxeles
+    (el píxel (1, 1) va de (0, 0) a (1, 1)), así el eje puede pasar por el
+    medio de un píxel o entre dos; si no se pasa es el centro del PixelMap.
+
+    Por cada copia se precalcula una tabla con el píxel del que sale cada
+    píxel del PixelMap (la transformación inversa), así las máscaras se
+    copian tomando muestras y al girarlas no quedan huecos. Las tablas de
+    los espejos son de una sola fila o columna; las de los giros se
+    guardan enteras si entran en TABLE_BUDGET, si no se calcula solo la
+    parte que se usa.
+    """
+
+    TABLE_BUDGET = 64 * 1024 * 1024  # En bytes
+
+    def __init__(self, width, height, mode, center=None, folds=4):
+        self.width = width
+        self.height = height
+        self.mode = mode
+        self.center = center
+        self.folds = folds
+
+        if center is None:
+            center = (width / 2, height / 2)
+
+        self._cx, self._cy = center
+        self._matrices = self._get_matrices(mode, folds)
+
+        rotations = len([matrix for matrix in self._matrices if not self._separable(matrix)])
+        full = rotations * width * height * 8 <= self.TABLE_BUDGET
+
+        self._tables = []
+        for matrix in self._matrices:
+            if self._separable(matrix):
+                # Un espejo solo mueve las columnas o las filas
+                xs, ys = self._inverse(matrix, 1, 1, width, height, grid=False)
+                table = (numpy.broadcast_to(xs, (height, width)),
+                         numpy.broadcast_to(ys, (height, width)))
+
+            elif full:
+                table = self._inverse(matrix, 1, 1, width, height)
+
+            else:
+                table = None
+
+            self._tables.append(table)
+
+    @property
+    def key(self):
+        return (self.width, self.height, self.mode, self.center, self.folds)
+
+    def _get_matrices(self, mode, folds):
+        # Las transformaciones de cada copia, sin contar la identidad
+        if mode == SymmetryMode.VERTICAL:
+            return [numpy.array([[-1, 0], [0, 1]])]
+
+        elif mode == SymmetryMode.HORIZONTAL:
+            return [numpy.array([[1, 0], [0, -1]])]
+
+        elif mode == SymmetryMode.BOTH:
+            return [numpy.array([[-1, 0], [0, 1]]),
+                    numpy.array([[1, 0], [0, -1]]),
+                    numpy.array([[-1, 0], [0, -1]])]
+
+        elif mode == SymmetryMode.RADIAL:
+            matrices = []
+            for i in range(1, folds):
+                angle = 2 * math.pi * i / folds
+                cos, sin = round(math.cos(angle), 12), round(math.sin(angle), 12)
+                matrices.append(numpy.array([[cos, -sin], [sin, cos]]))
+
+            return matrices
+
+        return []
+
+    def _separable(self, matrix):
+        return matrix[0, 1] == 0 and matrix[1, 0] == 0
+
+    def _transform(self, matrix, xs, ys):
+        # Centros de los píxeles, relativos al centro de la simetría
+        dx, dy = xs - 0.5 - self._cx, ys - 0.5 - self._cy
+
+        _xs = numpy.floor(self._cx + matrix[0, 0] * dx + matrix[0, 1] * dy).astype(numpy.int32) + 1
+        _ys = numpy.floor(self._cy + matrix[1, 0] * dx + matrix[1, 1] * dy).astype(numpy.int32) + 1
+
+        return _xs, _ys
+
+    def _inverse(self, matrix, x0, y0, x1, y1, grid=True):
+        """
+        Devuelve dos arrays (alto, ancho) con las coordenadas del píxel
+        del que sale cada píxel del rectángulo de (x0, y0) a (x1, y1),
+        incluidos. Con grid=False, si matrix es un espejo, se devuelven
+        una fila y una columna.
+        """
+
+        xs = numpy.arange(x0, x1 + 1)[None, :]
+        ys = numpy.arange(y0, y1 + 1)[:, None]
+
+        # Los giros y los espejos se deshacen con la transpuesta
+        inverse = matrix.T
+
+        if not grid:
+            # Cada coordenada depende solo de sí misma
+            return (self._transform(inverse, xs, self._cy + 0.5)[0],
+                    self._transform(inverse, self._cx + 0.5, ys)[1])
+
+        return self._transform(inverse, *numpy.broadcast_arrays(xs, ys))
+
+    def _source(self, index, x0, y0, x1, y1):
+        table = self._tables[index]
+        if table is None:
+            return self._inverse(self._matrices[index], x0, y0, x1, y1)
+
+        xs, ys = table
+        return xs[y0 - 1:y1, x0 - 1:x1], ys[y0 - 1:y1, x0 - 1:x1]
+
+    def map_points(self, points):
+        """
+        Devuelve, por cada copia, la lista de píxeles (x, y) donde caen
+        los de points, sin los que quedan fuera del PixelMap.
+        """
+
+        if len(points) == 0 or len(self._matrices) == 0:
+            return []
+
+        xs, ys = numpy.array(points).T
+        copies = []
+
+        for matrix in self._matrices:
+            _xs, _ys = self._transform(matrix, xs, ys)
+            inside = (_xs > 0) & (_xs <= self.width) & (_ys > 0) & (_ys <= self.height)
+            if inside.any():
+                copies.append(list(zip(_xs[inside].tolist(), _ys[inside].tolist())))
+
+        return copies
+
+    def map_mask(self, x, y, mask):
+        """
+        Devuelve, por cada copia, la posición (x, y) y la máscara donde
+        cae mask, ubicada en la posición (x, y). Además de tomar muestras
+        con la tabla se incluye cada píxel de mask transformado, así las
+        líneas finas no se cortan al girarlas.
+        """
+
+        ys, xs = numpy.nonzero(mask)
+        if len(xs) == 0:
+            return []
+
+        xs, ys = xs + x, ys + y
+        height, width = mask.shape
+        copies = []
+
+        for index, matrix in enumerate(self._matrices):
+            _xs, _ys = self._transform(matrix, xs, ys)
+            inside = (_xs > 0) & (_xs <= self.width) & (_ys > 0) & (_ys <= self.height)
+            if not inside.any():
+                continue
+
+            _xs, _ys = _xs[inside], _ys[inside]
+
+            # Al girar, las muestras pueden caer un píxel más afuera
+            x0, y0 = max(int(_xs.min()) - 1, 1), max(int(_ys.min()) - 1, 1)
+            x1, y1 = min(int(_xs.max()) + 1, self.width), min(int(_ys.max()) + 1, self.height)
+
+            sx, sy = self._source(index, x0, y0, x1, y1)
+            sx, sy = sx - x, sy - y
+            valid = (sx >= 0) & (sx < width) & (sy >= 0) & (sy < height)
+
+            _mask = numpy.zeros((y1 - y0 + 1, x1 - x0 + 1), dtype=bool)
+            _mask[valid] = mask[sy[valid], sx[valid]]
+            _mask[_ys - y0, _xs - x0] = True
+
+            copies.append((x0, y0, _mask))
+
+        return copies
+
+    def get_axes(self):
+        """
+        Devuelve los ejes como segmentos (x0, y0, x1, y1) en coordenadas
+        de los bordes de los píxeles, para dibujarlos.
+        """
+
+        cx, cy = self._cx, self._cy
+        axes = []
+
+        if self.mode in [SymmetryMode.VERTICAL, SymmetryMode.BOTH]:
+            axes.append((cx, 0, cx, self.height))
+
+        if self.mode in [SymmetryMode.HORIZONTAL, SymmetryMode.BOTH]:
+            axes.append((0, cy, self.width, cy))
+
+        if self.mode == SymmetryMode.RADIAL:
+            # Un rayo por copia, hasta salir del PixelMap
+            length = math.hypot(self.width, self.height)
+            for i in range(self.folds):
+                angle = 2 * math.pi * i / self.folds - math.pi / 2
+                axes.append((cx, cy, cx + length * math.cos(angle), cy + length * math.sin(angle)))
+
+        return axes
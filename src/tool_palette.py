@@ -45,7 +45,7 @@ class ToolPalette(Gtk.Grid):
             Tool("Rectangle",           (0, 3), ToolType.RECTANGLE),
             Tool("Move",                (0, 4), ToolType.MOVE),
             Tool("Rectangle selection", (0, 5), ToolType.RECTANGLE_SELECTION),
-            Tool("Lighten",             (0, 6), ToolType.LIGHTEN),
+            Tool("Adjust colors",       (0, 6), ToolType.LIGHTEN),
             Tool("Color Picker",        (0, 7), ToolType.COLOR_PICKER),
 
             Tool("Vertical mirror pen", (1, 0), ToolType.VERTICAL_MIRROR_PENCIL),
@@ -55,6 +55,7 @@ class ToolPalette(Gtk.Grid):
             Tool("Shape selection",     (1, 4), ToolType.SHAPE_SELECTION),
             Tool("Lasso selection",     (1, 5), ToolType.LASSO_SELECTION),
             Tool("Dithering",           (1, 6), ToolType.DITHERING),
+            Tool("Dither gradient",     (1, 7), ToolType.DITHER_GRADIENT),
         ]
 
         self._create_tools_buttons()
@@ -1,11 +1,22 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from .utils import ToolType, Color
+import numpy
+
+from .utils import ToolType, Color, ReplaceScope, PaintAlgorithms
+from .selection import polygon_mask
+from .symmetry import SymmetryMode
 
 
 class Tool(object):
 
+    # La simetría que se usa si no se eligió ninguna, ver Canvas.get_symmetry
+    symmetry = SymmetryMode.NONE
+
+    # Lo que se marca debajo del mouse en las herramientas sin tamaño
+    _pixel = numpy.ones((1, 1), dtype=bool)
+    _pixel.flags.writeable = False
+
     def __init__(self, name, tool_type):
 
         self.name = name
@@ -23,61 +34,61 @@ class Tool(object):
         else:
             return secondary
 
+    def _coords_to_mask(self, coords):
+        # Posición (x, y) y máscara del rectángulo que contiene a coords
+        xs, ys = numpy.array(coords).T
+        x, y = int(xs.min()), int(ys.min())
+
+        mask = numpy.zeros((ys.max() - y + 1, xs.max() - x + 1), dtype=bool)
+        mask[ys - y, xs - x] = True
+
+        return x, y, mask
+
+    def start(self, canvas):
+        """
+        Se llama al hacer click, antes del primer apply.
+        """
+
+        pass
+
     def apply(self, canvas, coords, color=Color.PRIMARY, primary=None, secondary=None):
         pass
 
-    def get_hovered_pixels(self, canvas, x, y):
-        pixels = [(x, y)]
+    def finish(self, canvas):
+        """
+        Se llama al soltar el último botón del mouse, antes de guardar el
+        trazo en el historial.
+        """
+
+        pass
+
+    def apply_mask(self, canvas, x, y, mask, color=Color.PRIMARY, primary=None, secondary=None):
+        """
+        Igual que apply, pero con los píxeles dados como una máscara
+        ubicada en la posición (x, y). Las herramientas que pueden pintar
+        toda la máscara de una vez la sobreescriben.
+        """
+
+        ys, xs = mask.nonzero()
+        coords = [(int(_x) + x, int(_y) + y) for _x, _y in zip(xs, ys)]
+
+        return self.apply(canvas, coords, color, primary, secondary)
+
+    def get_hover(self, canvas, x, y):
+        """
+        Devuelve los píxeles que se marcan con el mouse en (x, y) como una
+        máscara de solo lectura ubicada en una posición: (x, y, mask). La
+        máscara es siempre el mismo objeto mientras no cambien el tamaño
+        o la forma del pincel.
+        """
 
         if not ToolType.is_resizable(self.type):
-            return pixels
-
-        if canvas.config.tool_size >= 2:
-            # La X es donde está el mouse
-            # ---------
-            # | X | 1 |
-            # |---|---|
-            # | 3 | 2 |
-            # ---------
-            pixels.extend([(x + 1, y),      # 1
-                           (x + 1, y + 1),  # 2
-                           (x, y + 1)])     # 3
-
-        if canvas.config.tool_size >= 3:
-            # La X es donde está el mouse
-            # -------------
-            # | 4 | 5 | 6 |
-            # |---|---|---|
-            # | 7 | X | 1 |
-            # |---|---|---|
-            # | 8 | 2 | 3 |
-            # .............
-            pixels.extend([(x - 1, y - 1),   # 4
-                           (x, y - 1),       # 5
-                           (x + 1, y - 1),   # 6
-                           (x - 1, y),       # 7
-                           (x - 1, y + 1)])  # 8
-
-        if canvas.config.tool_size == 4:
-            # La X es donde está el mouse
-            # -----------------
-            # | 4 | 5 | 6 | 9 |
-            # |---|---|---|---|
-            # | 7 | X | 1 | 10|
-            # |---|---|---|---|
-            # | 8 | 2 | 3 | 11|
-            # |---|---|---|---|
-            # | 12| 13| 14| 15|
-            # -----------------
-            pixels.extend([(x + 2, y - 1),   # 9
-                           (x + 2, y),       # 10
-                           (x + 2, y + 1),   # 11
-                           (x - 1, y + 2),   # 12
-                           (x, y + 2),       # 13
-                           (x + 1, y + 2),   # 14
-                           (x + 2, y + 2)])  # 15
-
-        return pixels
+            return x, y, self._pixel
+
+        mask, (dx, dy) = PaintAlgorithms.brush_mask(canvas.config.tool_size,
+                                                    canvas.config.brush_shape)
+
+        return x + dx, y + dy, mask
 
 
 class Pencil(Tool):
@@ -92,24 +103,18 @@ class Pencil(Tool):
 
         return True
 
+    def apply_mask(self, canvas, x, y, mask, color=Color.PRIMARY, primary=None, secondary=None):
+        canvas.pixelmap.fill_temp_region(x, y, mask, self._get_color(primary, secondary, color))
 
-class VerticalMirrorPencil(Tool):
-
-    def __init__(self):
-        Tool.__init__(self, "Vertical mirror pencil", ToolType.VERTICAL_MIRROR_PENCIL)
+        return True
 
-    def apply(self, canvas, coords, color=Color.PRIMARY, primary=None, secondary=None):
-        return Pencil.apply(self, canvas, coords, color, primary, secondary)
 
-    def get_hovered_pixels(self, canvas, x, y):
-        pixels = super().get_hovered_pixels(canvas, x, y)
+class VerticalMirrorPencil(Pencil):
 
-        for x, y in pixels:
-            mx = canvas.config.layout_size[0] - x + 1
-            if (mx, y) not in pixels:
-                pixels.append((mx, y))
+    symmetry = SymmetryMode.VERTICAL
 
-        return pixels
+    def __init__(self):
+        Tool.__init__(self, "Vertical mirror pencil", ToolType.VERTICAL_MIRROR_PENCIL)
 
 
 class Bucket(Tool):
@@ -117,36 +122,28 @@ class Bucket(Tool):
     def __init__(self):
         Tool.__init__(self, "Bucket", ToolType.BUCKET)
 
-    def _flood_fill(self, pixelmap, x, y, current_color, new_color):
+    def apply(self, canvas, coords, color=Color.PRIMARY, primary=None, secondary=None):
+        current_color = canvas.pixelmap.get_pixel_color(*coords[0])
+        new_color = self._get_color(primary, secondary, color)
+
         if current_color == new_color:
             return
 
-        if x > 1 and pixelmap.get_pixel_color(x - 1, y) == current_color and pixelmap.get_temp_pixel_color(x - 1, y) == Color.TRANSPARENT:
-            pixelmap.set_temp_pixel_color(x - 1, y, new_color)
-            self._flood_fill(pixelmap, x - 1, y, current_color, new_color)
+        fill = PaintAlgorithms.flood_fill(canvas.pixelmap, coords,
+                                          canvas.config.fill_connectivity,
+                                          current_color)
 
-        if x < pixelmap.width and pixelmap.get_pixel_color(x + 1, y) == current_color and pixelmap.get_temp_pixel_color(x + 1, y) == Color.TRANSPARENT:
-            pixelmap.set_temp_pixel_color(x + 1, y, new_color)
-            self._flood_fill(pixelmap, x + 1, y, current_color, new_color)
+        if fill is not None:
+            # Todos los píxeles del relleno eran de current_color, así que
+            # en el historial alcanza con la máscara y los dos colores
+            x, y, mask = fill
+            canvas.pixelmap.fill_region(x, y, mask, new_color)
+            canvas.commit_change(mask, Color.cairo_to_array(current_color),
+                                 Color.cairo_to_array(new_color), x, y)
 
-        if y > 1 and pixelmap.get_pixel_color(x, y - 1) == current_color and pixelmap.get_temp_pixel_color(x, y - 1) == Color.TRANSPARENT:
-            pixelmap.set_temp_pixel_color(x, y - 1, new_color)
-            self._flood_fill(pixelmap, x, y - 1, current_color, new_color)
-
-        if y < pixelmap.height and  pixelmap.get_pixel_color(x, y + 1) == current_color and pixelmap.get_temp_pixel_color(x, y + 1) == Color.TRANSPARENT:
-            pixelmap.set_temp_pixel_color(x, y + 1, new_color)
-            self._flood_fill(pixelmap, x, y + 1, current_color, new_color)
-
-    def apply(self, canvas, coords, color=Color.PRIMARY, primary=None, secondary=None):
-        x, y = 0, 1
-
-        _color = self._get_color(primary, secondary, color)
-
-        for coord in coords:
-            current_pixel = canvas._hovered_pixels[0]
-            current_color = canvas.pixelmap.get_pixel_color(*current_pixel)
-            canvas.pixelmap.set_temp_pixel_color(coord[x], coord[y], _color)
-            self._flood_fill(canvas.pixelmap, coord[x], coord[y], current_color, _color)
+        # Los píxeles debajo del mouse se pintan siempre
+        for x, y in coords:
+            canvas.pixelmap.set_temp_pixel_color(x, y, new_color)
 
         return True
 
@@ -157,25 +154,22 @@ class SpecialBucket(Tool):
         Tool.__init__(self, "Special bucket", ToolType.SPECIAL_BUCKET)
 
     def apply(self, canvas, coords, color=Color.PRIMARY, primary=None, secondary=None):
-        current_pixel = canvas._hovered_pixels[0]
-        current_color = canvas.pixelmap.get_pixel_color(*current_pixel)
+        current_color = canvas.pixelmap.get_pixel_color(*coords[0])
         new_color = self._get_color(primary, secondary, color)
 
-        if current_color == new_color:
-            return
+        scope = canvas.config.replace_scope
+        if scope == ReplaceScope.ALL_FRAMES:
+            # Los demás frames los maneja el CanvasesNotebook
+            canvas.emit("replace-color-in-frames", current_color, new_color)
+            return True
 
-        if current_color != Color.TRANSPARENT:
-            for pixel in canvas.pixelmap.pixels:
-                if canvas.pixelmap.get_pixel_color(pixel.x, pixel.y) == current_color:
-                    canvas.pixelmap.set_temp_pixel_color(pixel.x, pixel.y, new_color)
+        mask = None
+        if scope == ReplaceScope.SELECTION:
+            mask = canvas.get_selection_mask()
+            if mask is None:
+                return
 
-        else:
-            for x in range(1, canvas.pixelmap.width + 1):
-                for y in range(1, canvas.pixelmap.height + 1):
-                    if canvas.pixelmap.get_pixel_color(x, y) == Color.TRANSPARENT:
-                        canvas.pixelmap.set_temp_pixel_color(x, y, new_color)
-
-        return True
+        return canvas.replace_color(current_color, new_color, mask)
 
 
 class Eraser(Tool):
@@ -189,6 +183,11 @@ class Eraser(Tool):
 
         return True
 
+    def apply_mask(self, canvas, x, y, mask, color=Color.PRIMARY, primary=None, secondary=None):
+        canvas.pixelmap.fill_temp_region(x, y, mask, Color.TRANSPARENT)
+
+        return True
+
 
 class Rectangle(Tool):
 
@@ -198,40 +197,18 @@ class Rectangle(Tool):
     def apply(self, canvas, coords, color=Color.PRIMARY, primary=None, secondary=None):
         _color = self._get_color(primary, secondary, color)
 
-        start = canvas.get_relative_coords(*canvas._click_mouse_position)
-        end = canvas.get_relative_coords(*canvas._mouse_position)
-
-        if start[0] >= end[0] and start[1] >= end[1]:
-            resp = end
-            end = start
-            start = resp
-
-        elif start[0] > end[0] and start[1] <= end[1]:
-            resp1 = (end[0], start[1])
-            resp2 = (start[0], end[1])
-
-            start = resp1
-            end = resp2
-
-        elif start[0] < end[0] and start[1] >= end[1]:
-            resp1 = (start[0], end[1])
-            resp2 = (end[0], start[1])
+        x0, y0 = canvas.get_click_position()
+        x1, y1 = canvas.get_mouse_position()
 
-            start = resp1
-            end = resp2
+        left, top = min(x0, x1), min(y0, y1)
+        width, height = abs(x1 - x0) + 1, abs(y1 - y0) + 1
 
-        temp_pixels = []
+        # Solo el borde, de ancho tool_size
+        size = canvas.config.tool_size
+        mask = numpy.ones((height, width), dtype=bool)
+        mask[size:max(height - size, 0), size:max(width - size, 0)] = False
 
-        for x in range(start[0], end[0] + 1):
-            for y in range(start[1], end[1] + 1):
-                if x + 1 > start[0] + canvas.config.tool_size and \
-                   x - 1 < end[0] - canvas.config.tool_size and \
-                   y + 1 > start[1] + canvas.config.tool_size and \
-                   y - 1 < end[1] - canvas.config.tool_size:
-
-                    continue
-
-                canvas.pixelmap.set_temp_pixel_color(x, y, _color)
+        canvas.pixelmap.set_preview(left, top, mask, _color)
 
         return True
 
@@ -241,318 +218,94 @@ class Stroke(Tool):
     def __init__(self):
         Tool.__init__(self, "Stroke", ToolType.STROKE)
 
-    def _get_useful_pixels(self, canvas):
-        """
-        Devuelve la mínima cantidad de píxeles necesarios
-        para aplicar la herramienta stroke (cuando canvas.config.tool_size
-        es igual a 3 o 4, para un tool_size de 1 o 2 no es necesaria la
-        optimización). Aún así, esta optimización parece no ser suficiente.
-        """
+    def apply(self, canvas, coords, color=Color.PRIMARY, primary=None, secondary=None):
+        x0, y0 = canvas.get_click_position()
+        x1, y1 = canvas.get_mouse_position()
+        _color = self._get_color(primary, secondary, color)
 
-        start = canvas.get_relative_coords(*canvas._click_mouse_position)
-        end = canvas.get_relative_coords(*canvas._mouse_position)
-
-        x1, y1 = start
-        x2, y2 = end
-
-        start_points = []
-        end_points = []
-        # -----------------
-        # | 4 | 5 | 6 | 9 |
-        # |---|---|---|---|
-        # | 7 | X | 1 | 10|
-        # |---|---|---|---|
-        # | 8 | 2 | 3 | 11|
-        # |---|---|---|---|
-        # | 12| 13| 14| 15|
-        # -----------------
-
-        if canvas.config.tool_size <= 2:
-            # Si es de 1x1 o 2x2 no hay gran pérdida de rendimiento
-            start_points = canvas.get_hovered_pixels(canvas._click_mouse_position)
-            end_points = canvas.get_hovered_pixels(canvas._mouse_position)
-
-        elif canvas.config.tool_size == 3:
-            if x1 > x2 and y1 > y2:
-                start_points = [
-                    (x1 + 1, y1 - 1),
-                    (x1 + 1, y1),
-                    (x1 + 1, y1 + 1),
-                    (x1, y1 + 1),
-                    (x1 - 1, y1 + 1),
-                ]
-
-                end_points = [
-                    (x2 + 1, y2 - 1),
-                    (x2, y2 - 1),
-                    (x2 - 1, y2 - 1),
-                    (x2 - 1, y2),
-                    (x2 - 1, y2 + 1),
-                ]
-
-            elif x1 > x2 and y1 < y2:
-                start_points = [
-                    (x1 - 1, y1 - 1),
-                    (x1, y1 - 1),
-                    (x1 + 1, y1 -1),
-                    (x1 + 1, y1),
-                    (x1 + 1, y1 + 1),
-                ]
-
-                end_points = [
-                    (x2 - 1, y2 - 1),
-                    (x2 - 1, y2),
-                    (x2 - 1, y2 + 1),
-                    (x2, y2 + 1),
-                    (x2 + 1, y2 + 1)
-                ]
-
-            elif x1 < x2 and y1 > y2:
-                start_points = [
-                    (x1 - 1, y1 - 1),
-                    (x1 - 1, y1),
-                    (x1 - 1, y1 + 1),
-                    (x1, y1 + 1),
-                    (x1 + 1, y1 + 1)
-                ]
-
-                end_points = [
-                    (x2 - 1, y2 - 1),
-                    (x2, y2 - 1),
-                    (x2 + 1, y2 -1),
-                    (x2 + 1, y2),
-                    (x2 + 1, y2 + 1),
-                ]
-
-            elif x1 < x2 and y1 < y2:
-                start_points = [
-                    (x1 + 1, y1 - 1),
-                    (x1, y1 - 1),
-                    (x1 - 1, y1 - 1),
-                    (x1 - 1, y1),
-                    (x1 - 1, y1 + 1),
-                ]
-
-                end_points = [
-                    (x2 + 1, y2 - 1),
-                    (x2 + 1, y2),
-                    (x2 + 1, y2 + 1),
-                    (x2, y2 + 1),
-                    (x2 - 1, y2 + 1),
-                ]
-
-            elif y1 == y2 and x1 >= x2:
-                start_points = [(x1 + 1, y1 + i) for i in range(-1, 2)]
-                end_points = [(x2 - 1, y2 + i) for i in range(-1, 2)]
-
-            elif y1 == y2 and x1 < x2:
-                start_points = [(x1 - 1, y1 + i) for i in range(-1, 2)]
-                end_points = [(x2 + 1, y2 + i) for i in range(-1, 2)]
-
-            elif x1 == x2 and y1 > y2:
-                start_points = [(x1 + i, y1 + 1) for i in range(-1, 2)]
-                end_points = [(x2 + i, y2 - 1) for i in range(-1, 2)]
-
-            elif x1 == x2 and y1 < y2:
-                start_points = [(x1 + i, y1 - 1) for i in range(-1, 2)]
-                end_points = [(x2 + i, y2 + 1) for i in range(-1, 2)]
+        brush, offset = PaintAlgorithms.brush_mask(canvas.config.tool_size,
+                                                   canvas.config.brush_shape)
+        x, y, mask = PaintAlgorithms.stamp_line(x0, y0, x1, y1, brush, offset)
+        canvas.pixelmap.set_preview(x, y, mask, _color)
 
-        else:
-        #elif self.config.tool_size == 4:
-            if x1 > x2 and y1 > y2:
-                start_points = [
-                    (x1 + 2, y1 - 1),
-                    (x1 + 2, y1),
-                    (x1 + 2, y1 + 1),
-                    (x1 + 2, y1 + 2),
-                    (x1 + 1, y1 + 2),
-                    (x1, y1 + 2),
-                    (x1 - 1, y1 + 2)
-                ]
-
-                end_points = [
-                    (x2 + 2, y2 - 1),
-                    (x2 + 1, y2 - 1),
-                    (x2, y2 - 1),
-                    (x2 - 1, y2 - 1),
-                    (x2 - 1, y2),
-                    (x2 - 1, y2 + 1),
-                    (x2 - 1, y2 + 2)
-                ]
-
-            elif x1 > x2 and y1 < y2:
-                start_points = [
-                    (x1 - 1, y1 - 1),
-                    (x1, y1 - 1),
-                    (x1 + 1, y1 - 1),
-                    (x1 + 2, y1 - 1),
-                    (x1 + 2, y1),
-                    (x1 + 2, y1 + 1),
-                    (x1 + 2, y1 + 2),
-                ]
-
-                end_points = [
-                    (x2 - 1, y2 - 1),
-                    (x2 - 1, y2),
-                    (x2 - 1, y2 + 1),
-                    (x2 - 1, y2 + 2),
-                    (x2, y2 + 2),
-                    (x2 + 1, y2 + 2),
-                    (x2 + 2, y2 + 2),
-                ]
-
-            elif x1 < x2 and y1 > y2:
-                start_points = [
-                    (x1 - 1, y1 - 1),
-                    (x1 - 1, y1),
-                    (x1 - 1, y1 + 1),
-                    (x1 - 1, y1 + 2),
-                    (x1, y1 + 2),
-                    (x1 + 1, y1 + 2),
-                    (x1 + 2, y1 + 2)
-                ]
-
-                end_points = [
-                    (x2 - 1, y2 - 1),
-                    (x2, y2 - 1),
-                    (x2 + 1, y2 - 1),
-                    (x2 + 2, y2 - 1),
-                    (x2 + 2, y2),
-                    (x2 + 2, y2 + 1),
-                    (x2 + 2, y2 + 2)
-                ]
-
-            elif x1 < x2 and y1 < y2:
-                start_points = [
-                    (x1 + 2, y1 - 1),
-                    (x1 + 1, y1 - 1),
-                    (x1, y1 - 1),
-                    (x1 - 1, y1 - 1),
-                    (x1 - 1, y1),
-                    (x1 - 1, y1 + 1),
-                    (x1 - 1, y1 + 2),
-                ]
-
-                end_points = [
-                    (x2 + 2, y2 - 1),
-                    (x2 + 2, y2),
-                    (x2 + 2, y2 + 1),
-                    (x2 + 2, y2 + 2),
-                    (x2 + 1, y2 + 2),
-                    (x2, y2 + 2),
-                    (x2 - 1, y2 + 2),
-                ]
-
-            elif y1 == y2 and x1 >= x2:
-                start_points = [(x1 + 2, y1 + i) for i in range(-1, 3)]
-                end_points = [(x2 - 1, y1 + i) for i in range(-1, 3)]
-
-            elif y1 == y2 and x1 < x2:
-                start_points = [(x1 - 1, y1 + i) for i in range(-1, 3)]
-                end_points = [(x2 + 2, y1 + i) for i in range(-1, 3)]
-
-            elif x1 == x2 and y1 > y2:
-                start_points = [(x1 + i, y1 + 2) for i in range(-1, 3)]
-                end_points = [(x2 + i, y2 - 1) for i in range(-1, 3)]
-
-            elif x1 == x2 and y1 < y2:
-                start_points = [(x1 + i, y1 - 1) for i in range(-1, 3)]
-                end_points = [(x2 + i, y2 + 2) for i in range(-1, 3)]
-
-        return start_points, end_points
-
-    def _draw_line(self, pixelmap, x0, y0, x1, y1, color):
-        """
-        Algorítmo basado en el pseudocódigo de:
-        https://es.wikipedia.org/wiki/Algoritmo_de_Bresenham#Descripci%C3%B3n
-        """
+        return True
 
-        if x0 != x1:
-            delta_y = (y1 - y0)
-            delta_x = (x1 - x0)
 
-            if delta_y >= 0:
-                inclinacion_y_i = 1
+class Move(Tool):
 
-            else:
-                delta_y = - delta_y
-                inclinacion_y_i = -1
+    def __init__(self):
+        Tool.__init__(self, "Move", ToolType.MOVE)
 
-            if delta_x >= 0:
-                inclinacion_x_i = 1
+        self._origin = None
 
-            else:
-                delta_x = -delta_x
-                inclinacion_x_i = -1
+    def start(self, canvas):
+        self._origin = canvas.get_click_position()
+        canvas.lift_floating()
 
-            if delta_x >= delta_y:
-                avance_y_recto = 0
-                avance_x_recto = inclinacion_x_i
+    def apply(self, canvas, coords, color=Color.PRIMARY, primary=None, secondary=None):
+        x, y = canvas.get_mouse_position()
+        canvas.move_floating(x - self._origin[0], y - self._origin[1])
 
-            else:
-                avance_x_recto = 0
-                avance_y_recto = inclinacion_y_i
+    def finish(self, canvas):
+        canvas.drop_floating()
 
-                k = delta_x
-                delta_x = delta_y
-                delta_y = k
 
-            x = x0
-            y = y0
+class RectangleSelection(Tool):
 
-            avR = (2 * delta_y)
-            av = (avR - delta_x)
-            avI = (av - delta_x)
+    def __init__(self):
+        Tool.__init__(self, "Rectangle selection", ToolType.RECTANGLE_SELECTION)
 
-            while x != x1:
-                pixelmap.set_temp_pixel_color(x, y, color)
+    def apply(self, canvas, coords, color=Color.PRIMARY, primary=None, secondary=None):
+        x0, y0 = canvas.get_click_position()
+        x1, y1 = canvas.get_mouse_position()
 
-                if av >= 0:
-                    x += inclinacion_x_i
-                    y += inclinacion_y_i
-                    av += avI
+        mask = numpy.ones((abs(y1 - y0) + 1, abs(x1 - x0) + 1), dtype=bool)
+        canvas.update_selection(min(x0, x1), min(y0, y1), mask)
 
-                else:
-                    x += avance_x_recto
-                    y += avance_y_recto
-                    av += avR
 
-            if y != y1:
-                # En algunas situaciones no se pintan los píxeles en la
-                # columna del pixel final
-                for _y in range(min(y, y1), max(y, y1) + 1):
-                    pixelmap.set_temp_pixel_color(x, _y, color)
+class ShapeSelection(Tool):
+
+    def __init__(self):
+        Tool.__init__(self, "Shape selection", ToolType.SHAPE_SELECTION)
 
-            # El último pixel siempre se pinta
-            pixelmap.set_temp_pixel_color(x1, y1, color)
+        self._shape = None
+        self._last = None
 
-        else:
-            for y in range(min(y0, y1), max(y0, y1) + 1):
-                pixelmap.set_temp_pixel_color(x0, y, color)
+    def start(self, canvas):
+        self._shape = numpy.zeros((canvas.pixelmap.height, canvas.pixelmap.width), dtype=bool)
+        self._last = None
 
     def apply(self, canvas, coords, color=Color.PRIMARY, primary=None, secondary=None):
-        start_points, end_points = self._get_useful_pixels(canvas)
-        _color = self._get_color(primary, secondary, color)
+        height, width = self._shape.shape
 
-        for i in range(0, len(start_points)):
-            x0, y0 = start_points[i]
-            x1, y1 = end_points[i]
+        # Se une con el punto anterior para no dejar huecos
+        x, y = coords[0]
+        x0, y0 = self._last or (x, y)
+        xs, ys = PaintAlgorithms.line(x0, y0, x, y)
+        inside = (xs > 0) & (xs <= width) & (ys > 0) & (ys <= height)
+        self._shape[ys[inside] - 1, xs[inside] - 1] = True
+        self._last = (x, y)
 
-            self._draw_line(canvas.pixelmap, x0, y0, x1, y1, _color)
+        canvas.update_selection(1, 1, self._shape)
 
-        return True
 
-
-class ShapeSelection(Tool):
+class LassoSelection(Tool):
 
     def __init__(self):
-        Tool.__init__(self, "Shape selection", ToolType.LIGHTEN)
+        Tool.__init__(self, "Lasso selection", ToolType.LASSO_SELECTION)
+
+        self._points = []
+
+    def start(self, canvas):
+        self._points = []
 
     def apply(self, canvas, coords, color=Color.PRIMARY, primary=None, secondary=None):
-        for x, y in coords:
-            canvas.select_pixel(x, y)
+        if self._points[-1:] == coords[:1]:
+            return
 
-        return True
+        self._points.append(coords[0])
+        mask = polygon_mask(self._points, canvas.pixelmap.width, canvas.pixelmap.height)
+        canvas.update_selection(1, 1, mask)
 
 
 class Lighten(Tool):
@@ -561,16 +314,25 @@ class Lighten(Tool):
         Tool.__init__(self, "Lighten", ToolType.LIGHTEN)
 
     def apply(self, canvas, coords, color=Color.PRIMARY, primary=None, secondary=None):
-        for x, y in coords:
-            current_color = canvas.pixelmap.get_temp_pixel_color(x, y)
-            if current_color == Color.TRANSPARENT:
-                current_color = canvas.pixelmap.get_pixel_color(x, y)
+        x, y, mask = self._coords_to_mask(coords)
+        return self.apply_mask(canvas, x, y, mask, color, primary, secondary)
 
-            if current_color[-1] == 0:  # Si sigue siendo transparente
-                continue
+    def apply_mask(self, canvas, x, y, mask, color=Color.PRIMARY, primary=None, secondary=None):
+        # Se parte de los colores de antes del trazo, así cada píxel se
+        # ajusta una sola vez aunque el pincel pase varias veces por él
+        height, width = mask.shape
+        region = canvas.pixelmap.get_region(x, y, width, height)
+        mask = mask & (region[:, :, Color.ALPHA] > 0)
 
-            new_color = tuple(value + 0.08 for value in current_color)
-            canvas.pixelmap.set_temp_pixel_color(x, y, new_color)
+        # Con el botón secundario se hace el ajuste contrario
+        amount = canvas.config.adjustment_amount / 100
+        if color == Color.SECONDARY:
+            amount = -amount
+
+        region[mask] = PaintAlgorithms.adjust_colors(region[mask], canvas.config.adjustment, amount)
+        canvas.pixelmap.set_temp_region(x, y, region, mask)
+
+        return True
 
 
 class ColorPicker(Tool):
@@ -595,14 +357,65 @@ class Dithering(Tool):
         Tool.__init__(self, "Dithering", ToolType.DITHERING)
 
     def apply(self, canvas, coords, color=Color.PRIMARY, primary=None, secondary=None):
-        for x, y in coords:
-            if (x + y) % 2 == 0:
-                canvas.pixelmap.set_temp_pixel_color(x, y,
-                    canvas.config.primary_color if color == Color.PRIMARY else canvas.config.secondary_color)
+        x, y, mask = self._coords_to_mask(coords)
+        return self.apply_mask(canvas, x, y, mask, color, primary, secondary)
+
+    def apply_mask(self, canvas, x, y, mask, color=Color.PRIMARY, primary=None, secondary=None):
+        height, width = mask.shape
+        pattern = PaintAlgorithms.dither_mask(x, y, width, height,
+                                              canvas.config.dither_pattern,
+                                              canvas.config.dither_level / 100)
+
+        first = canvas.config.primary_color if color == Color.PRIMARY else canvas.config.secondary_color
+        second = canvas.config.secondary_color if color == Color.PRIMARY else canvas.config.primary_color
+
+        canvas.pixelmap.fill_temp_region(x, y, mask & pattern, first)
+        canvas.pixelmap.fill_temp_region(x, y, mask & ~pattern, second)
+
+        return True
+
+
+class DitherGradient(Tool):
+    """
+    Rellena la selección (o todo el frame si no hay nada seleccionado)
+    con un degradé tramado que va del color del botón usado, donde se
+    hizo click, al otro color, donde está el mouse. Sin arrastrar se
+    rellena con la densidad de config.dither_level.
+    """
+
+    def __init__(self):
+        Tool.__init__(self, "Dither gradient", ToolType.DITHER_GRADIENT)
+
+    def apply(self, canvas, coords, color=Color.PRIMARY, primary=None, secondary=None):
+        start = canvas.get_click_position()
+        end = canvas.get_mouse_position()
+
+        bounds = canvas.selection.get_bounds()
+        if bounds is None:
+            x, y, width, height = 1, 1, canvas.pixelmap.width, canvas.pixelmap.height
+            mask = numpy.ones((height, width), dtype=bool)
+
+        else:
+            x, y, width, height = bounds
+            mask = canvas.selection.mask[y - 1:y - 1 + height, x - 1:x - 1 + width]
+
+        if start == end:
+            level = canvas.config.dither_level / 100
+
+        else:
+            level = 1 - PaintAlgorithms.linear_gradient(x, y, width, height, start, end)
+
+        pattern = PaintAlgorithms.dither_mask(x, y, width, height,
+                                              canvas.config.dither_pattern, level)
+
+        first = canvas.config.primary_color if color == Color.PRIMARY else canvas.config.secondary_color
+        second = canvas.config.secondary_color if color == Color.PRIMARY else canvas.config.primary_color
+
+        data = numpy.empty((height, width, 4), dtype=numpy.uint8)
+        data[:] = Color.cairo_to_array(second)
+        data[pattern] = Color.cairo_to_array(first)
 
-            else:
-                canvas.pixelmap.set_temp_pixel_color(x, y,
-                    canvas.config.secondary_color if color == Color.PRIMARY else canvas.config.primary_color)
+        canvas.pixelmap.set_preview_region(x, y, data, mask)
 
         return True
 
@@ -615,12 +428,13 @@ TOOLS = {
     ToolType.ERASER: Eraser(),
     ToolType.RECTANGLE: Rectangle(),
     ToolType.STROKE: Stroke(),
-    # ToolType.MOVE: (),
+    ToolType.MOVE: Move(),
     # ToolType.CIRCLE: (),
-    # ToolType.RECTANGLE_SELECTION: (),
+    ToolType.RECTANGLE_SELECTION: RectangleSelection(),
     ToolType.SHAPE_SELECTION: ShapeSelection(),
     ToolType.LIGHTEN: Lighten(),
-    # ToolType.LASSO_SELECTION: (),
+    ToolType.LASSO_SELECTION: LassoSelection(),
     ToolType.COLOR_PICKER: ColorPicker(),
     ToolType.DITHERING: Dithering(),
+    ToolType.DITHER_GRADIENT: DitherGradient(),
 }
@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 import os
+import bisect
 import numpy
 
 from PIL import Image
@@ -13,7 +14,6 @@ from gi.repository import GdkPixbuf
 
 SPRYTE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 SVG_PIXEL_SIZE = 20
-PixelMap = None
 
 
 class Color:
@@ -31,6 +31,8 @@ class Color:
     TRANSPARENT = (0, 0, 0, 0)
 
     SELECTED_PIXEL = (0.31, 0.76, 1, 0.45)
+    GRID = (0.45, 0.45, 0.45, 1)
+    SYMMETRY_AXIS = (1, 0.3, 0.3, 0.8)
 
     @classmethod
     def gdk_to_cairo(self, color, alpha=65535):
@@ -70,6 +72,51 @@ class Color:
             color[3] / 255
         )
 
+    @classmethod
+    def cairo_to_array(self, color):
+        # Redondeo en lugar de truncar (como en cairo_to_rgba) para que
+        # array_to_cairo(cairo_to_array(c)) devuelva el mismo color
+        if color[self.ALPHA] == 0:
+            return numpy.zeros(4, dtype=numpy.uint8)
+
+        return numpy.rint(numpy.clip(color, 0, 1) * 255).astype(numpy.uint8)
+
+    @classmethod
+    def array_to_cairo(self, values):
+        if values[self.ALPHA] == 0:
+            return self.TRANSPARENT
+
+        return self.rgba_to_cairo([int(value) for value in values])
+
+
+class ReplaceScope:
+    # Dónde reemplaza el color SpecialBucket
+    FRAME = 0
+    SELECTION = 1
+    ALL_FRAMES = 2
+
+
+class BrushShape:
+    SQUARE = 0
+    ROUND = 1
+    CUSTOM = 2  # Ver PaintAlgorithms.set_custom_brush
+
+
+class DitherPattern:
+    # Umbrales de Dithering, ver PaintAlgorithms.dither_tile
+    BAYER_2 = 0
+    BAYER_4 = 1
+    BAYER_8 = 2
+    CUSTOM = 3  # Ver PaintAlgorithms.set_custom_pattern
+
+
+class ColorAdjustment:
+    # Qué cambia Lighten, ver PaintAlgorithms.adjust_colors
+    LIGHTEN = 0
+    DARKEN = 1
+    HUE = 2
+    SATURATION = 3
+
 
 class ToolType:
     PENCIL = 0
@@ -87,6 +134,7 @@ class ToolType:
     LASSO_SELECTION = 12
     COLOR_PICKER = 13
     DITHERING = 14
+    DITHER_GRADIENT = 15
 
     ICONS = {
         PENCIL: os.path.join(SPRYTE_DIR, "icons", "pencil.svg"),
@@ -110,7 +158,40 @@ class ToolType:
             self.RECTANGLE_SELECTION,
             self.SHAPE_SELECTION,
             self.LASSO_SELECTION,
-            self.COLOR_PICKER
+            self.COLOR_PICKER,
+            self.DITHER_GRADIENT
+        ]
+
+    @classmethod
+    def is_selection_tool(self, tool):
+        return tool in [
+            self.RECTANGLE_SELECTION,
+            self.SHAPE_SELECTION,
+            self.LASSO_SELECTION
+        ]
+
+    @classmethod
+    def is_freehand(self, tool):
+        # Herramientas que pintan por donde pasa el mouse, uniendo los
+        # puntos con líneas (ver Canvas._flush_motion)
+        return tool in [
+            self.PENCIL,
+            self.VERTICAL_MIRROR_PENCIL,
+            self.ERASER,
+            self.LIGHTEN,
+            self.DITHERING
+        ]
+
+    @classmethod
+    def is_symmetric(self, tool):
+        # Herramientas que se copian con la simetría, ver Canvas.get_symmetry
+        return tool in [
+            self.PENCIL,
+            self.VERTICAL_MIRROR_PENCIL,
+            self.BUCKET,
+            self.ERASER,
+            self.LIGHTEN,
+            self.DITHERING
         ]
 
     @classmethod
@@ -124,7 +205,8 @@ class ToolType:
             self.STROKE,
             self.CIRCLE,
             self.LIGHTEN,
-            self.DITHERING
+            self.DITHERING,
+            self.DITHER_GRADIENT
         ]
 
 
@@ -218,105 +300,515 @@ class FileChooserManager:
 
 class PaintAlgorithms:
 
+    # Ver brush_mask
+    _brushes = {}
+    _custom_brush = numpy.ones((1, 1), dtype=bool)
+
+    # Ver dither_tile
+    _dither_tiles = {}
+    _custom_pattern = numpy.eye(2, dtype=bool)
+
+    # Margen inicial alrededor de los seeds al rellenar, ver flood_fill
+    FILL_WINDOW = 256
+
+    # Lo que cuesta cada vuelta de un ciclo en stamp_path, medido en
+    # píxeles de una operación con máscaras
+    STAMP_OVERHEAD = 1024
+
     @classmethod
-    def flood_fill(self, pixelmap, x, y, current_color, new_color):
-        if current_color == new_color:
-            return
+    def line(self, x0, y0, x1, y1):
+        """
+        Devuelve dos arrays con las coordenadas x e y de la línea entre
+        (x0, y0) y (x1, y1), los dos incluidos. Son los mismos píxeles que
+        elige Bresenham, pero calculados de una vez: en cada paso sobre el
+        eje más largo se redondea la posición sobre el otro.
+        """
 
-        if x > 1 and pixelmap.get_pixel_color(x - 1, y) == current_color and pixelmap.get_temp_pixel_color(x - 1, y) == Color.TRANSPARENT:
-            pixelmap.set_temp_pixel_color(x - 1, y, new_color)
-            self.flood_fill(pixelmap, x - 1, y, current_color, new_color)
+        dx = x1 - x0
+        dy = y1 - y0
+        steps = max(abs(dx), abs(dy))
 
-        if x < pixelmap.width and pixelmap.get_pixel_color(x + 1, y) == current_color and pixelmap.get_temp_pixel_color(x + 1, y) == Color.TRANSPARENT:
-            pixelmap.set_temp_pixel_color(x + 1, y, new_color)
-            self.flood_fill(pixelmap, x + 1, y, current_color, new_color)
+        if steps == 0:
+            return numpy.array([x0]), numpy.array([y0])
 
-        if y > 1 and pixelmap.get_pixel_color(x, y - 1) == current_color and pixelmap.get_temp_pixel_color(x, y - 1) == Color.TRANSPARENT:
-            pixelmap.set_temp_pixel_color(x, y - 1, new_color)
-            self.flood_fill(pixelmap, x, y - 1, current_color, new_color)
+        i = numpy.arange(steps + 1)
+        # División entera redondeando hacia arriba en la mitad, igual
+        # para los dos sentidos de la línea
+        xs = x0 + numpy.sign(dx) * ((2 * i * abs(dx) + steps) // (2 * steps))
+        ys = y0 + numpy.sign(dy) * ((2 * i * abs(dy) + steps) // (2 * steps))
 
-        if y < pixelmap.height and  pixelmap.get_pixel_color(x, y + 1) == current_color and pixelmap.get_temp_pixel_color(x, y + 1) == Color.TRANSPARENT:
-            pixelmap.set_temp_pixel_color(x, y + 1, new_color)
-            self.flood_fill(pixelmap, x, y + 1, current_color, new_color)
+        return xs, ys
 
     @classmethod
-    def replace(self, pixelmap, current_color, new_color):
-        if current_color == new_color:
-            return
+    def set_custom_brush(self, mask):
+        """
+        Cambia la forma del pincel BrushShape.CUSTOM por mask, un array de
+        booleanos (alto, ancho) que se escala según el tamaño del pincel.
+        """
 
-        for pixel in pixelmap.pixels:
-            if pixelmap.get_pixel_color(pixel.x, pixel.y) == current_color:
-                pixelmap.set_temp_pixel_color(pixel.x, pixel.y, new_color)
+        self._custom_brush = numpy.array(mask, dtype=bool)
+
+        for key in list(self._brushes.keys()):
+            if key[0] == BrushShape.CUSTOM:
+                del self._brushes[key]
+
+    @classmethod
+    def _make_brush(self, size, shape):
+        if shape == BrushShape.ROUND:
+            # Un poco menos que el radio, así los bordes no quedan planos
+            center = numpy.arange(size) + 0.5 - size / 2
+            distance = center[:, None] ** 2 + center[None, :] ** 2
+            mask = distance <= (size / 2) ** 2 - size / 4
+
+        elif shape == BrushShape.CUSTOM:
+            height, width = self._custom_brush.shape
+            scale = size / max(height, width)
+            rows = (numpy.arange(max(1, int(round(height * scale)))) / scale).astype(int)
+            columns = (numpy.arange(max(1, int(round(width * scale)))) / scale).astype(int)
+            mask = self._custom_brush[rows][:, columns]
+
+        else:
+            mask = numpy.ones((size, size), dtype=bool)
+
+        mask.flags.writeable = False
+
+        height, width = mask.shape
+        offset = (-((width - 1) // 2), -((height - 1) // 2))
+
+        return mask, offset
 
     @classmethod
-    def line(self, pixelmap, x0, y0, x1, y1, color):
+    def _get_brush(self, size, shape):
+        brush = self._brushes.get((shape, size), None)
+        if brush is None:
+            brush = self._make_brush(size, shape)
+            self._brushes[(shape, size)] = brush
+
+        return brush
+
+    @classmethod
+    def brush_mask(self, size, shape=None):
         """
-        Algorítmo basado en el pseudocódigo de:
-        https://es.wikipedia.org/wiki/Algoritmo_de_Bresenham#Descripci%C3%B3n
+        Devuelve la máscara del pincel (de solo lectura) y el
+        desplazamiento (x, y) de su esquina superior izquierda respecto al
+        pixel del mouse. Las máscaras se calculan una sola vez por forma
+        y tamaño.
         """
 
-        if x0 != x1:
-            delta_y = (y1 - y0)
-            delta_x = (x1 - x0)
+        if shape is None:
+            shape = BrushShape.SQUARE
 
-            if delta_y >= 0:
-                inclinacion_y_i = 1
+        return self._get_brush(size, shape)
 
-            else:
-                delta_y = - delta_y
-                inclinacion_y_i = -1
+    @classmethod
+    def stamp_line(self, x0, y0, x1, y1, brush, offset=(0, 0)):
+        """
+        Estampa la máscara brush en cada pixel de la línea entre (x0, y0)
+        y (x1, y1). Ver stamp_path.
+        """
 
-            if delta_x >= 0:
-                inclinacion_x_i = 1
+        return self.stamp_path([(x0, y0), (x1, y1)], brush, offset)
 
-            else:
-                delta_x = -delta_x
-                inclinacion_x_i = -1
+    @classmethod
+    def _mask_edge(self, mask):
+        # Los píxeles de mask que tienen algún vecino (también en diagonal)
+        # fuera de ella
+        height, width = mask.shape
+        padded = numpy.zeros((height + 2, width + 2), dtype=bool)
+        padded[1:-1, 1:-1] = mask
 
-            if delta_x >= delta_y:
-                avance_y_recto = 0
-                avance_x_recto = inclinacion_x_i
+        inner = mask.copy()
+        for dy in range(3):
+            for dx in range(3):
+                inner &= padded[dy:dy + height, dx:dx + width]
 
-            else:
-                avance_x_recto = 0
-                avance_y_recto = inclinacion_y_i
+        return mask & ~inner
+
+    @classmethod
+    def stamp_path(self, points, brush, offset=(0, 0)):
+        """
+        Estampa la máscara brush en cada pixel de las líneas que unen los
+        puntos (x, y) de points, en orden. Devuelve la posición (x, y) de
+        la esquina superior izquierda del resultado y una única máscara
+        con todos los píxeles cubiertos, así cada uno se pinta una sola
+        vez aunque las líneas se crucen.
+        """
+
+        xs, ys = zip(*[self.line(x0, y0, x1, y1)
+                       for (x0, y0), (x1, y1) in zip(points, points[1:] or points)])
+        xs, ys = numpy.concatenate(xs), numpy.concatenate(ys)
+        left, top = int(xs.min()), int(ys.min())
+
+        # Máscara del camino, así los píxeles por los que se pasa más de
+        # una vez (como los extremos de las líneas) cuentan una sola
+        path = numpy.zeros((int(ys.max()) - top + 1, int(xs.max()) - left + 1), dtype=bool)
+        path[ys - top, xs - left] = True
+
+        height, width = brush.shape
+        path_height, path_width = path.shape
+        mask = numpy.zeros((path_height + height - 1, path_width + width - 1), dtype=bool)
+
+        # Dilatación del camino con el pincel. Como el camino es continuo,
+        # alcanza con el pincel entero en el primer píxel y el camino
+        # corrido a cada píxel del borde del pincel. Si cuesta menos (un
+        # click, o una línea larga que ocupa poco de su rectángulo) se
+        # estampa el pincel en cada píxel del camino
+        edge_ys, edge_xs = numpy.nonzero(self._mask_edge(brush))
+        path_ys, path_xs = numpy.nonzero(path)
+
+        if len(edge_xs) * (path.size + self.STAMP_OVERHEAD) <= \
+           len(path_xs) * (brush.size + self.STAMP_OVERHEAD):
+            x, y = xs[0] - left, ys[0] - top
+            mask[y:y + height, x:x + width] = brush
+
+            for y, x in zip(edge_ys.tolist(), edge_xs.tolist()):
+                mask[y:y + path_height, x:x + path_width] |= path
+
+        else:
+            for y, x in zip(path_ys.tolist(), path_xs.tolist()):
+                mask[y:y + height, x:x + width] |= brush
+
+        return left + offset[0], top + offset[1], mask
+
+    @classmethod
+    def set_custom_pattern(self, mask):
+        """
+        Usa la máscara mask como la trama DitherPattern.CUSTOM: se pinta
+        con el primer color donde es True.
+        """
+
+        self._custom_pattern = numpy.array(mask, dtype=bool)
+        self._dither_tiles.pop(DitherPattern.CUSTOM, None)
+
+    @classmethod
+    def dither_tile(self, pattern):
+        """
+        Devuelve el array (n, n) de umbrales entre 0 y 1 de la trama
+        pattern, un DitherPattern. Se calcula una sola vez y es de solo
+        lectura.
+        """
+
+        tile = self._dither_tiles.get(pattern, None)
+        if tile is not None:
+            return tile
+
+        if pattern == DitherPattern.CUSTOM:
+            # Lo que no es de la trama no se pinta nunca
+            tile = numpy.where(self._custom_pattern, 0.0, 1.0)
+
+        else:
+            size = {DitherPattern.BAYER_2: 2,
+                    DitherPattern.BAYER_4: 4,
+                    DitherPattern.BAYER_8: 8}[pattern]
+
+            # Cada matriz de Bayer se arma con cuatro copias de la anterior
+            bayer = numpy.zeros((1, 1), dtype=int)
+            while bayer.shape[0] < size:
+                bayer = numpy.block([[4 * bayer, 4 * bayer + 2],
+                                     [4 * bayer + 3, 4 * bayer + 1]])
+
+            tile = (bayer + 0.5) / bayer.size
+
+        tile.flags.writeable = False
+        self._dither_tiles[pattern] = tile
+
+        return tile
+
+    @classmethod
+    def dither_mask(self, x, y, width, height, pattern, level):
+        """
+        Devuelve la máscara (alto, ancho), ubicada en la posición (x, y),
+        de los píxeles que se pintan con el primer color al tramar con
+        pattern. level (de 0 a 1, un número o un array (alto, ancho)) es
+        la proporción de esos píxeles. La trama se repite desde el píxel
+        (1, 1), así coincide entre distintos trazos.
+        """
+
+        tile = self.dither_tile(pattern)
+        rows = numpy.arange(y - 1, y - 1 + height) % tile.shape[0]
+        columns = numpy.arange(x - 1, x - 1 + width) % tile.shape[1]
+
+        return tile[rows[:, None], columns] < level
+
+    @classmethod
+    def linear_gradient(self, x, y, width, height, start, end):
+        """
+        Devuelve un array (alto, ancho), ubicado en la posición (x, y), que
+        va de 0 en el píxel start a 1 en el píxel end, constante en las
+        perpendiculares a la línea que los une.
+        """
+
+        dx, dy = end[0] - start[0], end[1] - start[1]
+        length = dx * dx + dy * dy
+        if length == 0:
+            return numpy.zeros((height, width))
+
+        xs = (numpy.arange(x, x + width) - start[0]) * dx / length
+        ys = (numpy.arange(y, y + height) - start[1]) * dy / length
+
+        return numpy.clip(ys[:, None] + xs, 0, 1)
+
+    @classmethod
+    def flood_fill_mask(self, match, seeds, connectivity=4):
+        """
+        Relleno por líneas (scanline) con una pila explícita en lugar de
+        recursión. match es un array de booleanos (alto, ancho) con los
+        píxeles que se pueden rellenar y seeds una lista de coordenadas
+        (x, y) que empiezan en 0. Devuelve la máscara de los píxeles
+        rellenados, conectados a los seeds por los lados (connectivity=4)
+        o también por las diagonales (connectivity=8).
+        """
+
+        height, width = match.shape
+        extra = 1 if connectivity == 8 else 0
+
+        # Todos los tramos de píxeles seguidos de cada fila, ordenados por
+        # fila y columna. Los de la fila y van de offsets[y] a offsets[y + 1]
+        padded = numpy.zeros((height, width + 2), dtype=numpy.int8)
+        padded[:, 1:-1] = match
+        edges = numpy.diff(padded, axis=1)
+
+        rows, starts = numpy.nonzero(edges == 1)
+        ends = numpy.nonzero(edges == -1)[1]
+        offsets = numpy.concatenate(([0], numpy.cumsum(numpy.bincount(rows, minlength=height))))
+
+        starts, ends, offsets = starts.tolist(), ends.tolist(), offsets.tolist()
+        visited = bytearray(len(starts))
+
+        stack = []
+        for x, y in seeds:
+            i = bisect.bisect_right(starts, x, offsets[y], offsets[y + 1]) - 1
+            if i >= offsets[y] and ends[i] > x and not visited[i]:
+                visited[i] = 1
+                stack.append((i, y))
+
+        filled = []
+        while len(stack) > 0:
+            i, y = stack.pop()
+            filled.append(i)
+
+            # Los tramos de las filas de arriba y abajo que tocan a este
+            start, end = starts[i] - extra, ends[i] + extra
+            for ny in (y - 1, y + 1):
+                if ny < 0 or ny >= height:
+                    continue
+
+                stop = offsets[ny + 1]
+                j = bisect.bisect_right(ends, start, offsets[ny], stop)
+                while j < stop and starts[j] < end:
+                    if not visited[j]:
+                        visited[j] = 1
+                        stack.append((j, ny))
+
+                    j += 1
+
+        # Se pintan todos los tramos de una vez: +1 donde empieza cada uno
+        # y -1 donde termina, y la suma acumulada de cada fila es la máscara.
+        # Dos tramos de una fila nunca se tocan, así que alcanza con int8
+        filled = numpy.array(filled, dtype=numpy.intp)
+        mask = numpy.zeros((height, width + 1), dtype=numpy.int8)
+        mask[rows[filled], numpy.array(starts, dtype=numpy.intp)[filled]] = 1
+        mask[rows[filled], numpy.array(ends, dtype=numpy.intp)[filled]] = -1
+
+        return numpy.cumsum(mask, axis=1, dtype=numpy.int8)[:, :width] > 0
+
+    @classmethod
+    def _match_region(self, pixelmap, target, x, y, width, height):
+        """
+        Devuelve la máscara (alto, ancho) de los píxeles del color target
+        (un array RGBA) en la región de width x height con esquina (x, y).
+        Se lee bloque por bloque (ver PixelMap.chunks): lo que no tiene
+        memoria asignada es transparente y se resuelve sin leerlo.
+        """
+
+        key = numpy.ascontiguousarray(target, dtype=numpy.uint8).view(numpy.uint32)[0]
+        match = numpy.full((height, width), key == 0, dtype=bool)
+
+        for cx, cy, data in pixelmap.chunks():
+            x0, y0 = max(x, cx), max(y, cy)
+            x1, y1 = min(x + width, cx + data.shape[1]), min(y + height, cy + data.shape[0])
+            if x0 >= x1 or y0 >= y1:
+                continue
+
+            # Cada píxel visto como un solo entero
+            region = numpy.ascontiguousarray(data[y0 - cy:y1 - cy, x0 - cx:x1 - cx])
+            keys = region.view(numpy.uint32)[:, :, 0]
+            match[y0 - y:y1 - y, x0 - x:x1 - x] = keys == key
+
+        return match
+
+    @classmethod
+    def flood_fill(self, pixelmap, seeds, connectivity=4, color=None):
+        """
+        Busca los píxeles del color color (por defecto, el del primer
+        seed) conectados a los seeds, que son coordenadas (x, y) que
+        empiezan en 1. Los seeds fuera del PixelMap se ignoran. Devuelve
+        (x, y, mask), con mask recortada al rectángulo que contiene a esos
+        píxeles y (x, y) su esquina, o None si no hay ninguno.
+
+        Solo se lee la parte del PixelMap a la que llega el relleno: se
+        empieza con FILL_WINDOW píxeles alrededor de los seeds, y mientras
+        el relleno toque un borde de la región se la agranda hacia ese lado.
+        """
+
+        width, height = pixelmap.width, pixelmap.height
+        seeds = [(x, y) for x, y in seeds if 0 < x <= width and 0 < y <= height]
+
+        if len(seeds) == 0:
+            return None
+
+        if color is None:
+            target = pixelmap.get_region(seeds[0][0], seeds[0][1], 1, 1)[0, 0]
+
+        else:
+            target = Color.cairo_to_array(color)
+
+        # Región (x0, y0) - (x1, y1), incluidos
+        xs, ys = zip(*seeds)
+        x0, y0 = max(min(xs) - self.FILL_WINDOW, 1), max(min(ys) - self.FILL_WINDOW, 1)
+        x1, y1 = min(max(xs) + self.FILL_WINDOW, width), min(max(ys) + self.FILL_WINDOW, height)
+
+        while True:
+            match = self._match_region(pixelmap, target, x0, y0, x1 - x0 + 1, y1 - y0 + 1)
+            mask = self.flood_fill_mask(match, [(x - x0, y - y0) for x, y in seeds], connectivity)
+
+            # Cada lado que toca el relleno se agranda al doble
+            _width, _height = x1 - x0 + 1, y1 - y0 + 1
+            _x0 = max(x0 - _width, 1) if mask[:, 0].any() else x0
+            _y0 = max(y0 - _height, 1) if mask[0].any() else y0
+            _x1 = min(x1 + _width, width) if mask[:, -1].any() else x1
+            _y1 = min(y1 + _height, height) if mask[-1].any() else y1
+
+            if (_x0, _y0, _x1, _y1) == (x0, y0, x1, y1):
+                break
+
+            x0, y0, x1, y1 = _x0, _y0, _x1, _y1
 
-                k = delta_x
-                delta_x = delta_y
-                delta_y = k
+        crop = self.crop_mask(mask)
+        if crop is None:
+            return None
 
-            x = x0
-            y = y0
+        left, top, mask = crop
+        return x0 + left, y0 + top, mask
 
-            avR = (2 * delta_y)
-            av = (avR - delta_x)
-            avI = (av - delta_x)
+    @classmethod
+    def crop_mask(self, mask):
+        """
+        Recorta mask al rectángulo que contiene a los píxeles donde es
+        True. Devuelve (x, y, mask), con (x, y) la posición del recorte
+        dentro de la máscara original (empezando en 0), o None si no hay
+        ninguno.
+        """
+
+        rows = numpy.flatnonzero(mask.any(axis=1))
+        if len(rows) == 0:
+            return None
+
+        columns = numpy.flatnonzero(mask.any(axis=0))
+        top, bottom = int(rows[0]), int(rows[-1]) + 1
+        left, right = int(columns[0]), int(columns[-1]) + 1
+
+        return left, top, mask[top:bottom, left:right]
+
+    @classmethod
+    def _color_match(self, data, target, tolerance):
+        # Máscara de los píxeles de data (alto, ancho, 4) a menos de
+        # tolerance de target, ver color_mask
+        if tolerance == 0:
+            # Cada píxel visto como un solo entero
+            keys = numpy.ascontiguousarray(data).view(numpy.uint32)[:, :, 0]
+            return keys == target.view(numpy.uint32)[0]
+
+        difference = data.astype(numpy.int32) - target
+        return (difference * difference).sum(axis=2) <= tolerance * tolerance
+
+    @classmethod
+    def color_mask(self, pixelmap, color, tolerance=0):
+        """
+        Devuelve la máscara (alto, ancho) de los píxeles cuya distancia
+        (euclídea, con los canales RGBA de 0 a 255) a color es como mucho
+        tolerance. Con tolerance 0 solo se incluyen los del mismo color.
+        Se compara bloque por bloque (ver PixelMap.chunks): lo que no tiene
+        memoria asignada es transparente y se compara una sola vez.
+        """
+
+        target = Color.cairo_to_array(color)
+        empty = self._color_match(numpy.zeros((1, 1, 4), dtype=numpy.uint8), target, tolerance)
+        mask = numpy.full((pixelmap.height, pixelmap.width), empty[0, 0], dtype=bool)
+
+        for x, y, data in pixelmap.chunks():
+            height, width = data.shape[:2]
+            mask[y - 1:y - 1 + height, x - 1:x - 1 + width] = self._color_match(data, target, tolerance)
+
+        return mask
+
+    @classmethod
+    def _hue_shape(self, hue):
+        """
+        En HSL cada canal es luminosidad - a * f(tono), con a = saturación
+        * min(luminosidad, 1 - luminosidad). Devuelve f para cada canal
+        como un array (..., 3), con hue en sextos de vuelta.
+        """
+
+        # f es un trapecio de período 12 (en doceavos de vuelta),
+        # desplazado un tercio de vuelta para cada canal
+        k = numpy.array([0, 8, 4], dtype=hue.dtype) + 2 * hue[..., None]
+        k -= 12 * numpy.floor(k / 12)
+
+        return numpy.clip(3 - numpy.abs(k - 6), -1, 1)
+
+    @classmethod
+    def adjust_colors(self, values, adjustment, amount):
+        """
+        Devuelve una copia del array (..., 4) de uint8 values con los
+        colores ajustados en el espacio HSL: amount (de -1 a 1) se suma a
+        la luminosidad, a la saturación o al tono (en vueltas) según
+        adjustment, un ColorAdjustment. Con ColorAdjustment.DARKEN se
+        resta. Los resultados se recortan a los valores válidos y el canal
+        alfa no cambia. Los grises no tienen tono, así que siguen siendo
+        grises aunque se les sume saturación.
+        """
 
-            while x != x1:
-                pixelmap.set_temp_pixel_color(x, y, color)
+        rgb = values[..., :3].astype(numpy.float32) / 255
+        r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
 
-                if av >= 0:
-                    x += inclinacion_x_i
-                    y += inclinacion_y_i
-                    av += avI
+        high = numpy.maximum(numpy.maximum(r, g), b)
+        low = numpy.minimum(numpy.minimum(r, g), b)
+        lightness = (high + low) / 2
+        a = (high - low) / 2
 
-                else:
-                    x += avance_x_recto
-                    y += avance_y_recto
-                    av += avR
+        # Máximo valor posible de a con esta luminosidad
+        limit = numpy.minimum(lightness, 1 - lightness)
 
-            if y != y1:
-                # En algunas situaciones no se pintan los píxeles en la
-                # columna del pixel final
-                for _y in range(min(y, y1), max(y, y1) + 1):
-                    pixelmap.set_temp_pixel_color(x, _y, color)
+        if adjustment == ColorAdjustment.HUE:
+            delta = numpy.where(a > 0, 2 * a, 1)
+            hue = numpy.where(high == r, (g - b) / delta,
+                              numpy.where(high == g, (b - r) / delta + 2, (r - g) / delta + 4))
 
-            # El último pixel siempre se pinta
-            pixelmap.set_temp_pixel_color(x1, y1, color)
+            rgb = lightness[..., None] - a[..., None] * self._hue_shape(hue + 6 * (amount % 1))
 
         else:
-            for y in range(min(y0, y1), max(y0, y1) + 1):
-                pixelmap.set_temp_pixel_color(x0, y, color)
+            # Sin cambiar el tono, la distancia de cada canal a la
+            # luminosidad es proporcional a a
+            if adjustment == ColorAdjustment.SATURATION:
+                new_lightness = lightness
+                saturation = a / numpy.where(limit > 0, limit, 1)
+                new_saturation = numpy.clip(saturation + amount, 0, 1)
+                scale = new_saturation / numpy.where(saturation > 0, saturation, 1)
+
+            else:
+                if adjustment == ColorAdjustment.DARKEN:
+                    amount = -amount
+
+                new_lightness = numpy.clip(lightness + amount, 0, 1)
+                scale = numpy.minimum(new_lightness, 1 - new_lightness) / numpy.where(limit > 0, limit, 1)
+
+            rgb = new_lightness[..., None] + (rgb - lightness[..., None]) * scale[..., None]
+
+        result = numpy.array(values, dtype=numpy.uint8)
+        result[..., :3] = numpy.clip(numpy.rint(rgb * 255), 0, 255)
+
+        return result
 
 
 def gtk_version_newer_than(major=3, minor=0, micro=0):
@@ -359,19 +851,7 @@ class FileManagement:
 
     @classmethod
     def pixelmap_to_png(self, pixelmap):
-        width, height = pixelmap.width, pixelmap.height
-        pixels = []
-
-        for y in range(0, height):
-            pixels.append([])
-
-        for x in range(0, width):
-            for y in range(0, height):
-                color = Color.cairo_to_rgba(pixelmap.get_pixel_color(x + 1, y + 1))
-                pixels[y].append(color)
-
-        array = numpy.array(pixels, dtype=numpy.uint8)
-        return Image.fromarray(array)
+        return Image.fromarray(pixelmap.to_array(), "RGBA")
 
     @classmethod
     def _save_as_png(self, pixelmap, file):
@@ -382,37 +862,67 @@ class FileManagement:
     def pixelmaps_to_pngs(self, pixelmaps):
         return [FileManagement.pixelmap_to_png(pixelmap) for pixelmap in pixelmaps]
 
+    @classmethod
+    def pixelmaps_to_palette_images(self, pixelmaps):
+        """
+        Si todos los frames son IndexedPixelMap que entran en una paleta
+        de GIF devuelve las imágenes en modo P, así no hay que cuantizar.
+        De lo contrario devuelve None.
+        """
+
+        frames = []
+        for pixelmap in pixelmaps:
+            if not isinstance(pixelmap, IndexedPixelMap):
+                return None
+
+            image = pixelmap.to_image()
+            if image is None:
+                return None
+
+            frames.append(image)
+
+        return frames
+
     @classmethod
     def _save_as_gif(self, pixelmaps, file):
-        frames = FileManagement.pixelmaps_to_pngs(pixelmaps)
+        frames = FileManagement.pixelmaps_to_palette_images(pixelmaps)
+        if frames is None:
+            frames = FileManagement.pixelmaps_to_pngs(pixelmaps)
+
         primera = frames[0]
         del frames[0]
 
         loop = 0  # TODO
-        duration = 250  # TODO
+        durations = [pixelmap.duration for pixelmap in pixelmaps]
 
         primera.save(file, save_all=True, append_images=frames,
-                     duration=duration, loop=loop,
+                     duration=durations, loop=loop,
                      transparency=0)
 
     @classmethod
-    def png_to_pixelmap(self, file):
+    def png_to_pixelmap(self, file, indexed=False):
         image = Image.open(file)
         image.load()
-        return PixelMap.new_from_image(image)
+        return PixelMap.new_from_image(image, indexed=indexed)
 
     @classmethod
-    def png_to_pixelmaps(self, file):
-        return [FileManagement.png_to_pixelmap(file)]
+    def png_to_pixelmaps(self, file, indexed=False):
+        return [FileManagement.png_to_pixelmap(file, indexed)]
 
     @classmethod
-    def gif_to_pixelmaps(self, file):
+    def gif_to_pixelmaps(self, file, indexed=False):
+        # Con indexed, los frames en modo P usan directamente la paleta
+        # del archivo (ver IndexedPixelMap.load_data_from_image)
         pixelmaps = []
 
         image = Image.open(file)
         image.load()
         for frame in ImageSequence.Iterator(image):
-            pixelmap = PixelMap.new_from_image(frame)
+            pixelmap = PixelMap.new_from_image(frame, indexed=indexed)
+
+            # Muchos GIF tienen frames de 0ms, que se muestran como de 10ms
+            duration = frame.info.get("duration", PixelMap.DEFAULT_DURATION)
+            pixelmap.duration = max(duration, PixelMap.MIN_DURATION)
             pixelmaps.append(pixelmap)
 
         return pixelmaps
@@ -452,12 +962,12 @@ class FileManagement:
             FileManagement.save(pixelmaps, file + ".png")
 
     @classmethod
-    def open(self, file):
+    def open(self, file, indexed=False):
         if file.endswith(".gif"):
-            return FileManagement.gif_to_pixelmaps(file)
+            return FileManagement.gif_to_pixelmaps(file, indexed)
 
         elif file.endswith(".png"):
-            return FileManagement.png_to_pixelmaps(file)
+            return FileManagement.png_to_pixelmaps(file, indexed)
 
         # elif file.endswith(".svg"):
         #     return FileManagement.svg_to_pixelmaps(file)
@@ -495,3 +1005,4 @@ class FileManagement:
 
 from .canvas import PixelMap  # canvas.py importa utils.py, así que debo
                               # importar canvas.py al final en utils.py
+from .canvas import IndexedPixelMap
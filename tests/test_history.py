@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+
+from src.canvas import PixelMap, IndexedPixelMap
+from src.history import History, HistoryStep, ReplaceStep, DurationStep, HistoryJournal
+
+
+class FakeCanvas(object):
+
+    def __init__(self, width, height):
+        self.pixelmap = PixelMap(width, height)
+
+
+class HistoryTestCase(unittest.TestCase):
+
+    def paint(self, canvas, history, x, y, value):
+        # Un paso que cambia el color de un solo píxel
+        mask = numpy.ones((1, 1), dtype=bool)
+        before = canvas.pixelmap.get_region(x, y, 1, 1)[mask]
+        after = numpy.full((1, 4), value, dtype=numpy.uint8)
+
+        data = numpy.zeros((1, 1, 4), dtype=numpy.uint8)
+        data[mask] = after
+        canvas.pixelmap.set_region(x, y, data, mask)
+
+        step = HistoryStep()
+        step.add(x, y, mask, before, after)
+        history.push(step)
+
+    def test_shrink_keeps_redo_steps(self):
+        # Deshacer N pasos, bajar el límite y rehacer
+        canvas = FakeCanvas(8, 8)
+        history = History(1024 * 1024)
+
+        states = [canvas.pixelmap.to_array()]
+        for i in range(6):
+            self.paint(canvas, history, i + 1, 1, 10 * (i + 1))
+            states.append(canvas.pixelmap.to_array())
+
+        history.mark_saved()
+        for i in range(4):
+            self.assertTrue(history.undo(canvas))
+
+        history.budget = 0
+        history.shrink()
+
+        self.assertEqual(history.cursor, 0)
+        self.assertEqual(len(history), 4)
+        self.assertTrue(history.is_modified())
+        self.assertFalse(history.can_undo())
+
+        for i in range(4):
+            self.assertTrue(history.redo(canvas))
+            numpy.testing.assert_array_equal(canvas.pixelmap.to_array(), states[3 + i])
+
+        self.assertFalse(history.redo(canvas))
+        self.assertFalse(history.is_modified())
+
+    def test_drop_forgets_saved_state(self):
+        canvas = FakeCanvas(8, 8)
+        history = History(1024 * 1024)
+
+        self.paint(canvas, history, 1, 1, 10)
+        history.mark_saved()
+        self.paint(canvas, history, 2, 1, 20)
+        self.paint(canvas, history, 3, 1, 30)
+
+        history.budget = 0
+        history.shrink()
+
+        self.assertEqual(history.cursor, 1)
+        self.assertTrue(history.is_modified())
+        self.assertTrue(history.undo(canvas))
+        self.assertTrue(history.is_modified())
+
+    def test_duration_step(self):
+        # Deshacer otro cambio no da por guardada la duración
+        canvas = FakeCanvas(8, 8)
+        history = History(1024 * 1024)
+
+        history.mark_saved()
+        self.paint(canvas, history, 1, 1, 10)
+        history.push(DurationStep(canvas.pixelmap.duration, 100))
+        canvas.pixelmap.duration = 100
+
+        self.assertTrue(history.undo(canvas))
+        self.assertEqual(canvas.pixelmap.duration, PixelMap.DEFAULT_DURATION)
+        self.assertTrue(history.is_modified())
+
+        self.assertTrue(history.undo(canvas))
+        self.assertFalse(history.is_modified())
+
+        self.assertTrue(history.redo(canvas))
+        self.assertTrue(history.redo(canvas))
+        self.assertEqual(canvas.pixelmap.duration, 100)
+
+
+    def test_journal_keeps_steps_after_duration(self):
+        # Un DurationStep no puede dejar un hueco en los pasos del journal
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "1-test-1.journal")
+
+        canvas = FakeCanvas(8, 8)
+        history = History(1024 * 1024, HistoryJournal(path))
+        history.journal.write_base(canvas.pixelmap, history.position)
+
+        self.paint(canvas, history, 1, 1, 10)
+        history.push(DurationStep(canvas.pixelmap.duration, 100))
+        canvas.pixelmap.duration = 100
+        self.paint(canvas, history, 2, 1, 20)
+        self.paint(canvas, history, 3, 1, 30)
+        history.journal.close()
+
+        journal, base, steps, cursor = HistoryJournal.recover(path)
+        journal.close()
+
+        self.assertEqual(len(steps), 4)
+        self.assertEqual(cursor, 4)
+        self.assertIsInstance(steps[1], DurationStep)
+        self.assertEqual((steps[1].before, steps[1].after), (PixelMap.DEFAULT_DURATION, 100))
+
+
+    def test_journal_base(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "1-test-1.journal")
+
+        pixelmap = IndexedPixelMap(8, 4)
+        pixelmap.duration = 100
+        pixelmap.set_region(2, 2, numpy.full((1, 1, 4), 255, dtype=numpy.uint8))
+
+        journal = HistoryJournal(path)
+        journal.write_base(pixelmap, 0)
+        journal.close()
+
+        journal, base, steps, cursor = HistoryJournal.recover(path)
+        journal.close()
+
+        width, height, duration, indexed, chunks = base
+        self.assertEqual((width, height, duration, indexed), (8, 4, 100, True))
+
+        recovered = PixelMap.new(width, height, indexed=indexed)
+        for x, y, data in chunks:
+            recovered.set_region(x, y, data)
+
+        numpy.testing.assert_array_equal(recovered.to_array(), pixelmap.to_array())
+
+
+    def test_replace_pixelmap(self):
+        canvas = FakeCanvas(8, 8)
+        history = History(1024 * 1024)
+
+        before, after, tiled = canvas.pixelmap, PixelMap(8, 8), PixelMap.new(2048, 2048)
+        history.push(ReplaceStep(before, after))
+        canvas.pixelmap = after
+
+        history.replace_pixelmap(after, tiled)
+        canvas.pixelmap = tiled
+
+        self.assertTrue(history.undo(canvas))
+        self.assertIs(canvas.pixelmap, before)
+        self.assertTrue(history.redo(canvas))
+        self.assertIs(canvas.pixelmap, tiled)
+
+
+if __name__ == "__main__":
+    unittest.main()
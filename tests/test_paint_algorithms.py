@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import numpy
+
+from src.canvas import PixelMap
+from src.utils import PaintAlgorithms, ColorAdjustment, DitherPattern
+
+
+class FloodFillTestCase(unittest.TestCase):
+
+    def test_fill_mask_connectivity(self):
+        # Dos regiones que solo se tocan en diagonal
+        match = numpy.array([[1, 1, 0, 0],
+                             [1, 1, 0, 0],
+                             [0, 0, 1, 1],
+                             [0, 0, 1, 0]], dtype=bool)
+
+        mask = PaintAlgorithms.flood_fill_mask(match, [(0, 0)], connectivity=4)
+        numpy.testing.assert_array_equal(mask, match & (numpy.arange(4) < 2)[:, None])
+
+        mask = PaintAlgorithms.flood_fill_mask(match, [(0, 0)], connectivity=8)
+        numpy.testing.assert_array_equal(mask, match)
+
+    def test_fill_mask_spirals(self):
+        # Un camino que baja y vuelve a subir llega a todas las filas
+        match = numpy.array([[1, 0, 1, 1, 1],
+                             [1, 0, 1, 0, 1],
+                             [1, 1, 1, 0, 1],
+                             [0, 0, 0, 0, 1],
+                             [1, 1, 1, 1, 1]], dtype=bool)
+
+        mask = PaintAlgorithms.flood_fill_mask(match, [(0, 0)])
+        numpy.testing.assert_array_equal(mask, match)
+
+    def test_fill_mask_seed_outside(self):
+        match = numpy.array([[1, 0, 1]], dtype=bool)
+        mask = PaintAlgorithms.flood_fill_mask(match, [(1, 0)])
+
+        self.assertFalse(mask.any())
+
+    def test_flood_fill_grows_window(self):
+        # El relleno pasa el borde de la primera región que se lee
+        pixelmap = PixelMap(400, 3)
+        wall = numpy.zeros((1, 400, 4), dtype=numpy.uint8)
+        wall[:, :, :] = 255
+        pixelmap.set_region(1, 2, wall)
+        pixelmap.set_region(400, 2, numpy.zeros((1, 1, 4), dtype=numpy.uint8))
+
+        x, y, mask = PaintAlgorithms.flood_fill(pixelmap, [(1, 1)])
+
+        self.assertEqual((x, y), (1, 1))
+        self.assertEqual(mask.shape, (3, 400))
+        self.assertEqual(int(mask.sum()), 2 * 400 + 1)
+        self.assertIsNone(PaintAlgorithms.flood_fill(pixelmap, [(0, 1), (401, 1)]))
+
+    def test_crop_mask(self):
+        mask = numpy.zeros((5, 6), dtype=bool)
+        mask[1, 2] = mask[3, 4] = True
+
+        x, y, cropped = PaintAlgorithms.crop_mask(mask)
+
+        self.assertEqual((x, y, cropped.shape), (2, 1, (3, 3)))
+        self.assertIsNone(PaintAlgorithms.crop_mask(numpy.zeros((2, 2), dtype=bool)))
+
+
+class ColorMaskTestCase(unittest.TestCase):
+
+    def test_tolerance(self):
+        pixelmap = PixelMap(3, 1)
+        data = numpy.array([[[255, 0, 0, 255], [250, 0, 0, 255], [0, 0, 255, 255]]], dtype=numpy.uint8)
+        pixelmap.set_region(1, 1, data)
+
+        mask = PaintAlgorithms.color_mask(pixelmap, (1, 0, 0, 1))
+        numpy.testing.assert_array_equal(mask, [[True, False, False]])
+
+        mask = PaintAlgorithms.color_mask(pixelmap, (1, 0, 0, 1), tolerance=5)
+        numpy.testing.assert_array_equal(mask, [[True, True, False]])
+
+    def test_empty_tiles(self):
+        # Lo que no tiene memoria asignada cuenta como transparente
+        pixelmap = PixelMap.new(2048, 1024)
+        pixelmap.set_region(1, 1, numpy.full((1, 1, 4), 255, dtype=numpy.uint8))
+
+        mask = PaintAlgorithms.color_mask(pixelmap, (0, 0, 0, 0))
+
+        self.assertEqual(mask.shape, (1024, 2048))
+        self.assertEqual(int(mask.sum()), 2048 * 1024 - 1)
+        self.assertFalse(mask[0, 0])
+
+
+class StampPathTestCase(unittest.TestCase):
+
+    def stamp(self, points, brush):
+        # El pincel estampado en cada píxel de las líneas, uno por uno
+        pixels = set()
+        for (x0, y0), (x1, y1) in zip(points, points[1:] or points):
+            xs, ys = PaintAlgorithms.line(x0, y0, x1, y1)
+            pixels.update(zip(xs.tolist(), ys.tolist()))
+
+        height, width = brush.shape
+        left, top = min(x for x, y in pixels), min(y for x, y in pixels)
+        right, bottom = max(x for x, y in pixels), max(y for x, y in pixels)
+
+        mask = numpy.zeros((bottom - top + height, right - left + width), dtype=bool)
+        for x, y in pixels:
+            mask[y - top:y - top + height, x - left:x - left + width] |= brush
+
+        return left, top, mask
+
+    def test_matches_stamping(self):
+        random = numpy.random.RandomState(0)
+        brushes = [numpy.ones((1, 1), dtype=bool),
+                   numpy.ones((3, 3), dtype=bool),
+                   numpy.array([[0, 1, 0], [1, 1, 1], [0, 1, 0]], dtype=bool),
+                   random.rand(6, 5) < 0.5]
+
+        for brush in brushes:
+            for count in [1, 2, 5]:
+                points = [tuple(point) for point in random.randint(1, 40, (count, 2)).tolist()]
+                x, y, mask = PaintAlgorithms.stamp_path(points, brush, offset=(-1, -2))
+                left, top, expected = self.stamp(points, brush)
+
+                self.assertEqual((x, y), (left - 1, top - 2))
+                numpy.testing.assert_array_equal(mask, expected)
+
+
+class AdjustColorsTestCase(unittest.TestCase):
+
+    def adjust(self, color, adjustment, amount):
+        values = numpy.array([color], dtype=numpy.uint8)
+        return PaintAlgorithms.adjust_colors(values, adjustment, amount)[0].tolist()
+
+    def test_lightness(self):
+        self.assertEqual(self.adjust([255, 0, 0, 255], ColorAdjustment.LIGHTEN, 0.25), [255, 128, 128, 255])
+        self.assertEqual(self.adjust([255, 0, 0, 255], ColorAdjustment.DARKEN, 0.25), [128, 0, 0, 255])
+        self.assertEqual(self.adjust([255, 0, 0, 255], ColorAdjustment.LIGHTEN, 1), [255, 255, 255, 255])
+
+    def test_hue(self):
+        self.assertEqual(self.adjust([255, 0, 0, 255], ColorAdjustment.HUE, 1 / 3), [0, 255, 0, 255])
+        self.assertEqual(self.adjust([255, 0, 0, 255], ColorAdjustment.HUE, -1 / 3), [0, 0, 255, 255])
+
+    def test_saturation(self):
+        self.assertEqual(self.adjust([191, 64, 64, 255], ColorAdjustment.SATURATION, -1), [128, 128, 128, 255])
+        self.assertEqual(self.adjust([191, 64, 64, 255], ColorAdjustment.SATURATION, 1), [255, 0, 0, 255])
+
+        # Los grises no tienen tono
+        self.assertEqual(self.adjust([100, 100, 100, 255], ColorAdjustment.SATURATION, 1), [100, 100, 100, 255])
+
+    def test_alpha_and_shape(self):
+        values = numpy.full((2, 3, 4), 100, dtype=numpy.uint8)
+        result = PaintAlgorithms.adjust_colors(values, ColorAdjustment.LIGHTEN, 0.5)
+
+        self.assertEqual(result.shape, values.shape)
+        self.assertTrue((result[..., 3] == 100).all())
+        self.assertTrue((values == 100).all())
+
+
+class DitherTestCase(unittest.TestCase):
+
+    def test_bayer_tiles(self):
+        for pattern, size in [(DitherPattern.BAYER_2, 2), (DitherPattern.BAYER_4, 4), (DitherPattern.BAYER_8, 8)]:
+            tile = PaintAlgorithms.dither_tile(pattern)
+
+            # Cada umbral aparece una sola vez
+            self.assertEqual(tile.shape, (size, size))
+            numpy.testing.assert_allclose(numpy.sort(tile.ravel()), (numpy.arange(size * size) + 0.5) / (size * size))
+            self.assertFalse(tile.flags.writeable)
+
+    def test_level(self):
+        for level in [0, 0.25, 0.5, 1]:
+            mask = PaintAlgorithms.dither_mask(1, 1, 8, 8, DitherPattern.BAYER_4, level)
+            self.assertEqual(int(mask.sum()), int(64 * level))
+
+        # La mitad de Bayer 2 es un tablero de ajedrez
+        mask = PaintAlgorithms.dither_mask(1, 1, 4, 4, DitherPattern.BAYER_2, 0.5)
+        numpy.testing.assert_array_equal(mask, (numpy.add.outer(numpy.arange(4), numpy.arange(4)) % 2) == 0)
+
+    def test_aligned_to_pixelmap(self):
+        # La trama coincide aunque se pida desde otra posición
+        whole = PaintAlgorithms.dither_mask(1, 1, 10, 10, DitherPattern.BAYER_8, 0.3)
+        part = PaintAlgorithms.dither_mask(4, 6, 5, 3, DitherPattern.BAYER_8, 0.3)
+
+        numpy.testing.assert_array_equal(part, whole[5:8, 3:8])
+
+    def test_custom_pattern(self):
+        self.addCleanup(PaintAlgorithms.set_custom_pattern, PaintAlgorithms._custom_pattern)
+
+        pattern = numpy.array([[1, 0, 0]], dtype=bool)
+        PaintAlgorithms.set_custom_pattern(pattern)
+        mask = PaintAlgorithms.dither_mask(1, 1, 6, 2, DitherPattern.CUSTOM, 0.5)
+
+        numpy.testing.assert_array_equal(mask, numpy.tile(pattern, (2, 2)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import numpy
+
+from src.canvas import PixelMap, TiledPixelMap, IndexedPixelMap
+
+
+def opaque(width, height, value=255):
+    return numpy.full((height, width, 4), value, dtype=numpy.uint8)
+
+
+class TiledPixelMapTestCase(unittest.TestCase):
+
+    def test_new(self):
+        self.assertIsInstance(PixelMap.new(2048, 1024), TiledPixelMap)
+        self.assertNotIsInstance(PixelMap.new(1024, 1024), TiledPixelMap)
+
+    def test_tiles_are_allocated_when_painted(self):
+        size = TiledPixelMap.TILE_SIZE
+        pixelmap = TiledPixelMap(8192, 8192)
+        self.assertEqual(pixelmap.nbytes, 0)
+
+        # Un rectángulo sobre el borde de cuatro tiles
+        pixelmap.set_region(size - 1, size - 1, opaque(4, 4))
+
+        self.assertEqual(len(list(pixelmap.chunks())), 4)
+        self.assertEqual(pixelmap.nbytes, 4 * size * size * 4)
+        numpy.testing.assert_array_equal(pixelmap.get_region(size - 1, size - 1, 4, 4), opaque(4, 4))
+        self.assertEqual(pixelmap.get_bounds(), (size - 1, size - 1, 4, 4))
+
+        # Los tiles que vuelven a quedar vacíos se liberan
+        pixelmap.set_region(size - 1, size - 1, opaque(4, 4, 0))
+        self.assertEqual(pixelmap.nbytes, 0)
+        self.assertTrue(pixelmap.is_empty())
+
+    def test_matches_dense(self):
+        data = numpy.random.RandomState(0).randint(0, 256, (100, 150, 4)).astype(numpy.uint8)
+        tiled, dense = TiledPixelMap(200, 130), PixelMap(200, 130)
+
+        for pixelmap in [tiled, dense]:
+            pixelmap.set_region(30, 20, data)
+            pixelmap.fill_region(5, 5, numpy.eye(70, dtype=bool), (1, 0, 0, 1))
+
+        numpy.testing.assert_array_equal(tiled.to_array(), dense.to_array())
+
+
+class CopyOnWriteTestCase(unittest.TestCase):
+
+    def test_dense(self):
+        pixelmap = PixelMap(8, 8)
+        pixelmap.set_region(1, 1, opaque(2, 2))
+        copy = pixelmap.copy()
+        self.assertIs(copy._data, pixelmap._data)
+
+        copy.set_region(1, 1, opaque(1, 1, 0))
+
+        self.assertIsNot(copy._data, pixelmap._data)
+        self.assertEqual(pixelmap.get_region(1, 1, 1, 1)[0, 0, 3], 255)
+        self.assertEqual(copy.get_region(1, 1, 1, 1)[0, 0, 3], 0)
+
+        # El original también copia antes de escribir
+        pixelmap.set_region(2, 2, opaque(1, 1, 0))
+        self.assertEqual(copy.get_region(2, 2, 1, 1)[0, 0, 3], 255)
+
+    def test_tiled(self):
+        # Solo se duplica el tile que se modifica
+        size = TiledPixelMap.TILE_SIZE
+        pixelmap = TiledPixelMap(4 * size, size)
+        pixelmap.set_region(1, 1, opaque(3 * size, 1))
+        copy = pixelmap.copy()
+
+        copy.set_region(size + 1, 1, opaque(1, 1, 0))
+
+        shared = [key for key in pixelmap._tiles if copy._tiles[key] is pixelmap._tiles[key]]
+        self.assertEqual(sorted(shared), [(0, 0), (2, 0)])
+        self.assertEqual(pixelmap.get_region(size + 1, 1, 1, 1)[0, 0, 3], 255)
+        self.assertEqual(copy.get_region(size + 1, 1, 1, 1)[0, 0, 3], 0)
+
+
+class IndexedPixelMapTestCase(unittest.TestCase):
+
+    def colors(self, count, start=0):
+        # Una fila de count colores opacos distintos
+        data = numpy.zeros((1, count, 4), dtype=numpy.uint8)
+        data[0, :, 0] = numpy.arange(start, start + count)
+        data[0, :, 3] = 255
+        return data
+
+    def test_region_roundtrip(self):
+        pixelmap = IndexedPixelMap(8, 8)
+        data = self.colors(5)
+        pixelmap.set_region(2, 3, data)
+
+        numpy.testing.assert_array_equal(pixelmap.get_region(2, 3, 5, 1), data)
+        self.assertEqual(len(pixelmap.palette), 6)
+        self.assertEqual(pixelmap.get_pixel_index(1, 1), 0)
+
+    def test_palette_color_recolors_pixels(self):
+        pixelmap = IndexedPixelMap(4, 4)
+        pixelmap.set_region(1, 1, numpy.full((2, 2, 4), 255, dtype=numpy.uint8))
+
+        mask = pixelmap.replace_color((1, 1, 1, 1), (1, 0, 0, 1))
+
+        self.assertEqual(int(mask.sum()), 4)
+        numpy.testing.assert_array_equal(pixelmap.get_region(1, 1, 1, 1)[0, 0], [255, 0, 0, 255])
+        self.assertEqual(len(pixelmap.palette), 2)
+
+    def test_copy_on_write(self):
+        pixelmap = IndexedPixelMap(4, 4)
+        pixelmap.set_region(1, 1, self.colors(2))
+        copy = pixelmap.copy()
+
+        copy.set_region(1, 1, self.colors(1, 7))
+
+        self.assertEqual(pixelmap.get_region(1, 1, 1, 1)[0, 0, 0], 0)
+        self.assertEqual(copy.get_region(1, 1, 1, 1)[0, 0, 0], 7)
+
+    def test_too_many_colors(self):
+        # Si no entran en la paleta, se pasa a un PixelMap común
+        pixelmap = IndexedPixelMap(8, 1)
+        pixelmap.MAX_COLORS = 4
+        pixelmap.set_region(1, 1, self.colors(3))
+
+        data = self.colors(8, 10)
+        pixelmap.set_region(1, 1, data)
+
+        self.assertIs(type(pixelmap), PixelMap)
+        self.assertFalse(pixelmap.indexed)
+        numpy.testing.assert_array_equal(pixelmap.get_region(1, 1, 8, 1), data)
+
+
+if __name__ == "__main__":
+    unittest.main()
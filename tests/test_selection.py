@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import numpy
+
+from src.selection import Selection, SelectionMode, polygon_mask
+
+
+class PolygonMaskTestCase(unittest.TestCase):
+
+    def test_rectangle(self):
+        mask = polygon_mask([(2, 2), (5, 2), (5, 4), (2, 4)], 6, 5)
+
+        expected = numpy.zeros((5, 6), dtype=bool)
+        expected[1:4, 1:5] = True
+        numpy.testing.assert_array_equal(mask, expected)
+
+    def test_triangle_is_symmetric(self):
+        mask = polygon_mask([(1, 9), (9, 1), (17, 9)], 17, 9)
+
+        numpy.testing.assert_array_equal(mask, mask[:, ::-1])
+        self.assertTrue(mask[8].all())
+        self.assertEqual(mask[0].tolist().count(True), 1)
+
+    def test_self_intersecting(self):
+        # Con la regla par-impar, el centro de la estrella queda afuera
+        points = [(10, 1), (16, 19), (1, 7), (19, 7), (4, 19)]
+        mask = polygon_mask(points, 19, 19)
+
+        self.assertFalse(mask[10, 9])
+        self.assertTrue(mask[6, 9])
+
+    def test_clipped(self):
+        mask = polygon_mask([(-5, -5), (3, -5), (3, 3), (-5, 3)], 4, 4)
+
+        expected = numpy.zeros((4, 4), dtype=bool)
+        expected[:3, :3] = True
+        numpy.testing.assert_array_equal(mask, expected)
+
+
+class SelectionTestCase(unittest.TestCase):
+
+    def test_combine(self):
+        selection = Selection(6, 4)
+        selection.select_rectangle(1, 1, 4, 2)
+        selection.select_rectangle(3, 1, 4, 4, SelectionMode.UNION)
+        self.assertEqual(selection.get_bounds(), (1, 1, 6, 4))
+
+        selection.select_rectangle(3, 2, 2, 2, SelectionMode.SUBTRACT)
+        self.assertNotIn((3, 2), selection)
+        self.assertIn((2, 2), selection)
+
+        selection.select_rectangle(5, 1, 10, 10, SelectionMode.INTERSECT)
+        self.assertEqual(selection.get_bounds(), (5, 1, 2, 4))
+
+        selection.select_rectangle(7, 7, 2, 2)
+        self.assertTrue(selection.is_empty())
+        self.assertIsNone(selection.get_bounds())
+
+    def test_outline(self):
+        # Un cuadrado de 2x2 tiene cuatro lados, cada uno de un segmento
+        selection = Selection(4, 4)
+        selection.select_rectangle(2, 2, 2, 2)
+
+        self.assertEqual(sorted(selection.get_outline()),
+                         sorted([(1, 1, 3, 1), (1, 3, 3, 3), (1, 1, 1, 3), (3, 1, 3, 3)]))
+
+        # El contorno se vuelve a calcular después de un cambio
+        selection.set_pixel(4, 2)
+        self.assertEqual(len(selection.get_outline()), 6)
+
+    def test_translate(self):
+        selection = Selection(4, 4)
+        selection.select_rectangle(1, 1, 2, 2)
+        selection.translate(3, 1)
+
+        self.assertEqual(selection.get_bounds(), (4, 2, 1, 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import numpy
+
+from src.symmetry import Symmetry, SymmetryMode
+from src.utils import PaintAlgorithms
+
+
+class PartialSymmetry(Symmetry):
+
+    TABLE_BUDGET = 0
+
+
+class SymmetryTestCase(unittest.TestCase):
+
+    def place(self, width, height, copies):
+        # Las copias de map_mask juntas en una máscara del PixelMap
+        mask = numpy.zeros((height, width), dtype=bool)
+        for x, y, _mask in copies:
+            _height, _width = _mask.shape
+            mask[y - 1:y - 1 + _height, x - 1:x - 1 + _width] |= _mask
+
+        return mask
+
+    def test_mirrors(self):
+        mask = numpy.array([[1, 1, 0], [1, 0, 0]], dtype=bool)
+
+        vertical = Symmetry(10, 6, SymmetryMode.VERTICAL)
+        copies = self.place(10, 6, vertical.map_mask(2, 3, mask))
+        expected = numpy.zeros((6, 10), dtype=bool)
+        expected[2:4, 6:9] = mask[:, ::-1]
+        numpy.testing.assert_array_equal(copies, expected)
+
+        both = Symmetry(10, 6, SymmetryMode.BOTH)
+        self.assertEqual(len(both.map_mask(2, 3, mask)), 3)
+        self.assertEqual(both.map_points([(1, 1)]), [[(10, 1)], [(1, 6)], [(10, 6)]])
+
+    def test_radial(self):
+        # Cuatro copias de un píxel alrededor del centro de 8x8
+        symmetry = Symmetry(8, 8, SymmetryMode.RADIAL, folds=4)
+        pixel = numpy.ones((1, 1), dtype=bool)
+
+        mask = self.place(8, 8, symmetry.map_mask(2, 1, pixel))
+        mask[0, 1] = True
+
+        numpy.testing.assert_array_equal(mask, numpy.rot90(mask))
+        self.assertEqual(int(mask.sum()), 4)
+
+    def test_rotated_lines_have_no_gaps(self):
+        # Una línea girada 45 grados sigue conectada
+        symmetry = Symmetry(41, 41, SymmetryMode.RADIAL, folds=8)
+        line = numpy.ones((1, 15), dtype=bool)
+
+        copies = symmetry.map_mask(14, 5, line)
+        self.assertEqual(len(copies), 7)
+
+        for x, y, mask in copies:
+            ys, xs = numpy.nonzero(mask)
+            filled = PaintAlgorithms.flood_fill_mask(mask, [(xs[0], ys[0])], connectivity=8)
+            numpy.testing.assert_array_equal(filled, mask)
+
+    def test_partial_tables(self):
+        # Sin tablas precalculadas el resultado es el mismo
+        mask = numpy.random.RandomState(0).rand(7, 5) < 0.5
+        full = Symmetry(32, 24, SymmetryMode.RADIAL, center=(13, 11), folds=6)
+
+        partial = PartialSymmetry(32, 24, SymmetryMode.RADIAL, center=(13, 11), folds=6)
+
+        self.assertIsNone(partial._tables[0])
+        for a, b in zip(full.map_mask(9, 4, mask), partial.map_mask(9, 4, mask)):
+            self.assertEqual(a[:2], b[:2])
+            numpy.testing.assert_array_equal(a[2], b[2])
+
+    def test_outside(self):
+        symmetry = Symmetry(8, 8, SymmetryMode.VERTICAL, center=(1, 4))
+        self.assertEqual(symmetry.map_mask(7, 1, numpy.ones((2, 2), dtype=bool)), [])
+
+
+if __name__ == "__main__":
+    unittest.main()